@@ -1,9 +1,13 @@
-import anthropic
-from agent.llm_utils import pil_to_b64
+from agent.image_pipeline import ImagePipeline
+from agent.telemetry import AgentTelemetry
+from agent.conversation_store import ConversationStore
+from agent.llm_client import LLMClient, get_anthropic_client
+from agent.streaming import StreamTimer
 from utils.VNCClient import VNCClient_SSH
 from utils.log import print_message
+from utils.artifact_writer import get_artifact_writer
+from utils.timing import timed_sleep
 from utils.timeout import timeout
-import time
 import os
 import json
 from typing import cast
@@ -34,6 +38,9 @@ class ClaudeComputerUseAgent:
         only_n_most_recent_images: int,
         system_prompt: str,
         remote_client: VNCClient_SSH,
+        image_pipeline: ImagePipeline = None,
+        stream: bool = False,
+        image_eviction_chunk: int = 1,
     ):
         self.model = model
         self.betas = betas
@@ -42,56 +49,183 @@ class ClaudeComputerUseAgent:
         self.display_height = display_height
         self.only_n_most_recent_images = only_n_most_recent_images
         self.system_prompt = system_prompt
+        # Tools and system prompt form the stable prefix of every request; mark it for prompt caching
+        self.system_blocks = None if system_prompt is None else [
+            {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+        ]
+        self.image_pipeline = image_pipeline if image_pipeline is not None else ImagePipeline()
+        self.stream = stream
 
-        self.messages = []
+        # Screenshots beyond the most recent `only_n_most_recent_images` are dropped from tool results
+        self.conversation = ConversationStore(max_images = only_n_most_recent_images, eviction_chunk = image_eviction_chunk)
+        self.messages = self.conversation.messages
+        self.cache_breakpoint_blocks = []
         self.token_usage = []
         self.total_input_tokens = 0
         self.total_output_tokens = 0
+        self.stream_stats = []
+
+        # The model sees (and predicts coordinates on) screenshots at the pipeline's payload resolution
+        tool_display_width, tool_display_height = self.image_pipeline.payload_size(self.display_width, self.display_height)
 
-        self.client = anthropic.Anthropic()
+        self.client = get_anthropic_client()
+        self.llm_client = LLMClient('anthropic', api_key=os.environ.get("ANTHROPIC_API_KEY"))
+        self.telemetry = AgentTelemetry(self.model, self.llm_client, self.image_pipeline)
         self.tools = [
             {
                 "type": "computer_20250124",
                 "name": "computer",
-                "display_width_px": self.display_width,
-                "display_height_px": self.display_height,
+                "display_width_px": tool_display_width,
+                "display_height_px": tool_display_height,
                 "display_number": 1,
             }
         ]
 
         self.remote_client = remote_client
 
+    def place_cache_breakpoints(self, n_breakpoints: int = 3):
+        """
+        Put `cache_control` on the last block of the `n_breakpoints` most recent user turns, moving the marks set
+        for the previous request. Each request then reads the prefix cached by the one before and writes a longer one.
+        Anthropic allows four breakpoints per request; one is taken by the system prompt.
+        """
+        for block in self.cache_breakpoint_blocks:
+            block.pop('cache_control', None)
+        self.cache_breakpoint_blocks = []
+        for message in reversed(self.messages):
+            if len(self.cache_breakpoint_blocks) >= n_breakpoints:
+                break
+            if message['role'] == 'user' and isinstance(message['content'], list) and len(message['content']) > 0:
+                block = message['content'][-1]
+                block['cache_control'] = {"type": "ephemeral"}
+                self.cache_breakpoint_blocks.append(block)
+
     def call_agent(self, step_index: int):
+        self.place_cache_breakpoints()
         if self.system_prompt is None:
-            response = self.client.beta.messages.create(
+            response = self.llm_client.call(
+                self.client.beta.messages.create,
                 model = self.model,
                 max_tokens = self.max_tokens,
                 tools = self.tools,
                 messages = self.messages,
-                betas = self.betas
+                betas = self.betas,
+                timeout_kwarg = 'timeout'
             )
         else:
-            response = self.client.beta.messages.create(
+            response = self.llm_client.call(
+                self.client.beta.messages.create,
                 model = self.model,
                 max_tokens = self.max_tokens,
                 tools = self.tools,
                 messages = self.messages,
-                system = self.system_prompt,
-                betas = self.betas
+                system = self.system_blocks,
+                betas = self.betas,
+                timeout_kwarg = 'timeout'
             )
 
         # Count token usage
+        self.record_token_usage(step_index, response.usage)
+        return response
+
+    def record_token_usage(self, step_index: int, usage):
+        # `input_tokens` excludes the prompt tokens read from or written to the prompt cache
+        cache_read_input_tokens = getattr(usage, 'cache_read_input_tokens', None) or 0
+        cache_creation_input_tokens = getattr(usage, 'cache_creation_input_tokens', None) or 0
         self.token_usage.append(
             {
                 "step": step_index,
-                "input_tokens": response.usage.input_tokens,
-                "output_tokens": response.usage.output_tokens
+                "input_tokens": usage.input_tokens,
+                "cache_read_input_tokens": cache_read_input_tokens,
+                "cache_creation_input_tokens": cache_creation_input_tokens,
+                "output_tokens": usage.output_tokens
             }
         )
-        self.total_input_tokens += response.usage.input_tokens
-        self.total_output_tokens += response.usage.input_tokens
-        return response
+        self.total_input_tokens += usage.input_tokens
+        self.total_output_tokens += usage.output_tokens
+        self.telemetry.record_usage(
+            prompt_tokens = usage.input_tokens + cache_read_input_tokens + cache_creation_input_tokens,
+            completion_tokens = usage.output_tokens,
+            cached_prompt_tokens = cache_read_input_tokens,
+            cache_write_tokens = cache_creation_input_tokens
+        )
+
+    def stream_and_execute(self, step_index: int, save_dir: str):
+        """
+        Streaming counterpart of `call_agent` + actuation.
+        Each tool_use block is executed as soon as it has fully streamed in, while the model is still generating.
+
+        Returns (response, tool_result_message_blocks, stream_timing).
+        """
+        if self.llm_client.cache is not None:
+            # The model cache stores whole messages; execute the tool_use blocks once the message is complete
+            timer = StreamTimer()
+            response = self.call_agent(step_index)
+            timer.mark_token()
+            tool_result_message_blocks = []
+            for block in response.content:
+                if block.type == "tool_use":
+                    timer.mark_action()
+                    tool_result_message_blocks.append(self.handle_tool_use(block, step_index, save_dir))
+            timer.finish()
+            return response, tool_result_message_blocks, timer.to_dict()
+
+        self.place_cache_breakpoints()
+        request_kwargs = dict(
+            model = self.model,
+            max_tokens = self.max_tokens,
+            tools = self.tools,
+            messages = self.messages,
+            betas = self.betas,
+            timeout = self.llm_client.request_timeout_seconds
+        )
+        if self.system_prompt is not None:
+            request_kwargs['system'] = self.system_blocks
+        stream_manager = self.client.beta.messages.stream(**request_kwargs)
+
+        timer = StreamTimer()
+        tool_result_message_blocks = []
+        # Entering the manager sends the request, so it is what gets retried
+        stream = self.llm_client.call(stream_manager.__enter__)
+        try:
+            for event in stream:
+                if event.type == 'content_block_delta':
+                    timer.mark_token()
+                elif event.type == 'content_block_stop' and event.content_block.type == 'tool_use':
+                    timer.mark_action()
+                    tool_result_message_blocks.append(self.handle_tool_use(event.content_block, step_index, save_dir))
+            response = stream.get_final_message()
+        finally:
+            stream_manager.__exit__(None, None, None)
+        timer.finish()
+
+        # Count token usage
+        self.record_token_usage(step_index, response.usage)
+        return response, tool_result_message_blocks, timer.to_dict()
+
+    def handle_tool_use(self, block, current_step: int, save_dir: str):
+        """Execute a tool_use block; returns the tool_result message block."""
+        status, tool_result_content, current_screenshot = self.execute_action(block.input)
+        tool_result_message_block = self.tool_result_to_params(
+            tool_use_id = block.id,
+            status = status,
+            tool_result_content = tool_result_content
+        )
+        tool_result = tool_result_message_block['content'][0]
+        for item in tool_result['content']:
+            if item['type'] == 'image':
+                self.conversation.track_image(tool_result_message_block, tool_result['content'], item)
+
+        # Save screenshot
+        if current_screenshot is not None:
+            get_artifact_writer().save_image(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'), current_screenshot)
+
+        return tool_result_message_block
     
+    def move_to_pixel(self, x, y):
+        """Move the cursor to pixel coordinates predicted on the payload image."""
+        self.remote_client.move_to_pixel(*self.image_pipeline.to_screen_pixel(x, y))
+
     def execute_action(self, action_dict: dict):
         """
         Execute an action based on the input dictionary.
@@ -156,7 +290,7 @@ class ClaudeComputerUseAgent:
             coordinate = action_dict.get("coordinate")
             if coordinate and len(coordinate) == 2:
                 x, y = coordinate
-                self.remote_client.move_to_pixel(x, y)
+                self.move_to_pixel(x, y)
                 return True, [{"type": "text", "text": "Tool executed successfully"}], None
             else:
                 print(f"Error parsing action dict `{action_dict}`: 'coordinate' parameter is required for mouse_move.")
@@ -183,7 +317,7 @@ class ClaudeComputerUseAgent:
             # Move cursor
             if coordinate and len(coordinate) == 2:
                 x, y = coordinate
-                self.remote_client.move_to_pixel(x, y)
+                self.move_to_pixel(x, y)
 
             # Click
             self.remote_client.left_click()
@@ -201,12 +335,12 @@ class ClaudeComputerUseAgent:
                 coordinate and len(coordinate) == 2):
                 # Move to the starting coordinate.
                 x0, y0 = start_coordinate
-                self.remote_client.move_to_pixel(x0, y0)
+                self.move_to_pixel(x0, y0)
                 # Press and hold the left mouse button.
                 self.remote_client.mouse_down("left")
                 # Move to the destination coordinate.
                 x1, y1 = coordinate
-                self.remote_client.move_to_pixel(x1, y1)
+                self.move_to_pixel(x1, y1)
                 # Release the mouse button.
                 self.remote_client.mouse_up("left")
                 return True, [{"type": "text", "text": "Tool executed successfully"}], None
@@ -218,7 +352,7 @@ class ClaudeComputerUseAgent:
             coordinate = action_dict.get("coordinate")
             if coordinate and len(coordinate) == 2:
                 x, y = coordinate
-                self.remote_client.move_to_pixel(x, y)
+                self.move_to_pixel(x, y)
             self.remote_client.right_click()
             return True, [{"type": "text", "text": "Tool executed successfully"}], None
         
@@ -226,7 +360,7 @@ class ClaudeComputerUseAgent:
             coordinate = action_dict.get("coordinate")
             if coordinate and len(coordinate) == 2:
                 x, y = coordinate
-                self.remote_client.move_to_pixel(x, y)
+                self.move_to_pixel(x, y)
             self.remote_client.middle_click()
             return True, [{"type": "text", "text": "Tool executed successfully"}], None
         
@@ -234,7 +368,7 @@ class ClaudeComputerUseAgent:
             coordinate = action_dict.get("coordinate")
             if coordinate and len(coordinate) == 2:
                 x, y = coordinate
-                self.remote_client.move_to_pixel(x, y)
+                self.move_to_pixel(x, y)
             self.remote_client.double_click()
             return True, [{"type": "text", "text": "Tool executed successfully"}], None
         
@@ -243,7 +377,7 @@ class ClaudeComputerUseAgent:
             coordinate = action_dict.get("coordinate")
             if coordinate and len(coordinate) == 2:
                 x, y = coordinate
-                self.remote_client.move_to_pixel(x, y)
+                self.move_to_pixel(x, y)
             self.remote_client.triple_click()
             return True, [{"type": "text", "text": "Tool executed successfully"}], None
         
@@ -258,7 +392,7 @@ class ClaudeComputerUseAgent:
                 coordinate = action_dict.get("coordinate")
                 if coordinate and len(coordinate) == 2:
                     x, y = coordinate
-                    self.remote_client.move_to_pixel(x, y)
+                    self.move_to_pixel(x, y)
                 if scroll_direction == "up":
                     self.remote_client.scroll_up(scroll_amount, by_pixel=True)
                     return True, [{"type": "text", "text": "Tool executed successfully"}], None
@@ -281,7 +415,7 @@ class ClaudeComputerUseAgent:
                 print(f"Error parsing action dict `{action_dict}`: 'duration' is required for wait.")
                 return False, None, None
             else:
-                time.sleep(duration)
+                timed_sleep(duration, 'wait_action')
                 return True, [{"type": "text", "text": "Tool executed successfully"}], None
         
         elif action == "screenshot":
@@ -294,8 +428,8 @@ class ClaudeComputerUseAgent:
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/png",
-                            "data": pil_to_b64(image, add_prefix=False)
+                            "media_type": self.image_pipeline.mime_type,
+                            "data": self.image_pipeline.to_b64(image, add_prefix=False)
                         }
                     }
                 ], image
@@ -342,21 +476,6 @@ class ClaudeComputerUseAgent:
             ]
         }
     
-    def filter_to_n_most_recent_images(self, n: int):
-        # The function would only consider images within tool_result blocks
-        for message_index in range(len(self.messages) - 1, -1, -1):
-            if self.messages[message_index]['role'] == 'user':
-                for message_content_index in range(len(self.messages[message_index]['content']) - 1, -1, -1):
-                    if isinstance(self.messages[message_index]['content'], list):
-                        if self.messages[message_index]['content'][message_content_index]['type'] == 'tool_result':
-                            for message_content_content_index in range(len(self.messages[message_index]['content'][message_content_index]['content']) - 1, -1, -1):
-                                if self.messages[message_index]['content'][message_content_index]['content'][message_content_content_index]['type'] == 'image':
-                                    if n > 0:
-                                        n -= 1
-                                    else:
-                                        # Remove item `messages[message_index]['content'][message_content_index]['content'][message_content_content_index]` from the list `messages[message_index]['content'][message_content_index]['content']` 
-                                        del self.messages[message_index]['content'][message_content_index]['content'][message_content_content_index]
-
     def step(
         self,
 
@@ -383,51 +502,55 @@ class ClaudeComputerUseAgent:
             }
             self.messages.append(task_block)
 
-        if self.only_n_most_recent_images > 0:
-            self.filter_to_n_most_recent_images(self.only_n_most_recent_images)
-
-        # [Step 2] Agent prediction
-        print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent...')
+        if self.stream:
+            # [Step 2 + 3] Agent prediction and actuation, overlapped
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent and actuating streamed actions...')
 
-        response = self.call_agent(current_step)
-        agent_response_block = {
-            "role": "assistant",
-            "content": self._response_to_params(response)
-        }
-        self.messages.append(agent_response_block)
+            response, tool_result_message_blocks, stream_timing = self.stream_and_execute(current_step, save_dir)
+            self.stream_stats.append({"step": current_step, **stream_timing})
+            agent_response_block = {
+                "role": "assistant",
+                "content": self._response_to_params(response)
+            }
+            self.messages.append(agent_response_block)
+            self.messages += tool_result_message_blocks
 
-        # [Step 3] Acutation
+        else:
+            # [Step 2] Agent prediction
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent...')
 
-        print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Actuating...')
+            response = self.call_agent(current_step)
+            agent_response_block = {
+                "role": "assistant",
+                "content": self._response_to_params(response)
+            }
+            self.messages.append(agent_response_block)
 
-        response_content = response.content
+            # [Step 3] Acutation
 
-        for block in response_content:
-            if block.type == "tool_use":
-                # Perform actions
-                status, tool_result_content, current_screenshot = self.execute_action(block.input)
-                tool_result_message_block = self.tool_result_to_params(
-                    tool_use_id = block.id,
-                    status = status,
-                    tool_result_content = tool_result_content
-                )
-                self.messages.append(tool_result_message_block)
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Actuating...')
 
-                # Save screenshot
-                if current_screenshot is not None:
-                    current_screenshot.save(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'))
+            for block in response.content:
+                if block.type == "tool_use":
+                    # Perform actions
+                    self.messages.append(self.handle_tool_use(block, current_step, save_dir))
 
-            elif block.type == 'text':
+        for block in response.content:
+            if block.type == 'text':
                 if "```DONE```" in block.text:
                     step_status = "done"
                 elif "```FAIL```" in block.text:
                     step_status = "fail"
+
+        # Close this step's telemetry record (tokens, images, model calls, cost)
+        self.telemetry.end_step(current_step)
         
         return step_status
     
     def save_conversation_history(self, save_dir: str):
-        # Remove all images before saving chat log
-        self.filter_to_n_most_recent_images(0)
+        # Remove all images and cache breakpoints before saving chat log
+        self.conversation.evict_all()
+        self.place_cache_breakpoints(0)
         
         file = os.path.join(save_dir, 'context', 'chat_log.json')
         with open(file, "w") as json_file:
@@ -439,4 +562,15 @@ class ClaudeComputerUseAgent:
         })
         file = os.path.join(save_dir, 'context', 'token_usage.json')
         with open(file, "w") as json_file:
-            json.dump(self.token_usage, json_file)
\ No newline at end of file
+            json.dump(self.token_usage, json_file)
+
+        self.telemetry.save(save_dir)
+
+        file = os.path.join(save_dir, 'context', 'llm_calls.json')
+        with open(file, "w") as json_file:
+            json.dump(self.llm_client.pop_records(), json_file)
+
+        if self.stream:
+            file = os.path.join(save_dir, 'context', 'stream_stats.json')
+            with open(file, "w") as json_file:
+                json.dump(self.stream_stats, json_file)
\ No newline at end of file
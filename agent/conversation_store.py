@@ -0,0 +1,69 @@
+from collections import deque
+
+class ConversationStore:
+    """
+    Provider-format message history whose screenshots are kept in a bounded ring.
+
+    `messages` is the list sent to the model, so it can be passed to the SDK without further processing.
+    Every image placed in a message is registered with `track_image`. Once more than `max_images` images are
+    registered, the oldest is evicted where it sits:
+      - with a `placeholder` (a dict of fields), the image item is updated in place with those fields;
+      - otherwise the item is removed from its content list, and with `drop_empty_messages` the message itself
+        is dropped once its content is empty.
+
+    Each step therefore only touches the images that fall out of the window, instead of rescanning the whole
+    history. Evicted items are located by identity, and they are always the oldest, so lookups stop early.
+
+    Every eviction rewrites the history from the evicted image onwards, which invalidates provider prompt caches
+    from that point. With `eviction_chunk` = k > 1, images are evicted k at a time once k extra images have
+    accumulated, so the window holds between `max_images` and `max_images + k - 1` images and the prefix stays
+    unchanged for k - 1 steps out of k.
+    """
+    def __init__(self, max_images: int = None, placeholder: dict = None, drop_empty_messages: bool = False, eviction_chunk: int = 1):
+        # `max_images` of None or <= 0 keeps every image
+        self.max_images = max_images if max_images is not None and max_images > 0 else None
+        self.placeholder = placeholder
+        self.drop_empty_messages = drop_empty_messages
+        self.eviction_chunk = max(1, eviction_chunk)
+
+        self.messages = []
+        self.ring = deque()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, message: dict):
+        self.messages.append(message)
+        return message
+
+    def extend(self, messages: list):
+        self.messages.extend(messages)
+
+    def track_image(self, message: dict, content: list, item: dict):
+        """
+        Register image `item`, held in the `content` list of `message`. Evicts the oldest image if the ring is full.
+        `content` may be None when a placeholder is used, as the item is then updated rather than removed.
+        """
+        self.ring.append((message, content, item))
+        if self.max_images is not None and len(self.ring) - self.max_images >= self.eviction_chunk:
+            while len(self.ring) > self.max_images:
+                self._evict(*self.ring.popleft())
+
+    def evict_all(self):
+        """Evict every tracked image, e.g. before dumping the chat log."""
+        while self.ring:
+            self._evict(*self.ring.popleft())
+
+    def _evict(self, message: dict, content: list, item: dict):
+        if self.placeholder is not None:
+            item.update(self.placeholder)
+            return
+        for index, candidate in enumerate(content):
+            if candidate is item:
+                del content[index]
+                break
+        if self.drop_empty_messages and len(content) == 0:
+            for index, candidate in enumerate(self.messages):
+                if candidate is message:
+                    del self.messages[index]
+                    break
@@ -1,4 +1,3 @@
-import time
 from typing import Any
 
 from PIL import Image
@@ -19,7 +18,13 @@ from vertexai.preview.generative_models import (
 
 from utils.VNCClient import VNCClient_SSH
 from utils.log import print_message
+from utils.artifact_writer import get_artifact_writer
+from utils.timing import timed_sleep
 from utils.timeout import timeout
+from agent.image_pipeline import ImagePipeline
+from agent.telemetry import AgentTelemetry
+from agent.llm_client import LLMClient
+from agent.streaming import open_stream, StreamTimer, IncrementalActionDispatcher
 
 
 
@@ -119,7 +124,9 @@ GEMINI_SAFETY_CONFIG = {
     HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
 }
 
-def pil_to_vertex(img: Image.Image) -> str:
+def pil_to_vertex(img: Image.Image, image_pipeline: ImagePipeline = None) -> str:
+    if image_pipeline is not None:
+        return VertexImage.from_bytes(image_pipeline.encode(img))
     with BytesIO() as image_buffer:
         img.save(image_buffer, format="PNG")
         byte_data = image_buffer.getvalue()
@@ -137,8 +144,11 @@ class Gemini_General_Agent:
         top_p: float,
         temperature: float,
         safety_config: dict,
+        image_pipeline: ImagePipeline = None,
+        stream: bool = False,
     ):
         self.prompt_client = GenerativeModel(model)
+        self.llm_client = LLMClient('gemini', model=model)
         self.safety_config = safety_config
         self.system_prompt = system_prompt
         self.remote_client = remote_client
@@ -147,6 +157,8 @@ class Gemini_General_Agent:
         self.only_n_most_recent_images = only_n_most_recent_images
         self.top_p = top_p
         self.temperature = temperature
+        self.image_pipeline = image_pipeline if image_pipeline is not None else ImagePipeline()
+        self.stream = stream
         
         self.messages = None
         self.screenshots = []
@@ -154,6 +166,8 @@ class Gemini_General_Agent:
         self.token_usage = []
         self.total_prompt_tokens = 0
         self.total_candidates_tokens = 0
+        self.telemetry = AgentTelemetry(model, self.llm_client, self.image_pipeline)
+        self.stream_stats = []
 
     def construct_user_prompt(self, task: str, screenshots: list):
         if len(screenshots) == 0:
@@ -175,7 +189,8 @@ class Gemini_General_Agent:
     def call_agent(self, task: str):
         prompt = self.construct_user_prompt(task = task, screenshots = self.screenshots)
 
-        response = self.prompt_client.generate_content(
+        response = self.llm_client.call(
+            self.prompt_client.generate_content,
             prompt,
             generation_config=dict(
                 candidate_count=1,
@@ -187,17 +202,71 @@ class Gemini_General_Agent:
         )
 
         # Count token usage
+        self.record_token_usage(response.usage_metadata)
+
+        response_text = response.candidates[0].content.parts[0].text
+        return response_text
+
+    def record_token_usage(self, usage_metadata):
         self.token_usage.append(
             {
-                "prompt_token_count": response.usage_metadata.prompt_token_count,
-                "candidates_token_count": response.usage_metadata.candidates_token_count
+                "prompt_token_count": usage_metadata.prompt_token_count,
+                "candidates_token_count": usage_metadata.candidates_token_count
             }
         )
-        self.total_prompt_tokens += response.usage_metadata.prompt_token_count
-        self.total_candidates_tokens += response.usage_metadata.candidates_token_count
+        self.total_prompt_tokens += usage_metadata.prompt_token_count
+        self.total_candidates_tokens += usage_metadata.candidates_token_count
+        self.telemetry.record_usage(
+            usage_metadata.prompt_token_count,
+            usage_metadata.candidates_token_count,
+            getattr(usage_metadata, 'cached_content_token_count', 0)
+        )
 
-        response_text = response.candidates[0].content.parts[0].text
-        return response_text
+    def stream_and_execute(self, task: str):
+        """
+        Streaming counterpart of `call_agent` + `parse_agent_output` + `execute_actions`.
+        Each action is executed as soon as its line has streamed in, while the model is still generating.
+
+        Returns (raw_response, status, parsed_actions, stream_timing).
+        """
+        prompt = self.construct_user_prompt(task = task, screenshots = self.screenshots)
+
+        timer = StreamTimer()
+        dispatcher = IncrementalActionDispatcher(
+            parse_fn = self.parse_agent_output,
+            execute_fn = lambda actions: self.execute_actions(actions)[0],
+            timer = timer
+        )
+        stream = open_stream(
+            self.llm_client,
+            self.prompt_client.generate_content,
+            prompt,
+            generation_config=dict(
+                candidate_count=1,
+                max_output_tokens=self.max_tokens,
+                top_p=self.top_p,
+                temperature=self.temperature,
+            ),
+            safety_settings=self.safety_config,
+            stream=True,
+        )
+        usage_metadata = None
+        try:
+            for chunk in stream:
+                # Usage is cumulative; the last chunk that carries it holds the totals
+                if chunk.usage_metadata is not None and chunk.usage_metadata.prompt_token_count:
+                    usage_metadata = chunk.usage_metadata
+                if chunk.candidates and chunk.candidates[0].content.parts:
+                    dispatcher.feed(chunk.candidates[0].content.parts[0].text)
+                if dispatcher.finished:
+                    break
+        finally:
+            stream.close()
+        if usage_metadata is not None:
+            self.record_token_usage(usage_metadata)
+
+        response_text, status, parsed_actions = dispatcher.close()
+        return response_text, status, parsed_actions, timer.to_dict()
     
     def parse_agent_output(self, agent_output):
         """
@@ -334,7 +403,7 @@ class Gemini_General_Agent:
         status = "unfinished"
         for action in actions:
             act = action.get("action")
-            time.sleep(self.remote_client.action_interval_seconds)
+            timed_sleep(self.remote_client.action_interval_seconds, 'action_interval')
             if act == "move_to":
                 self.remote_client.move_to(action["x"], action["y"])
             elif act == "mouse_down":
@@ -366,7 +435,7 @@ class Gemini_General_Agent:
             elif act == "key_press":
                 self.remote_client.key_press(action["key"])
             elif act == "wait":
-                time.sleep(action["seconds"])
+                timed_sleep(action["seconds"], 'wait_action')
             elif act == "fail":
                 status = "fail"
                 return status, actions
@@ -392,31 +461,47 @@ class Gemini_General_Agent:
         # Capture screenshot
         print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Capturing screenshot...')
         current_screenshot = self.remote_client.capture_screenshot()
-        self.screenshots.append(pil_to_vertex(current_screenshot))
+        self.screenshots.append(pil_to_vertex(current_screenshot, self.image_pipeline))
         if self.only_n_most_recent_images > 0:
             self.screenshots = self.screenshots[-self.only_n_most_recent_images:]
         
-        # Prediction
-        print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent...')
-        raw_response = self.call_agent(task = task)
-
-        # Action
-        print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Actuating...')
-        parsed_actions = self.parse_agent_output(raw_response)
-        status, _ = self.execute_actions(parsed_actions)
+        if self.stream:
+            # Prediction and action, overlapped
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent and actuating streamed actions...')
+            raw_response, status, parsed_actions, stream_timing = self.stream_and_execute(task = task)
+            self.stream_stats.append({"step": current_step, **stream_timing})
+        else:
+            # Prediction
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent...')
+            raw_response = self.call_agent(task = task)
+
+            # Action
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Actuating...')
+            parsed_actions = self.parse_agent_output(raw_response)
+            status, _ = self.execute_actions(parsed_actions)
 
         # Save current_screenshot
-        current_screenshot.save(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'))
+        get_artifact_writer().save_image(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'), current_screenshot)
 
         # Save raw_response
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), 'w') as f:
-            f.write(raw_response)
+        get_artifact_writer().write_text(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), raw_response)
 
         # Dump parsed_actions
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_parsed_actions.json'), 'w') as f:
-            json.dump(parsed_actions, f, indent=4)
+        get_artifact_writer().write_json(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_parsed_actions.json'), parsed_actions, indent=4)
+
+        # Close this step's telemetry record (tokens, images, model calls, cost)
+        self.telemetry.end_step(current_step)
 
         return status
     
     def save_conversation_history(self, save_dir: str):
-        pass
\ No newline at end of file
+        self.telemetry.save(save_dir)
+
+        file = os.path.join(save_dir, 'context', 'llm_calls.json')
+        with open(file, "w") as json_file:
+            json.dump(self.llm_client.pop_records(), json_file)
+
+        if self.stream:
+            file = os.path.join(save_dir, 'context', 'stream_stats.json')
+            with open(file, "w") as json_file:
+                json.dump(self.stream_stats, json_file)
\ No newline at end of file
@@ -1,6 +1,10 @@
 from constants import SCREEN_WIDTH, SCREEN_HEIGHT
 
-def get_gui_agent(gui_agent_name, remote_client):
+def get_gui_agent(gui_agent_name, remote_client, image_pipeline = None, stream = False, image_eviction_chunk = 1):
+    # `image_pipeline` (agent.image_pipeline.ImagePipeline) controls how screenshots are encoded for API-based agents;
+    # None keeps lossless PNG at native resolution.
+    # `stream` lets agents that support it execute actions while the response is still being generated.
+    # `image_eviction_chunk` > 1 lets Claude and UI-TARS drop old screenshots in batches to keep the prompt cache warm
     if "gpt" in gui_agent_name and "/omniparser" in gui_agent_name:
         from agent.openai_omniparser import OpenAI_OmniParser_Agent, GPT_OMNIPARSER_SYSTEM_PROMPT
         return OpenAI_OmniParser_Agent(
@@ -10,7 +14,9 @@ def get_gui_agent(gui_agent_name, remote_client):
             screenshot_rolling_window = 3,
             top_p = 0.9,
             temperature = 1.0,
-            device = 'cuda'
+            device = 'cpu' if gui_agent_name.endswith('/omniparser-cpu') else 'cuda',
+            image_pipeline = image_pipeline,
+            stream = stream
         )
     elif "openai/computer-use-preview" in gui_agent_name:
         from agent.openai_cua import OpenAI_CUA, CUA_SYSTEM_PROMPT
@@ -20,7 +26,8 @@ def get_gui_agent(gui_agent_name, remote_client):
             remote_client = remote_client,
             only_n_most_recent_images = 3,
             top_p = 0.9,
-            temperature = 1.0
+            temperature = 1.0,
+            image_pipeline = image_pipeline
         )
     elif "gpt" in gui_agent_name:
         from agent.openai import OpenAI_General_Agent, GPT_SYSTEM_PROMPT
@@ -30,7 +37,9 @@ def get_gui_agent(gui_agent_name, remote_client):
             remote_client = remote_client,
             screenshot_rolling_window = 3,
             top_p = 0.9,
-            temperature = 1.0
+            temperature = 1.0,
+            image_pipeline = image_pipeline,
+            stream = stream
         )
     elif "claude-3-7-sonnet-20250219" in gui_agent_name and "computer-use-2025-01-24" in gui_agent_name:
         from agent.anthropic import ClaudeComputerUseAgent, CLAUDE_CUA_SYSTEM_PROMPT
@@ -42,7 +51,10 @@ def get_gui_agent(gui_agent_name, remote_client):
             display_height = SCREEN_HEIGHT,
             only_n_most_recent_images = 3,
             system_prompt = CLAUDE_CUA_SYSTEM_PROMPT,
-            remote_client = remote_client
+            remote_client = remote_client,
+            image_pipeline = image_pipeline,
+            stream = stream,
+            image_eviction_chunk = image_eviction_chunk
         )
     elif "UI-TARS-7B-DPO" in gui_agent_name:
         from agent.uitars import UITARS_GUI_AGENT, UITARS_COMPUTER_SYSTEM_PROMPT
@@ -54,7 +66,10 @@ def get_gui_agent(gui_agent_name, remote_client):
             only_n_most_recent_images = 3,
             max_tokens = 12800,
             top_p = 0.9,
-            temperature = 1.0
+            temperature = 1.0,
+            image_pipeline = image_pipeline,
+            stream = stream,
+            image_eviction_chunk = image_eviction_chunk
         )
     elif "showlab/ShowUI-2B" in gui_agent_name:
         from agent.showui import ShowUI_Agent, _NAV_SYSTEM, _NAV_FORMAT
@@ -75,6 +90,8 @@ def get_gui_agent(gui_agent_name, remote_client):
             max_tokens = 12800,
             top_p = 0.9,
             temperature = 1.0,
-            safety_config = GEMINI_SAFETY_CONFIG
+            safety_config = GEMINI_SAFETY_CONFIG,
+            image_pipeline = image_pipeline,
+            stream = stream
         )
     raise NotImplementedError(f'Agent "{gui_agent_name}" not implemented')
\ No newline at end of file
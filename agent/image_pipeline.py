@@ -0,0 +1,169 @@
+import time
+import base64
+from io import BytesIO
+from PIL import Image
+
+from constants import SCREEN_WIDTH, SCREEN_HEIGHT
+
+IMAGE_MIME_TYPES = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+}
+
+class ImagePipeline:
+    """
+    Turns screenshots into image payloads for model requests.
+
+    The default configuration (lossless PNG at native resolution, `"detail": "high"`) reproduces the
+    payloads the agents have always sent. Other settings trade image fidelity for request size:
+
+      format (str):              'png', 'jpeg' or 'webp'
+      quality (int):             JPEG/WebP quality (1-100); ignored for PNG
+      png_compress_level (int):  zlib level for PNG (0-9)
+      max_edge (int):            downscale so that the longer edge is at most `max_edge` pixels
+      grayscale (bool):          convert to single-channel grayscale before encoding
+      detail (str):              OpenAI `image_url.detail` value
+
+    When `max_edge` downscales the screenshot, pixel coordinates predicted by the model are in the
+    payload's coordinate system. `to_screen_pixel` maps them back onto the remote screen.
+
+    Each encode is timed and measured; `pop_step_stats` returns the totals accumulated since the last call.
+    """
+    def __init__(
+        self,
+        format: str = 'png',
+        quality: int = None,
+        png_compress_level: int = 6,
+        max_edge: int = None,
+        grayscale: bool = False,
+        detail: str = 'high',
+    ):
+        format = format.lower()
+        if format == 'jpg':
+            format = 'jpeg'
+        if format not in IMAGE_MIME_TYPES:
+            raise ValueError(f'Unsupported image format "{format}". Choose from {list(IMAGE_MIME_TYPES.keys())}.')
+        if max_edge is not None and max_edge <= 0:
+            raise ValueError(f'`max_edge` should be a positive integer; got {max_edge}.')
+
+        self.format = format
+        self.quality = quality
+        self.png_compress_level = png_compress_level
+        self.max_edge = max_edge
+        self.grayscale = grayscale
+        self.detail = detail
+
+        # Size of the most recent screenshot before resizing; used for coordinate back-mapping
+        self.source_size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+
+        self._pending_count = 0
+        self._pending_bytes = 0
+        self._pending_seconds = 0.0
+
+    @classmethod
+    def from_spec(cls, spec: str):
+        """
+        Build a pipeline from a compact string, e.g. `jpeg,quality=85,max_edge=1280,grayscale`.
+
+        The first token may name the format. Other tokens are `key=value` pairs or bare boolean flags.
+        An empty or None spec returns the default (lossless) pipeline.
+        """
+        if spec is None or spec.strip() == '':
+            return cls()
+        kwargs = {}
+        for index, token in enumerate(spec.split(',')):
+            token = token.strip()
+            if not token:
+                continue
+            if '=' in token:
+                key, value = [part.strip() for part in token.split('=', 1)]
+            elif index == 0 and token.lower() in list(IMAGE_MIME_TYPES.keys()) + ['jpg']:
+                key, value = 'format', token
+            else:
+                key, value = token, 'true'
+
+            if key in ['quality', 'png_compress_level', 'max_edge']:
+                kwargs[key] = int(value)
+            elif key == 'grayscale':
+                kwargs[key] = value.lower() in ['1', 'true', 'yes']
+            elif key in ['format', 'detail']:
+                kwargs[key] = value
+            else:
+                raise ValueError(f'Unknown image pipeline option "{key}" in "{spec}".')
+        return cls(**kwargs)
+
+    def __repr__(self):
+        return (f'ImagePipeline(format={self.format}, quality={self.quality}, png_compress_level={self.png_compress_level}, '
+                f'max_edge={self.max_edge}, grayscale={self.grayscale}, detail={self.detail})')
+
+    @property
+    def mime_type(self) -> str:
+        return IMAGE_MIME_TYPES[self.format]
+
+    def payload_size(self, width: int, height: int):
+        """Return the (width, height) of the payload for a screenshot of the given size."""
+        if self.max_edge is None or max(width, height) <= self.max_edge:
+            return width, height
+        scale = self.max_edge / max(width, height)
+        return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+    def prepare(self, img: Image.Image) -> Image.Image:
+        """Apply resizing and colour conversion; returns the image that will be encoded."""
+        self.source_size = img.size
+        target_size = self.payload_size(*img.size)
+        if target_size != img.size:
+            img = img.resize(target_size, Image.LANCZOS)
+        if self.grayscale:
+            img = img.convert('L')
+        elif self.format == 'jpeg' and img.mode not in ['RGB', 'L']:
+            # JPEG cannot store an alpha channel
+            img = img.convert('RGB')
+        return img
+
+    def encode(self, img: Image.Image) -> bytes:
+        """Prepare and encode an image, recording the payload size and encode time."""
+        start_time = time.perf_counter()
+        img = self.prepare(img)
+        save_kwargs = {}
+        if self.format == 'png':
+            save_kwargs['compress_level'] = self.png_compress_level
+        elif self.quality is not None:
+            save_kwargs['quality'] = self.quality
+        with BytesIO() as image_buffer:
+            img.save(image_buffer, format=self.format.upper(), **save_kwargs)
+            byte_data = image_buffer.getvalue()
+
+        self._pending_count += 1
+        self._pending_bytes += len(byte_data)
+        self._pending_seconds += time.perf_counter() - start_time
+        return byte_data
+
+    def to_b64(self, img: Image.Image, add_prefix: bool = True) -> str:
+        img_b64 = base64.b64encode(self.encode(img)).decode("utf-8")
+        if add_prefix:
+            img_b64 = f"data:{self.mime_type};base64," + img_b64
+        return img_b64
+
+    def to_screen_pixel(self, x, y):
+        """Map pixel coordinates on the payload image back to pixel coordinates on the remote screen."""
+        source_width, source_height = self.source_size
+        payload_width, payload_height = self.payload_size(source_width, source_height)
+        if (payload_width, payload_height) == (source_width, source_height):
+            return x, y
+        return (
+            int(round(x * source_width / payload_width)),
+            int(round(y * source_height / payload_height)),
+        )
+
+    def pop_step_stats(self) -> dict:
+        """Return image statistics accumulated since the previous call and reset the counters."""
+        stats = {
+            "image_count": self._pending_count,
+            "image_bytes": self._pending_bytes,
+            "encode_seconds": round(self._pending_seconds, 6),
+        }
+        self._pending_count = 0
+        self._pending_bytes = 0
+        self._pending_seconds = 0.0
+        return stats
@@ -0,0 +1,305 @@
+"""
+Shared, provider-agnostic client layer for model API calls.
+
+- Connection pooling: SDK clients and HTTP sessions are created once per process and shared by all agents.
+- Rate limiting: one token bucket per (provider, API key), shared by every environment in the process.
+- Retries: jittered exponential backoff on retryable errors (429, 408/409, 5xx, connection errors, timeouts),
+  honouring `Retry-After` when the provider sends it.
+- Deadlines: every logical call has a hard deadline across all attempts; each attempt's timeout is capped by it.
+- Metrics: each `LLMClient` keeps per-call records (latency, retries, outcome) for the agent that owns it.
+  Each call is also a `model_call` span of the task timer (utils/timing.py); for a stream, up to its first chunk.
+  Calls, latency, retries and rate-limit waits are also counted in the process-wide metrics (utils/metrics.py).
+- Record/replay: calls can be served from and stored to the model cache (see agent/model_cache.py).
+
+Settings are read from environment variables (unset = default):
+    MACOSWORLD_LLM_MAX_RETRIES              retries after the first attempt (default 5)
+    MACOSWORLD_LLM_DEADLINE_SECONDS         hard deadline per call, including retries (default 300)
+    MACOSWORLD_LLM_REQUEST_TIMEOUT_SECONDS  timeout per attempt (default 120)
+    MACOSWORLD_LLM_RPM_<PROVIDER>           requests per minute per API key, e.g. MACOSWORLD_LLM_RPM_OPENAI=60 (default unlimited)
+
+Rate limits are enforced per process; when several drivers share an API key, split the budget between them.
+"""
+
+import os
+import time
+import random
+import hashlib
+import threading
+
+from utils.log import print_message
+from utils.timing import span, timed, timed_sleep
+from utils.metrics import LLM_CALLS_TOTAL, LLM_CALL_SECONDS, LLM_RETRIES_TOTAL, LLM_RATE_LIMIT_WAIT_SECONDS_TOTAL
+from agent.model_cache import ModelCacheMiss, get_model_cache
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+RETRYABLE_ERROR_NAMES = {
+    # openai / anthropic SDKs
+    'APIConnectionError', 'APITimeoutError', 'RateLimitError', 'InternalServerError', 'OverloadedError',
+    # google.api_core
+    'ResourceExhausted', 'ServiceUnavailable', 'DeadlineExceeded', 'InternalServerError', 'TooManyRequests', 'GatewayTimeout',
+    # requests / httpx / builtins
+    'ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'Timeout', 'TimeoutError', 'RemoteProtocolError', 'ChunkedEncodingError',
+}
+
+class LLMDeadlineExceeded(TimeoutError):
+    pass
+
+class RetryableHTTPError(Exception):
+    """Raised by raw HTTP callers so that non-2xx responses go through the same retry logic as SDK errors."""
+    def __init__(self, status_code: int, message: str, headers: dict = None):
+        super().__init__(f'HTTP {status_code}: {message}')
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def _env_float(name: str, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return float(value)
+
+def _error_status_code(error: Exception):
+    for candidate in [error, getattr(error, 'response', None)]:
+        status_code = getattr(candidate, 'status_code', None)
+        if isinstance(status_code, int):
+            return status_code
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    return None
+
+def is_retryable_error(error: Exception) -> bool:
+    status_code = _error_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES or 500 <= status_code < 600
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+def _retry_after_seconds(error: Exception):
+    headers = getattr(error, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Thread-safe token bucket; `acquire` blocks until a token is available or the deadline passes."""
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline: float = None) -> float:
+        """Take one token. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate_per_second)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait_seconds = (1 - self.tokens) / self.rate_per_second
+            if deadline is not None and time.monotonic() + wait_seconds > deadline:
+                raise LLMDeadlineExceeded('Deadline exceeded while waiting for rate limiter.')
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+
+_shared_lock = threading.Lock()
+_rate_limiters = {}
+_shared_clients = {}
+
+def _key_fingerprint(api_key: str) -> str:
+    if not api_key:
+        return 'default'
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+def get_rate_limiter(provider: str, api_key: str = None):
+    """Return the process-wide token bucket for this provider/key, or None if no limit is configured."""
+    requests_per_minute = _env_float(f'MACOSWORLD_LLM_RPM_{provider.upper()}', None)
+    if requests_per_minute is None or requests_per_minute <= 0:
+        return None
+    key = (provider, _key_fingerprint(api_key))
+    with _shared_lock:
+        if key not in _rate_limiters:
+            rate_per_second = requests_per_minute / 60
+            # Allow short bursts of up to one second's worth of requests (at least one)
+            _rate_limiters[key] = TokenBucket(rate_per_second, capacity=max(1.0, rate_per_second))
+        return _rate_limiters[key]
+
+def _get_shared(key, factory):
+    with _shared_lock:
+        if key not in _shared_clients:
+            _shared_clients[key] = factory()
+        return _shared_clients[key]
+
+def get_openai_client(base_url: str = None, api_key: str = None):
+    """Process-wide OpenAI client (also used for vLLM's OpenAI-compatible server). SDK retries are disabled."""
+    from openai import OpenAI
+    import httpx
+
+    proxy_url = os.environ.get("OPENAI_PROXY_URL")
+    proxy_url = None if proxy_url == "" else proxy_url
+
+    def factory():
+        http_client = httpx.Client(
+            proxy = proxy_url,
+            limits = httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+        return OpenAI(base_url=base_url, api_key=api_key, max_retries=0, http_client=http_client)
+    return _get_shared(('openai', base_url, _key_fingerprint(api_key), proxy_url), factory)
+
+def get_anthropic_client():
+    """Process-wide Anthropic client. SDK retries are disabled."""
+    import anthropic
+    return _get_shared(('anthropic',), lambda: anthropic.Anthropic(max_retries=0))
+
+def get_http_session():
+    """Process-wide `requests` session with a connection pool, for providers called over raw HTTP."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    def factory():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=100)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    return _get_shared(('http_session',), factory)
+
+
+class LLMClient:
+    """
+    Wraps model calls with rate limiting, retries and deadlines, and records per-call metrics.
+
+    One instance per agent: the rate limiter and underlying connections are shared,
+    while the metric records belong to the agent that made the calls.
+    """
+    def __init__(
+        self,
+        provider: str,
+        api_key: str = None,
+        model: str = None,
+        max_retries: int = None,
+        deadline_seconds: float = None,
+        request_timeout_seconds: float = None,
+        base_backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 60.0,
+    ):
+        self.provider = provider
+        # Only used to key the model cache, for SDKs whose call arguments do not name the model
+        self.model = model
+        self.max_retries = int(max_retries if max_retries is not None else _env_float('MACOSWORLD_LLM_MAX_RETRIES', 5))
+        self.deadline_seconds = deadline_seconds if deadline_seconds is not None else _env_float('MACOSWORLD_LLM_DEADLINE_SECONDS', 300)
+        self.request_timeout_seconds = request_timeout_seconds if request_timeout_seconds is not None else _env_float('MACOSWORLD_LLM_REQUEST_TIMEOUT_SECONDS', 120)
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.rate_limiter = get_rate_limiter(provider, api_key)
+        self.cache = get_model_cache()
+
+        self.records = []
+        self.lock = threading.Lock()
+
+    @timed('model_call')
+    def call(self, fn, *args, timeout_kwarg: str = None, cache_as: tuple = None, **kwargs):
+        """
+        Call `fn(*args, **kwargs)` with retries.
+
+        If `timeout_kwarg` is given, that keyword argument is set to the per-attempt timeout
+        (capped by the time left before the deadline).
+
+        When the model cache is enabled, the request is keyed on `fn`, `args` and `kwargs`, or on the
+        `(fn, args, kwargs)` triple in `cache_as` when `fn` is a wrapper around the actual SDK call.
+        """
+        if self.cache is None:
+            return self._call(fn, args, kwargs, timeout_kwarg)
+
+        cache_fn, cache_args, cache_kwargs = cache_as if cache_as is not None else (fn, args, kwargs)
+        request = self.cache.make_request(self.provider, self.model, cache_fn, cache_args, cache_kwargs)
+        key = self.cache.make_key(request)
+        if self.cache.reads:
+            start_time = time.monotonic()
+            found, result = self.cache.load(key)
+            if found:
+                self._record(start_time, start_time, 0, 0.0, cache = "hit")
+                return result
+            if self.cache.mode == 'replay':
+                print_message(f'Cache miss for {key}: {self.cache.explain_miss(request)}', title = 'Model Cache')
+                raise ModelCacheMiss(f'No cached {self.provider} response for request {key} in {self.cache.cache_dir}.')
+        result = self._call(fn, args, kwargs, timeout_kwarg)
+        if self.cache.store(key, request, result):
+            self.last_record["cache"] = "stored"
+        return result
+
+    def _call(self, fn, args: tuple, kwargs: dict, timeout_kwarg: str = None):
+        start_time = time.monotonic()
+        deadline = start_time + self.deadline_seconds
+        retries = 0
+        rate_limit_wait = 0.0
+        while True:
+            if self.rate_limiter is not None:
+                with span('rate_limit_wait'):
+                    rate_limit_wait += self.rate_limiter.acquire(deadline)
+            if timeout_kwarg is not None:
+                kwargs[timeout_kwarg] = max(1.0, min(self.request_timeout_seconds, deadline - time.monotonic()))
+            attempt_start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retryable = is_retryable_error(e)
+                if not retryable or retries >= self.max_retries:
+                    self._record(start_time, attempt_start, retries, rate_limit_wait, error=e)
+                    raise
+                backoff = random.uniform(0, min(self.max_backoff_seconds, self.base_backoff_seconds * (2 ** retries)))
+                retry_after = _retry_after_seconds(e)
+                if retry_after is not None:
+                    backoff = max(backoff, retry_after)
+                if time.monotonic() + backoff > deadline:
+                    self._record(start_time, attempt_start, retries, rate_limit_wait, error=e)
+                    raise LLMDeadlineExceeded(f'{self.provider} call exceeded its {self.deadline_seconds}s deadline after {retries + 1} attempts. Last error: {e}') from e
+                retries += 1
+                print_message(f'{self.provider} call failed ({type(e).__name__}: {e}). Retry {retries}/{self.max_retries} in {backoff:.1f}s', title = 'LLM Client')
+                timed_sleep(backoff, 'retry_backoff')
+                continue
+            self._record(start_time, attempt_start, retries, rate_limit_wait)
+            return result
+
+    def _record(self, start_time: float, attempt_start: float, retries: int, rate_limit_wait: float, error: Exception = None, cache: str = None):
+        end_time = time.monotonic()
+        record = {
+            "provider": self.provider,
+            "latency_seconds": round(end_time - start_time, 4),
+            "last_attempt_seconds": round(end_time - attempt_start, 4),
+            "retries": retries,
+            "rate_limit_wait_seconds": round(rate_limit_wait, 4),
+            "success": error is None,
+        }
+        if error is not None:
+            record["error"] = f'{type(error).__name__}: {error}'
+        if cache is not None:
+            record["cache"] = cache
+        with self.lock:
+            self.records.append(record)
+
+        LLM_CALLS_TOTAL.inc(provider = self.provider, outcome = 'cache_hit' if cache == 'hit' else 'success' if error is None else 'error')
+        if cache != 'hit':
+            LLM_CALL_SECONDS.observe(end_time - start_time, provider = self.provider)
+        LLM_RETRIES_TOTAL.inc(retries, provider = self.provider)
+        LLM_RATE_LIMIT_WAIT_SECONDS_TOTAL.inc(rate_limit_wait, provider = self.provider)
+
+    @property
+    def last_record(self):
+        with self.lock:
+            return self.records[-1] if self.records else None
+
+    def pop_records(self) -> list:
+        with self.lock:
+            records, self.records = self.records, []
+        return records
@@ -18,17 +18,21 @@ def b64_to_pil(img_b64: str, remove_prefix: bool = True) -> Image.Image:
     image = Image.open(BytesIO(byte_data))
     return image
 
-def format_interleaved_message(elements, b64_image_add_prefix = True):
+def format_interleaved_message(elements, b64_image_add_prefix = True, image_pipeline = None):
     formatted_list = []
     for element in elements:
         if isinstance(element, str):
             formatted_list.append({"type": "text", "text": element})
         elif isinstance(element, Image.Image):
+            if image_pipeline is None:
+                url, detail = pil_to_b64(element, add_prefix = b64_image_add_prefix), "high"
+            else:
+                url, detail = image_pipeline.to_b64(element, add_prefix = b64_image_add_prefix), image_pipeline.detail
             formatted_list.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": pil_to_b64(element, add_prefix = b64_image_add_prefix),
-                    "detail": "high"
+                    "url": url,
+                    "detail": detail
                 }
             })
     return formatted_list
@@ -0,0 +1,190 @@
+"""
+Content-addressed record/replay cache for model calls.
+
+A request is identified by the provider, model, the called SDK method and its arguments. Images are reduced to
+SHA-256 digests before keying, and transport-only arguments (timeouts, headers, API keys) are ignored. Responses are
+stored as pickles under `<cache_dir>/<key[:2]>/<key>.pkl`, next to a `<key>.json` file holding the keyed request
+(with image digests in place of image data) for inspection. Arguments must reduce to stable JSON: PIL images, bytes,
+SDK objects with `model_dump`/`to_dict` or with image bytes in `data` (vertexai `Image`). Other types raise
+`TypeError` rather than being keyed by a `repr` that differs between runs.
+
+Modes, selected with MACOSWORLD_MODEL_CACHE:
+    off      (default) no caching
+    record   always call the model and store the response
+    replay   only serve stored responses; a miss raises `ModelCacheMiss` and nothing is sent over the network. The
+             miss is logged with the arguments in which the request differs from the closest stored one.
+    auto     serve stored responses, and call and store on a miss
+
+The cache directory is MACOSWORLD_MODEL_CACHE_DIR (default `model_cache`).
+
+Screenshots are part of the key, so a replayed trajectory hits the cache only as long as the environment renders
+exactly the same screens. Cache files are unpickled on load; only replay caches that you recorded yourself.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import threading
+
+from PIL import Image
+
+from utils.log import print_message
+
+MODEL_CACHE_MODES = ['off', 'record', 'replay', 'auto']
+
+# Arguments that affect transport only, not the model output
+IGNORED_ARGUMENTS = {'timeout', 'headers', 'extra_headers', 'api_key'}
+
+# Strings longer than this are digested in the stored request (base64 images, inline file data)
+MAX_INLINE_STRING_LENGTH = 1024
+
+
+class ModelCacheMiss(Exception):
+    pass
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def canonicalize(obj):
+    """Convert a request argument into a JSON-serialisable form with images replaced by digests."""
+    if obj is None or isinstance(obj, (bool, int, float)):
+        return obj
+    if isinstance(obj, str):
+        if obj.startswith('data:image') or len(obj) > MAX_INLINE_STRING_LENGTH:
+            return f'<sha256:{_digest(obj.encode("utf-8"))}>'
+        return obj
+    if isinstance(obj, (bytes, bytearray)):
+        return f'<sha256:{_digest(bytes(obj))}>'
+    if isinstance(obj, Image.Image):
+        return f'<image {obj.mode} {obj.size[0]}x{obj.size[1]} sha256:{_digest(obj.tobytes())}>'
+    if isinstance(obj, dict):
+        return {str(key): canonicalize(value) for key, value in obj.items() if key not in IGNORED_ARGUMENTS}
+    if isinstance(obj, (list, tuple)):
+        return [canonicalize(item) for item in obj]
+    # SDK objects (pydantic models, vertexai parts and configs)
+    for method_name in ['model_dump', 'to_dict']:
+        method = getattr(obj, method_name, None)
+        if callable(method):
+            return canonicalize(method())
+    # Encoded images of SDKs, e.g. vertexai `Image`, whose `data` holds the file bytes
+    data = getattr(obj, 'data', None)
+    if isinstance(data, (bytes, bytearray)):
+        return f'<{type(obj).__name__} sha256:{_digest(bytes(data))}>'
+    # A `repr` may hold memory addresses, which would give the same request a different key in every run
+    raise TypeError(f'Cannot key model requests on arguments of type {type(obj).__module__}.{type(obj).__name__}.')
+
+
+def _differences(stored, request, path: str) -> list:
+    """Paths at which two canonical requests differ, e.g. `args[0][3]` or `kwargs.generation_config`."""
+    if isinstance(stored, dict) and isinstance(request, dict):
+        differences = []
+        for name in sorted(set(stored) | set(request)):
+            differences += _differences(stored.get(name), request.get(name), f'{path}.{name}' if path else name)
+        return differences
+    if isinstance(stored, list) and isinstance(request, list) and len(stored) == len(request):
+        differences = []
+        for i, (stored_item, item) in enumerate(zip(stored, request)):
+            differences += _differences(stored_item, item, f'{path}[{i}]')
+        return differences
+    return [] if stored == request else [path]
+
+
+class ModelCache:
+    def __init__(self, mode: str, cache_dir: str):
+        if mode not in MODEL_CACHE_MODES:
+            raise ValueError(f'Unknown model cache mode "{mode}". Choose from {MODEL_CACHE_MODES}.')
+        self.mode = mode
+        self.cache_dir = cache_dir
+
+    @property
+    def reads(self) -> bool:
+        return self.mode in ['replay', 'auto']
+
+    @property
+    def writes(self) -> bool:
+        return self.mode in ['record', 'auto']
+
+    def make_request(self, provider: str, model: str, fn, args: tuple, kwargs: dict) -> dict:
+        return {
+            "provider": provider,
+            "model": model,
+            "method": getattr(fn, '__qualname__', type(fn).__name__),
+            "args": canonicalize(list(args)),
+            "kwargs": canonicalize(kwargs),
+        }
+
+    def make_key(self, request: dict) -> str:
+        return _digest(json.dumps(request, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+
+    def explain_miss(self, request: dict) -> str:
+        """Name the arguments in which `request` differs from the closest stored request of the same method."""
+        closest = None
+        if os.path.isdir(self.cache_dir):
+            for directory in os.listdir(self.cache_dir):
+                directory = os.path.join(self.cache_dir, directory)
+                if not os.path.isdir(directory):
+                    continue
+                for name in os.listdir(directory):
+                    if not name.endswith('.json'):
+                        continue
+                    try:
+                        with open(os.path.join(directory, name), 'r') as f:
+                            stored = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    if [stored.get(field) for field in ['provider', 'model', 'method']] != [request[field] for field in ['provider', 'model', 'method']]:
+                        continue
+                    differences = _differences({"args": stored.get("args"), "kwargs": stored.get("kwargs")}, {"args": request["args"], "kwargs": request["kwargs"]}, '')
+                    if closest is None or len(differences) < len(closest[1]):
+                        closest = (name[:-len('.json')], differences)
+        if closest is None:
+            return f'no stored request of {request["provider"]} {request["model"]} {request["method"]}'
+        key, differences = closest
+        shown = ', '.join(differences[:5]) + (f' and {len(differences) - 5} more' if len(differences) > 5 else '')
+        return f'closest stored request {key} differs in {shown}'
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.{extension}')
+
+    def load(self, key: str):
+        """Return (found, response)."""
+        path = self._path(key, 'pkl')
+        if not os.path.exists(path):
+            return False, None
+        with open(path, 'rb') as f:
+            return True, pickle.load(f)
+
+    def store(self, key: str, request: dict, response):
+        try:
+            payload = pickle.dumps(response)
+        except Exception as e:
+            print_message(f'Response of type {type(response).__name__} cannot be cached: {e}', title = 'Model Cache')
+            return False
+        os.makedirs(os.path.dirname(self._path(key, 'pkl')), exist_ok=True)
+        # Write-then-rename so that concurrent drivers never read a partial file
+        for extension, data in [('json', json.dumps(request, indent=4, ensure_ascii=False).encode('utf-8')), ('pkl', payload)]:
+            path = self._path(key, extension)
+            temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return True
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_model_cache():
+    """Return the process-wide cache configured by environment variables, or None when caching is off."""
+    global _default_cache
+    mode = os.environ.get('MACOSWORLD_MODEL_CACHE', 'off').strip().lower() or 'off'
+    if mode == 'off':
+        return None
+    cache_dir = os.environ.get('MACOSWORLD_MODEL_CACHE_DIR', 'model_cache')
+    with _default_cache_lock:
+        if _default_cache is None or (_default_cache.mode, _default_cache.cache_dir) != (mode, cache_dir):
+            _default_cache = ModelCache(mode, cache_dir)
+            print_message(f'Model cache in "{mode}" mode at {os.path.abspath(cache_dir)}', title = 'Model Cache')
+        return _default_cache
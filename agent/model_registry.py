@@ -0,0 +1,45 @@
+"""
+Process-wide registry of locally loaded models.
+
+`testbench.py` runs many tasks in one process and builds a fresh agent for each. Agents that run models locally
+(ShowUI, OmniParser) fetch their weights from here, so they are loaded once per process and shared by every task;
+per-task state (action history, screenshots, messages) stays on the agent instance. Models must therefore be used
+read-only by the agents.
+"""
+
+import time
+import threading
+
+from utils.log import print_message
+
+_resident_models = {}
+_load_seconds = {}
+_registry_lock = threading.Lock()
+
+def get_resident_model(key, loader):
+    """
+    Return `(model, load_seconds)` for `key`, calling `loader()` only if the key is not resident yet.
+    `load_seconds` is the time spent loading during this call, so 0.0 when the model was already resident.
+    """
+    # Loading holds the lock: concurrent callers wait for the first load instead of loading the weights twice
+    with _registry_lock:
+        if key in _resident_models:
+            return _resident_models[key], 0.0
+        start_time = time.perf_counter()
+        model = loader()
+        load_seconds = time.perf_counter() - start_time
+        _resident_models[key] = model
+        _load_seconds[key] = load_seconds
+    print_message(f'Loaded {key} in {load_seconds:.1f}s; it stays resident for later tasks', title = 'Model Registry')
+    return model, load_seconds
+
+def release_resident_model(key):
+    """Drop a model from the registry so that its memory can be reclaimed once no agent holds it."""
+    with _registry_lock:
+        _resident_models.pop(key, None)
+        _load_seconds.pop(key, None)
+
+def resident_model_load_report() -> dict:
+    """Load time in seconds of every resident model, keyed by `str(key)`."""
+    with _registry_lock:
+        return {str(key): round(seconds, 3) for key, seconds in _load_seconds.items()}
@@ -1,13 +1,20 @@
 from agent.llm_utils import pil_to_b64
+from agent.image_pipeline import ImagePipeline
+from agent.telemetry import AgentTelemetry
+from agent.conversation_store import ConversationStore
+from agent.llm_client import LLMClient, RetryableHTTPError, is_retryable_error, get_http_session
 from PIL import Image
 from utils.VNCClient import VNCClient_SSH
 from utils.log import print_message
+from utils.artifact_writer import get_artifact_writer
+from utils.timing import timed_sleep
 import os
 import json
-import requests
-import time
 from constants import SCREEN_WIDTH, SCREEN_HEIGHT
 
+# Stands in for pruned screenshots; encoded once instead of on every step
+BLACK_PLACEHOLDER_B64 = pil_to_b64(Image.new('RGB', (7, 7), (0, 0, 0)))
+
 CUA_SYSTEM_PROMPT = """You are using a macOS computer to complete a user-given task. Additional Notes:
 * Available xdotool keys: ctrl, command, option, backspace, tab, enter, esc, del, left, up, right, down, and single ASCII characters.
 * When you think the task can not be done, say ```FAIL```, don't easily say ```FAIL```, try your best to do the task. When you think the task is completed, say ```DONE```. Include the three backticks. If the task is not completed, don't raise any of these two flags.
@@ -23,6 +30,7 @@ class OpenAI_CUA:
         only_n_most_recent_images: int,
         top_p: float,
         temperature: float,
+        image_pipeline: ImagePipeline = None,
     ):
         self.model = model
         self.system_prompt = system_prompt
@@ -30,22 +38,30 @@ class OpenAI_CUA:
         self.only_n_most_recent_images = only_n_most_recent_images
         self.top_p = top_p
         self.temperature = temperature
+        self.image_pipeline = image_pipeline if image_pipeline is not None else ImagePipeline()
+
+        # The model sees (and predicts coordinates on) screenshots at the pipeline's payload resolution
+        display_width, display_height = self.image_pipeline.payload_size(SCREEN_WIDTH, SCREEN_HEIGHT)
 
         self.tools = [
             {
                 "type": "computer-preview",
-                "display_width": SCREEN_WIDTH,
-                "display_height": SCREEN_HEIGHT,
+                "display_width": display_width,
+                "display_height": display_height,
                 "environment": "mac" # other possible values: "browser", "windows", "ubuntu"
             },
         ]
 
-        self.messages = []
+        # Screenshots older than the most recent `only_n_most_recent_images` are replaced with a 7x7 pure black image
+        self.conversation = ConversationStore(max_images = only_n_most_recent_images, placeholder = {"image_url": BLACK_PLACEHOLDER_B64})
+        self.messages = self.conversation.messages
         self.token_usage = []
         self.total_input_tokens = 0
         self.total_output_tokens = 0
+        self.llm_client = LLMClient('openai', api_key=os.getenv('OPENAI_API_KEY'))
+        self.telemetry = AgentTelemetry(self.model, self.llm_client, self.image_pipeline)
 
-    def create_response(self, **kwargs):
+    def create_response(self, timeout: float = None, **kwargs):
         """
         https://github.com/openai/openai-cua-sample-app/blob/main/utils.py#L50
 
@@ -76,10 +92,14 @@ class OpenAI_CUA:
         if openai_org:
             headers["Openai-Organization"] = openai_org
 
-        response = requests.post(url, headers=headers, json=kwargs)
+        response = get_http_session().post(url, headers=headers, json=kwargs, timeout=timeout)
 
         if response.status_code != 200:
             print(f"Error: {response.status_code} {response.text}")
+            error = RetryableHTTPError(response.status_code, response.text, response.headers)
+            if is_retryable_error(error):
+                # Let the client layer back off and retry
+                raise error
 
         return response.json()
     
@@ -92,13 +112,15 @@ class OpenAI_CUA:
             self.messages.append({"role": "user", "content": task})
 
         # Call API
-        response = self.create_response(
+        response = self.llm_client.call(
+            self.create_response,
             model = "computer-use-preview-2025-03-11",
             input = self.messages,
             tools = self.tools,
             truncation = "auto",
             temperature = self.temperature,
-            top_p = self.top_p
+            top_p = self.top_p,
+            timeout_kwarg = 'timeout'
         )
 
         # Check if call is successful
@@ -109,6 +131,11 @@ class OpenAI_CUA:
         self.token_usage.append(response['usage'])
         self.total_input_tokens += response['usage']['input_tokens']
         self.total_output_tokens += response['usage']['output_tokens']
+        self.telemetry.record_usage(
+            response['usage']['input_tokens'],
+            response['usage']['output_tokens'],
+            (response['usage'].get('input_tokens_details') or {}).get('cached_tokens', 0)
+        )
 
         return response['output']
     
@@ -120,25 +147,9 @@ class OpenAI_CUA:
                 if self.messages[message_index]['type'] == 'reasoning':
                     del self.messages[message_index]
     
-    def filter_to_n_most_recent_images(self, n: int):
-        # The function would only consider images within computer_call_output blocks
-        call_id_to_remove = []
-        for message_index in range(len(self.messages) - 1, -1, -1):
-            if 'type' in self.messages[message_index] and 'output' in self.messages[message_index]:
-                if self.messages[message_index]['type'] == 'computer_call_output' and isinstance(self.messages[message_index]['output'], dict):
-                    if 'type' in self.messages[message_index]['output']:
-                        if self.messages[message_index]['output']['type'] == 'input_image':
-                            if n > 0:
-                                n -= 1
-                            else:
-                                self.messages[message_index]['output']['image_url'] = pil_to_b64(Image.new('RGB', (7, 7), (0, 0, 0))) # Substitute with a 7x7 pure black image
-                                # call_id_to_remove.append(self.messages[message_index]['call_id'])
-                                # del self.messages[message_index]
-
-        # for message_index in range(len(self.messages) - 1, -1, -1):
-        #     if 'call_id' in self.messages[message_index]:
-        #         if self.messages[message_index]['call_id'] in call_id_to_remove:
-        #             del self.messages[message_index]
+    def move_to_pixel(self, x, y):
+        """Move the cursor to pixel coordinates predicted on the payload image."""
+        self.remote_client.move_to_pixel(*self.image_pipeline.to_screen_pixel(x, y))
 
     def actuate(self, action: dict):
         """
@@ -159,7 +170,7 @@ class OpenAI_CUA:
             pass
         elif action_type == "click":
             if 'x' in action and 'y' in action:
-                self.remote_client.move_to_pixel(action['x'], action['y'])
+                self.move_to_pixel(action['x'], action['y'])
             if "button" not in action:
                 print(f'Error parsing action {action}: button to click not provided')
             elif action["button"] == 'left':
@@ -172,11 +183,11 @@ class OpenAI_CUA:
                 print(f'Error parsing action {action}: invalid button to click')
         elif action_type == "double_click":
             if 'x' in action and 'y' in action:
-                self.remote_client.move_to_pixel(action['x'], action['y'])
+                self.move_to_pixel(action['x'], action['y'])
             self.remote_client.double_click()
         elif action_type == "scroll":
             if 'x' in action and 'y' in action:
-                self.remote_client.move_to_pixel(action['x'], action['y'])
+                self.move_to_pixel(action['x'], action['y'])
             if 'scroll_x' in action:
                 if action['scroll_x'] < 0:
                     self.remote_client.scroll_up(-action['scroll_x'])
@@ -191,21 +202,21 @@ class OpenAI_CUA:
             self.remote_client.type_text(action['text'])
         elif action_type == 'wait':
             if 'ms' in action:
-                time.sleep(action['ms'] / 1000)
+                timed_sleep(action['ms'] / 1000, 'wait_action')
             else:
                 wait_seconds = 1 # https://github.com/openai/openai-cua-sample-app/blob/main/computers/docker.py#L134
-                time.sleep(wait_seconds)
+                timed_sleep(wait_seconds, 'wait_action')
         elif action_type == 'move':
-            self.remote_client.move_to_pixel(action['x'], action['y'])
+            self.move_to_pixel(action['x'], action['y'])
         elif action_type == 'keypress':
             key_combo = "-".join(action['keys'])
             self.remote_client.key_press(key_combo)
         elif action_type == 'drag':
             waypoints = action['path']
-            self.remote_client.move_to_pixel(waypoints[0]['x'], waypoints[0]['y'])
+            self.move_to_pixel(waypoints[0]['x'], waypoints[0]['y'])
             self.remote_client.client.mouseDown(1)
             for waypoint in waypoints[1:]:
-                self.remote_client.move_to_pixel(waypoint['x'], waypoint['y'])
+                self.move_to_pixel(waypoint['x'], waypoint['y'])
             self.remote_client.client.mouseUp(1)
             
 
@@ -241,7 +252,7 @@ class OpenAI_CUA:
 
             # Take a screenshot
             current_screenshot = self.remote_client.capture_screenshot()
-            current_screenshot.save(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_item_{str(current_action).zfill(3)}.png'))
+            get_artifact_writer().save_image(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_item_{str(current_action).zfill(3)}.png'), current_screenshot)
 
             call_output = {
                 # https://github.com/openai/openai-cua-sample-app/blob/main/agent/agent.py#L94
@@ -250,9 +261,10 @@ class OpenAI_CUA:
                 "acknowledged_safety_checks": item.get("pending_safety_checks", []), # Acknowledging all safety checks
                 "output": {
                     "type": "input_image",
-                    "image_url": pil_to_b64(current_screenshot),
+                    "image_url": self.image_pipeline.to_b64(current_screenshot),
                 },
             }
+            self.conversation.track_image(call_output, None, call_output["output"])
 
             return [call_output], None
         
@@ -274,10 +286,6 @@ class OpenAI_CUA:
         
         step_status = "unfinished"
 
-        # [Step 1] Message preparation
-        if self.only_n_most_recent_images > 0:
-            self.filter_to_n_most_recent_images(self.only_n_most_recent_images)
-
         # [Step 2] Agent prediction
         print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent...')
 
@@ -299,14 +307,16 @@ class OpenAI_CUA:
                 step_status = action_status
 
         # Save raw_response
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), 'w') as f:
-            json.dump(raw_response, f)
+        get_artifact_writer().write_json(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), raw_response)
+
+        # Close this step's telemetry record (tokens, images, model calls, cost)
+        self.telemetry.end_step(current_step)
 
         return step_status
 
     def save_conversation_history(self, save_dir: str):
         # Remove all images before saving chat log
-        self.filter_to_n_most_recent_images(0)
+        self.conversation.evict_all()
         
         file = os.path.join(save_dir, 'context', 'chat_log.json')
         with open(file, "w") as json_file:
@@ -318,4 +328,10 @@ class OpenAI_CUA:
         })
         file = os.path.join(save_dir, 'context', 'token_usage.json')
         with open(file, "w") as json_file:
-            json.dump(self.token_usage, json_file)
\ No newline at end of file
+            json.dump(self.token_usage, json_file)
+
+        self.telemetry.save(save_dir)
+
+        file = os.path.join(save_dir, 'context', 'llm_calls.json')
+        with open(file, "w") as json_file:
+            json.dump(self.llm_client.pop_records(), json_file)
@@ -1,17 +1,24 @@
-from openai import OpenAI
 import os
 from utils.VNCClient import VNCClient_SSH
 from utils.log import print_message
-from agent.llm_utils import pil_to_b64
+from utils.artifact_writer import get_artifact_writer
+from utils.timing import span, timed_sleep
 from PIL import Image
 import json
 from utils.timeout import timeout
 import time
 import re
-import httpx
 
 from agent.llm_utils import construct_user_prompt, format_interleaved_message
-from utils.omniparser import DefaultOmniParser
+from agent.image_pipeline import ImagePipeline
+from agent.telemetry import AgentTelemetry, openai_cached_tokens
+from agent.llm_client import LLMClient, get_openai_client
+from agent.streaming import open_stream, StreamTimer, IncrementalActionDispatcher
+from utils.omniparser import load_omniparser
+from utils.omniparser_service import OmniParserClient
+from utils.omniparser_cache import get_omniparser_cache
+from utils.omniparser_incremental import omniparser_incremental_enabled, make_incremental_omniparser
+from agent.model_registry import get_resident_model
 
 GPT_OMNIPARSER_SYSTEM_PROMPT = """
 You are an agent that performs Mac desktop computer tasks by controlling mouse and keyboard through VNC. For each step, you will receive a screenshot observation of the computer screen and should predict the next action.
@@ -118,27 +125,50 @@ class OpenAI_OmniParser_Agent:
         top_p: float,
         temperature: float,
         device: str,
+        image_pipeline: ImagePipeline = None,
+        stream: bool = False,
     ):
-        proxy_url = os.environ.get("OPENAI_PROXY_URL")
-
-        self.prompt_client = OpenAI() if proxy_url is None or proxy_url == "" else OpenAI(http_client=httpx.Client(proxy=proxy_url))
+        # Shared client honours OPENAI_PROXY_URL and pools connections across agents
+        self.prompt_client = get_openai_client()
+        self.llm_client = LLMClient('openai', api_key=os.environ.get("OPENAI_API_KEY"))
         self.model = model
         self.system_prompt = system_prompt
         self.remote_client = remote_client
         self.screenshot_rolling_window = screenshot_rolling_window
         self.top_p = top_p
         self.temperature = temperature
-
-        self.omniparser = DefaultOmniParser(device)
+        self.image_pipeline = image_pipeline if image_pipeline is not None else ImagePipeline()
+        self.stream = stream
+
+        omniparser_service_url = os.environ.get('OMNIPARSER_SERVICE_URL')
+        if omniparser_service_url:
+            # Parsing is done by a shared service (utils/omniparser_service.py), which batches screenshots across processes
+            self.omniparser, model_load_seconds = OmniParserClient(omniparser_service_url), 0.0
+        else:
+            # YOLO and Florence weights are loaded once per process; the parser keeps no per-task state
+            self.omniparser, model_load_seconds = get_resident_model(('omniparser', device), lambda: load_omniparser(device))
+        # Per task: re-parses only the screen regions that changed since the previous step
+        self.incremental_omniparser = None
+        if omniparser_incremental_enabled():
+            if omniparser_service_url:
+                print_message('Incremental parsing needs the in-process parser; ignored with OMNIPARSER_SERVICE_URL', title = 'OmniParser')
+            else:
+                self.incremental_omniparser = make_incremental_omniparser(self.omniparser)
+        # Process-wide, so that screens repeated across tasks (e.g. the initial desktop) are parsed once; None when off
+        self.omniparser_cache = get_omniparser_cache()
 
         self.messages = None
         self.screenshots = []
+        self.image_parts = {}
+        self.telemetry = AgentTelemetry(self.model, self.llm_client, self.image_pipeline)
+        self.telemetry.model_load_seconds = model_load_seconds
+        self.stream_stats = []
 
-    def __call__(self, task, screenshots, som_string):
+    def construct_messages(self, task, screenshots, som_string):
         user_prompt = self.construct_user_prompt(task, screenshots, som_string)
         formatted_user_prompt = self.format_interleaved_message(user_prompt)
 
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": self.system_prompt
@@ -149,30 +179,90 @@ class OpenAI_OmniParser_Agent:
             }
         ]
 
-        response = self.prompt_client.chat.completions.create(
+    def __call__(self, task, screenshots, som_string):
+        messages = self.construct_messages(task, screenshots, som_string)
+
+        response = self.llm_client.call(
+            self.prompt_client.chat.completions.create,
             model=self.model,
             messages=messages,
             top_p=self.top_p,
-            temperature=self.temperature
-        ).choices[0].message.content
+            temperature=self.temperature,
+            timeout_kwarg='timeout'
+        )
+        self.telemetry.record_usage(response.usage.prompt_tokens, response.usage.completion_tokens, openai_cached_tokens(response.usage))
+        response = response.choices[0].message.content
 
         extended_messages = messages + [{"role": "assistant", "content": response}]
 
         return response, extended_messages
+
+    def stream_and_execute(self, task, screenshots, som_string, parse_fn):
+        """
+        Streaming counterpart of `__call__` + `parse_agent_output` + `execute_actions`.
+        Each action is executed as soon as its line has streamed in, while the model is still generating.
+
+        Returns (raw_response, extended_messages, status, parsed_actions, stream_timing).
+        """
+        messages = self.construct_messages(task, screenshots, som_string)
+
+        timer = StreamTimer()
+        dispatcher = IncrementalActionDispatcher(
+            parse_fn = parse_fn,
+            execute_fn = lambda actions: self.execute_actions(actions)[0],
+            timer = timer
+        )
+        stream = open_stream(
+            self.llm_client,
+            self.prompt_client.chat.completions.create,
+            model=self.model,
+            messages=messages,
+            top_p=self.top_p,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout_kwarg='timeout'
+        )
+        try:
+            for chunk in stream:
+                # Usage arrives in a final chunk without choices
+                if chunk.usage is not None:
+                    self.telemetry.record_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens, openai_cached_tokens(chunk.usage))
+                if chunk.choices and chunk.choices[0].delta.content:
+                    dispatcher.feed(chunk.choices[0].delta.content)
+                if dispatcher.finished:
+                    break
+        finally:
+            stream.close()
+        response, status, parsed_actions = dispatcher.close()
+
+        extended_messages = messages + [{"role": "assistant", "content": response}]
+
+        return response, extended_messages, status, parsed_actions, timer.to_dict()
     
     def format_interleaved_message(self, elements, b64_image_add_prefix = True):
+        # A screenshot stays in the rolling window for several steps; its image part is encoded once and reused,
+        # which also keeps the payload byte-identical for the provider's prompt cache
         formatted_list = []
+        image_parts = {}
         for element in elements:
             if isinstance(element, str):
                 formatted_list.append({"type": "text", "text": element})
             elif isinstance(element, Image.Image):
-                formatted_list.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": pil_to_b64(element, add_prefix = b64_image_add_prefix),
-                        "detail": "high"
+                cached = self.image_parts.get(id(element))
+                if cached is not None and cached[0] is element:
+                    image_part = cached[1]
+                else:
+                    image_part = {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": self.image_pipeline.to_b64(element, add_prefix = b64_image_add_prefix),
+                            "detail": self.image_pipeline.detail
+                        }
                     }
-                })
+                image_parts[id(element)] = (element, image_part)
+                formatted_list.append(image_part)
+        self.image_parts = image_parts
         return formatted_list
 
     def construct_user_prompt(self, task: str, screenshots: list, som_content: str):
@@ -356,7 +446,7 @@ class OpenAI_OmniParser_Agent:
         status = "unfinished"
         for action in actions:
             act = action.get("action")
-            time.sleep(self.remote_client.action_interval_seconds)
+            timed_sleep(self.remote_client.action_interval_seconds, 'action_interval')
             if act == "move_to":
                 self.remote_client.move_to(action["x"], action["y"])
             elif act == "mouse_down":
@@ -388,7 +478,7 @@ class OpenAI_OmniParser_Agent:
             elif act == "key_press":
                 self.remote_client.key_press(action["key"])
             elif act == "wait":
-                time.sleep(action["seconds"])
+                timed_sleep(action["seconds"], 'wait_action')
             elif act == "fail":
                 status = "fail"
                 return status, actions
@@ -422,43 +512,83 @@ class OpenAI_OmniParser_Agent:
         current_screenshot = self.remote_client.capture_screenshot()
 
         # Annotate screenshot with omniparser
-        current_screenshot, parsed_content_list = self.omniparser(current_screenshot)
+        parse_start = time.perf_counter()
+        screen_parser = self.incremental_omniparser if self.incremental_omniparser is not None else self.omniparser
+        with span('screen_parse'):
+            if self.omniparser_cache is not None:
+                current_screenshot, parsed_content_list, cache_status = self.omniparser_cache.parse(screen_parser, current_screenshot)
+            else:
+                current_screenshot, parsed_content_list = screen_parser(current_screenshot)
+                cache_status = 'off'
+        cache_hit = cache_status in ['hit', 'disk_hit']
+        if cache_hit:
+            # Nothing was parsed; `last_parsed_fraction` still describes an earlier screenshot
+            parsed_fraction = 0.0
+        else:
+            parsed_fraction = self.incremental_omniparser.last_parsed_fraction if self.incremental_omniparser is not None else 1.0
+        self.telemetry.record_screen_parse(
+            time.perf_counter() - parse_start,
+            cache_hit = cache_hit,
+            parsed_fraction = parsed_fraction
+        )
         parsed_content_string = self.generate_parsed_content_string(parsed_content_list)
         self.screenshots.append(current_screenshot)
         self.screenshots = self.screenshots[-self.screenshot_rolling_window:]
 
-        # Prediction
-        print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent...')
-        raw_response, messages = self(task = task, screenshots = self.screenshots, som_string = parsed_content_string)
-
-        # Action
-        print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Actuating...')
-        coord_parsed_raw_response = self.parse_som_coordinate(raw_response, parsed_content_list)
-        parsed_actions = self.parse_agent_output(coord_parsed_raw_response)
-        status, _ = self.execute_actions(parsed_actions)
+        if self.stream:
+            # Prediction and action, overlapped
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent and actuating streamed actions...')
+            raw_response, messages, status, parsed_actions, stream_timing = self.stream_and_execute(
+                task = task,
+                screenshots = self.screenshots,
+                som_string = parsed_content_string,
+                parse_fn = lambda text: self.parse_agent_output(self.parse_som_coordinate(text, parsed_content_list))
+            )
+            self.stream_stats.append({"step": current_step, **stream_timing})
+            coord_parsed_raw_response = self.parse_som_coordinate(raw_response, parsed_content_list)
+        else:
+            # Prediction
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent...')
+            raw_response, messages = self(task = task, screenshots = self.screenshots, som_string = parsed_content_string)
+
+            # Action
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Actuating...')
+            coord_parsed_raw_response = self.parse_som_coordinate(raw_response, parsed_content_list)
+            parsed_actions = self.parse_agent_output(coord_parsed_raw_response)
+            status, _ = self.execute_actions(parsed_actions)
 
         # Save current_screenshot
-        current_screenshot.save(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'))
+        get_artifact_writer().save_image(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'), current_screenshot)
 
         # Save current som annotations
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_som_annotations.json'), 'w') as f:
-            json.dump(parsed_content_list, f, indent=4)
+        get_artifact_writer().write_json(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_som_annotations.json'), parsed_content_list, indent=4)
 
         # Save raw_response
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), 'w') as f:
-            f.write(raw_response)
+        get_artifact_writer().write_text(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), raw_response)
 
         # Save coord parsed raw_response
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_coord_parsed_raw_response.txt'), 'w') as f:
-            f.write(coord_parsed_raw_response)
+        get_artifact_writer().write_text(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_coord_parsed_raw_response.txt'), coord_parsed_raw_response)
 
         # Dump parsed_actions
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_parsed_actions.json'), 'w') as f:
-            json.dump(parsed_actions, f, indent=4)
+        get_artifact_writer().write_json(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_parsed_actions.json'), parsed_actions, indent=4)
+
+        # Close this step's telemetry record (tokens, images, model calls, cost)
+        self.telemetry.end_step(current_step)
 
         # print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = f'Status: {status}')
 
         return status
 
     def save_conversation_history(self, save_dir: str):
-        pass
+        self.telemetry.save(save_dir)
+        if self.omniparser_cache is not None:
+            print_message(f'Process-wide parse cache: {self.omniparser_cache.stats()}', title = 'OmniParser Cache')
+
+        file = os.path.join(save_dir, 'context', 'llm_calls.json')
+        with open(file, "w") as json_file:
+            json.dump(self.llm_client.pop_records(), json_file)
+
+        if self.stream:
+            file = os.path.join(save_dir, 'context', 'stream_stats.json')
+            with open(file, "w") as json_file:
+                json.dump(self.stream_stats, json_file)
@@ -1,15 +1,15 @@
 import os
 from utils.VNCClient import VNCClient_SSH
 from utils.log import print_message
-from agent.llm_utils import pil_to_b64
+from utils.artifact_writer import get_artifact_writer
+from utils.timing import span, timed_sleep
+from agent.telemetry import AgentTelemetry
+from agent.showui_engine import get_showui_engine, ShowUIClient
 from PIL import Image
-import json
 from utils.timeout import timeout
 import time
 import torch
 import ast
-from qwen_vl_utils import process_vision_info
-from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
 
 _NAV_SYSTEM = """
 You are an assistant trained to navigate the macOS screen. 
@@ -44,16 +44,17 @@ class ShowUI_Agent:
         max_pixels: int,
     ):
         
-        # Perform device count check
-        if torch.cuda.device_count() != 1:
-            raise NotImplementedError(f'ShowUI only verified for running on one card. Comment out this line if you know what you are doing.')
-        
-        self.model = Qwen2VLForConditionalGeneration.from_pretrained(
-            model_name,
-            torch_dtype=torch.bfloat16,
-            device_map="auto"
-        )
-        self.processor = AutoProcessor.from_pretrained(model_name, min_pixels=min_pixels, max_pixels=max_pixels)
+        showui_service_url = os.environ.get('SHOWUI_SERVICE_URL')
+        if showui_service_url:
+            # Generation is done by a shared service (agent/showui_engine.py), which batches steps across processes
+            self.engine, model_load_seconds = ShowUIClient(showui_service_url), 0.0
+        else:
+            # Perform device count check
+            if torch.cuda.device_count() != 1:
+                raise NotImplementedError(f'ShowUI only verified for running on one card. Comment out this line if you know what you are doing.')
+
+            # Weights and processor are loaded once per process and shared by the agents of all tasks
+            self.engine, model_load_seconds = get_showui_engine(model_name, min_pixels, max_pixels)
 
         self.system_prompt = system_prompt
         self.min_pixels = min_pixels
@@ -61,59 +62,24 @@ class ShowUI_Agent:
         self.action_history = ''
 
         self.remote_client = remote_client
+        self.telemetry = AgentTelemetry(model_name)
+        self.telemetry.model_load_seconds = model_load_seconds
 
     def call_agent(self, task: str, screenshot: Image.Image):
-
-        # Construct messages
-        if len(self.action_history) == 0:
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": self.system_prompt},
-                        {"type": "text", "text": f'Task: {task}'},
-                        # {"type": "text", "text": PAST_ACTION},
-                        {"type": "image", "image": pil_to_b64(screenshot), "min_pixels": self.min_pixels, "max_pixels": self.max_pixels},
-                    ],
-                }
-            ]
-        else:
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": self.system_prompt},
-                        {"type": "text", "text": f'Task: {task}'},
-                        {"type": "text", "text": self.action_history},
-                        {"type": "image", "image": pil_to_b64(screenshot), "min_pixels": self.min_pixels, "max_pixels": self.max_pixels},
-                    ],
-                }
-            ]
-
-        # Prepare for generation
-        text = self.processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True,
-        )
-        image_inputs, video_inputs = process_vision_info(messages)
-        inputs = self.processor(
-            text=[text],
-            images=image_inputs,
-            videos=video_inputs,
-            padding=True,
-            return_tensors="pt",
-        )
-        inputs = inputs.to(self.model.device)
-
-        # Generate
-        generated_ids = self.model.generate(**inputs, max_new_tokens=128)
-        generated_ids_trimmed = [
-            out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-        ]
-        output_text = self.processor.batch_decode(
-            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )[0]
-
-        return output_text
+        # The screenshot is passed as a PIL image; concurrent steps of other environments may share the `generate` call
+        with span('model_call'):
+            result = self.engine.generate_step(
+                system_prompt = self.system_prompt,
+                task = task,
+                action_history = self.action_history,
+                screenshot = screenshot,
+                min_pixels = self.min_pixels,
+                max_pixels = self.max_pixels
+            )
+        self.telemetry.record_local_call(result['generate_seconds'])
+        self.telemetry.record_usage(result['prompt_tokens'], result['completion_tokens'])
+
+        return result['output_text']
     
     def parse_agent_output(self, output_text):
         # https://github.com/showlab/computer_use_ootb/blob/58ff12c63d4bcc4d1d0ed841644da12d80d8ebfc/computer_use_demo/gui_agent/actor/showui_agent.py#L151
@@ -192,7 +158,7 @@ class ShowUI_Agent:
             except Exception as e:
                 print(f'Failed to parse action {action}')
 
-            time.sleep(self.remote_client.action_interval_seconds)
+            timed_sleep(self.remote_client.action_interval_seconds, 'action_interval')
 
         return status
             
@@ -231,20 +197,21 @@ class ShowUI_Agent:
             self.action_history = f'{parsed_actions}\n'
 
         # Save current_screenshot
-        current_screenshot.save(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'))
+        get_artifact_writer().save_image(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'), current_screenshot)
 
         # Save raw_response
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), 'w') as f:
-            f.write(raw_response)
+        get_artifact_writer().write_text(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), raw_response)
 
         # Dump parsed_actions
         if parsed_actions is not None:
-            with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_parsed_actions.json'), 'w') as f:
-                json.dump(parsed_actions, f, indent=4)
+            get_artifact_writer().write_json(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_parsed_actions.json'), parsed_actions, indent=4)
+
+        # Close this step's telemetry record
+        self.telemetry.end_step(current_step)
 
         return status
 
     def save_conversation_history(self, save_dir: str):
-        pass
+        self.telemetry.save(save_dir)
 
     
\ No newline at end of file
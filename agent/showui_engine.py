@@ -0,0 +1,174 @@
+"""
+Batched ShowUI inference shared by several environments.
+
+`ShowUIEngine` runs one padded `generate` call for a batch of step requests, each a Qwen2-VL message list holding
+the screenshot as a PIL image (no base64 round trip). Requests are grouped by a `MicroBatcher`, so concurrent
+callers share batches and a single copy of the weights.
+
+In-process, `get_showui_engine` returns the process-wide engine. To serve the VMs of several testbench processes
+from one model copy, start the engine as a service and point the agents at it:
+
+    python -m agent.showui_engine --port 8766                     # or --unix_socket /tmp/showui.sock
+    export SHOWUI_SERVICE_URL=http://127.0.0.1:8766               # or unix:///tmp/showui.sock
+
+Endpoints:
+    POST /generate   body: one line of JSON {"system_prompt", "task", "action_history", "min_pixels", "max_pixels"},
+                     a newline, then the screenshot as PNG bytes; returns the `generate` result of `ShowUIEngine`
+    GET  /health     returns {"status": "ok", "requests": ..., "batches": ..., "mean_batch_size": ...}
+"""
+
+import io
+import os
+import json
+import time
+import argparse
+
+import torch
+from PIL import Image
+from qwen_vl_utils import process_vision_info
+from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+
+from utils.log import print_message
+from utils.batching_service import MicroBatcher, JSONRequestHandler, ServiceClient, make_http_server, encode_png
+from agent.model_registry import get_resident_model
+
+
+def build_messages(system_prompt: str, task: str, action_history: str, screenshot: Image.Image, min_pixels: int, max_pixels: int) -> list:
+    content = [
+        {"type": "text", "text": system_prompt},
+        {"type": "text", "text": f'Task: {task}'},
+    ]
+    if len(action_history) > 0:
+        content.append({"type": "text", "text": action_history})
+    # qwen_vl_utils accepts PIL images as they are and resizes them within [min_pixels, max_pixels]
+    content.append({"type": "image", "image": screenshot, "min_pixels": min_pixels, "max_pixels": max_pixels})
+    return [{"role": "user", "content": content}]
+
+
+class ShowUIEngine:
+    def __init__(self, model_name: str, min_pixels: int, max_pixels: int, max_new_tokens: int = 128, max_batch_size: int = 8, max_batch_wait_seconds: float = 0.02):
+        self.model = Qwen2VLForConditionalGeneration.from_pretrained(
+            model_name,
+            torch_dtype=torch.bfloat16,
+            device_map="auto"
+        )
+        self.processor = AutoProcessor.from_pretrained(model_name, min_pixels=min_pixels, max_pixels=max_pixels)
+        # Decoder-only batching: pad on the left so every row continues right after its prompt
+        self.processor.tokenizer.padding_side = 'left'
+        self.max_new_tokens = max_new_tokens
+        self.batcher = MicroBatcher(self.generate_batch, max_batch_size = max_batch_size, max_batch_wait_seconds = max_batch_wait_seconds, name = 'showui-batcher')
+
+    def generate(self, messages: list) -> dict:
+        """Queue one request and wait for its batch. Safe to call from several threads."""
+        return self.batcher.submit(messages).result()
+
+    def generate_step(self, system_prompt: str, task: str, action_history: str, screenshot: Image.Image, min_pixels: int, max_pixels: int) -> dict:
+        return self.generate(build_messages(system_prompt, task, action_history, screenshot, min_pixels, max_pixels))
+
+    def generate_batch(self, batch: list) -> list:
+        """
+        Run one padded `generate` over a list of message lists. Each result holds the decoded `output_text`, its
+        `prompt_tokens` and `completion_tokens`, and the `batch_size` and `generate_seconds` of the shared call.
+        """
+        texts = [self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True) for messages in batch]
+        image_inputs, video_inputs = process_vision_info(batch)
+        inputs = self.processor(
+            text=texts,
+            images=image_inputs,
+            videos=video_inputs,
+            padding=True,
+            return_tensors="pt",
+        )
+        inputs = inputs.to(self.model.device)
+
+        generate_start = time.perf_counter()
+        generated_ids = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens)
+        generate_seconds = time.perf_counter() - generate_start
+
+        # With left padding all prompts end at the same column
+        generated_ids_trimmed = generated_ids[:, inputs.input_ids.shape[1]:]
+        output_texts = self.processor.batch_decode(
+            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )
+        pad_token_id = self.processor.tokenizer.pad_token_id
+        return [
+            {
+                "output_text": output_text,
+                "prompt_tokens": int(attention_mask.sum()),
+                "completion_tokens": int((out_ids != pad_token_id).sum()),
+                "batch_size": len(batch),
+                "generate_seconds": generate_seconds,
+            }
+            for output_text, attention_mask, out_ids in zip(output_texts, inputs.attention_mask, generated_ids_trimmed)
+        ]
+
+
+def get_showui_engine(model_name: str, min_pixels: int, max_pixels: int):
+    """Return `(engine, load_seconds)` for the process-wide engine; `load_seconds` is 0.0 once it is resident."""
+    return get_resident_model(
+        ('showui', model_name, min_pixels, max_pixels),
+        lambda: ShowUIEngine(model_name, min_pixels, max_pixels)
+    )
+
+
+class ShowUIRequestHandler(JSONRequestHandler):
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {"status": "ok", **self.server.engine.batcher.stats()})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/generate':
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            header, png_bytes = self.read_body().split(b'\n', 1)
+            request = json.loads(header)
+            screenshot = Image.open(io.BytesIO(png_bytes))
+            screenshot.load()
+            result = self.server.engine.generate(build_messages(screenshot = screenshot, **request))
+        except Exception as e:
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self.send_json(200, result)
+
+
+class ShowUIClient(ServiceClient):
+    """Sends step requests to a running ShowUI service; `generate_step` returns the same result as `ShowUIEngine.generate_step`."""
+    def generate_step(self, system_prompt: str, task: str, action_history: str, screenshot: Image.Image, min_pixels: int, max_pixels: int) -> dict:
+        # json.dumps escapes newlines inside strings, so the header is a single line
+        header = json.dumps({"system_prompt": system_prompt, "task": task, "action_history": action_history, "min_pixels": min_pixels, "max_pixels": max_pixels})
+        return self.request('POST', '/generate', body = header.encode('utf-8') + b'\n' + encode_png(screenshot))
+
+
+def serve(host: str, port: int, unix_socket: str, model_name: str, min_pixels: int, max_pixels: int, max_batch_size: int, max_batch_wait_ms: float):
+    load_start = time.perf_counter()
+    engine = ShowUIEngine(model_name, min_pixels, max_pixels, max_batch_size = max_batch_size, max_batch_wait_seconds = max_batch_wait_ms / 1000)
+    print_message(f'{model_name} loaded in {time.perf_counter() - load_start:.1f}s', title = 'ShowUI Service')
+
+    server, address = make_http_server(host, port, unix_socket, ShowUIRequestHandler)
+    server.engine = engine
+
+    print_message(f'Serving at {address} (max batch {max_batch_size}, wait {max_batch_wait_ms}ms)', title = 'ShowUI Service')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--unix_socket', type=str, default=None) # overrides --host/--port
+    parser.add_argument('--model_name', type=str, default='showlab/ShowUI-2B')
+    parser.add_argument('--min_pixels', type=int, default=256*28*28)
+    parser.add_argument('--max_pixels', type=int, default=1344*28*28)
+    parser.add_argument('--max_batch_size', type=int, default=8)
+    parser.add_argument('--max_batch_wait_ms', type=float, default=20)
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.unix_socket, args.model_name, args.min_pixels, args.max_pixels, args.max_batch_size, args.max_batch_wait_ms)
@@ -0,0 +1,160 @@
+import sys
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+def open_stream(llm_client, fn, *args, **kwargs):
+    """
+    Start a streaming request through `llm_client` and return an iterator over its chunks.
+
+    The first chunk is pulled inside the retry scope, so connection errors and rate limits raised
+    when the stream opens are retried like ordinary calls. Errors after the first chunk are not retried,
+    because actions may already have been executed.
+    """
+    timeout_kwarg = kwargs.pop('timeout_kwarg', None)
+
+    if llm_client.cache is not None:
+        # Cached streams are read to the end before any chunk is handed out, so that the chunk list can be
+        # stored and replayed. Early execution is lost, but actions are dispatched exactly as when streaming.
+        def read_all(**call_kwargs):
+            return list(fn(*args, **kwargs, **call_kwargs))
+        return OpenedStream(llm_client.call(read_all, timeout_kwarg=timeout_kwarg, cache_as=(fn, args, kwargs)))
+
+    def start(**call_kwargs):
+        # `call_kwargs` carries the per-attempt timeout set by the client layer
+        return OpenedStream(fn(*args, **kwargs, **call_kwargs))
+    return llm_client.call(start, timeout_kwarg=timeout_kwarg)
+
+
+class OpenedStream:
+    """An SDK stream whose first chunk has already been received. Iterate to get all chunks; `close` releases the connection."""
+    def __init__(self, raw_stream):
+        self.raw_stream = raw_stream
+        self.iterator = iter(raw_stream)
+        try:
+            self.head = [next(self.iterator)]
+        except StopIteration:
+            self.head = []
+
+    def __iter__(self):
+        return itertools.chain(self.head, self.iterator)
+
+    def close(self):
+        if hasattr(self.raw_stream, 'close'):
+            self.raw_stream.close()
+
+
+class StreamTimer:
+    """Records time-to-first-token and time-to-first-action for one streamed step."""
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.first_token_time = None
+        self.first_action_time = None
+        self.end_time = None
+
+    def mark_token(self):
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+
+    def mark_action(self):
+        if self.first_action_time is None:
+            self.first_action_time = time.perf_counter()
+
+    def finish(self):
+        self.end_time = time.perf_counter()
+
+    def to_dict(self) -> dict:
+        def elapsed(t):
+            return None if t is None else round(t - self.start_time, 4)
+        return {
+            "time_to_first_token": elapsed(self.first_token_time),
+            "time_to_first_action": elapsed(self.first_action_time),
+            "total_seconds": elapsed(self.end_time),
+        }
+
+
+class _ThreadOutputFilter:
+    """Stand-in for `sys.stdout` that drops what one thread prints and passes the output of other threads through."""
+    def __init__(self, stream, thread_id: int):
+        self.stream = stream
+        self.thread_id = thread_id
+
+    def write(self, text: str):
+        if threading.get_ident() == self.thread_id:
+            return len(text)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+@contextmanager
+def _quiet_current_thread():
+    stream = sys.stdout
+    sys.stdout = _ThreadOutputFilter(stream, threading.get_ident())
+    try:
+        yield
+    finally:
+        sys.stdout = stream
+
+
+class IncrementalActionDispatcher:
+    """
+    Parses streamed model output as it arrives and executes each action once it is complete.
+
+    `parse_fn` is the agent's ordinary full-text parser. After every completed line it is re-run on all complete
+    lines received so far, and only actions beyond those already dispatched are executed. Actions are therefore
+    dispatched in the same order, and with the same content, as parsing the full response at once. The final
+    (possibly unterminated) line is parsed when the stream ends. Parsers report malformed lines with `print`; those
+    reports are muted while streaming, since every re-run would repeat them, and printed once by the final parse.
+
+    `execute_fn` executes a list of actions and returns a status; dispatching stops at the first status other
+    than "unfinished".
+    """
+    def __init__(self, parse_fn, execute_fn, timer: StreamTimer = None):
+        self.parse_fn = parse_fn
+        self.execute_fn = execute_fn
+        self.timer = timer if timer is not None else StreamTimer()
+        self.text = ''
+        self.complete_length = 0
+        self.dispatched_actions = []
+        self.status = "unfinished"
+
+    @property
+    def finished(self) -> bool:
+        return self.status != "unfinished"
+
+    def feed(self, text_delta: str):
+        """Append streamed text; dispatch any actions that became complete. Returns the current status."""
+        if not text_delta:
+            return self.status
+        self.timer.mark_token()
+        self.text += text_delta
+        last_newline = self.text.rfind('\n')
+        if last_newline + 1 > self.complete_length:
+            self.complete_length = last_newline + 1
+            if not self.finished:
+                with _quiet_current_thread():
+                    actions = self.parse_fn(self.text[:self.complete_length])
+                self._dispatch(actions)
+        return self.status
+
+    def close(self):
+        """Parse the remaining text once the stream has ended. Returns (full_text, status, dispatched_actions)."""
+        # Parsed even if dispatching has finished, so that malformed lines are reported once
+        actions = self.parse_fn(self.text)
+        self._dispatch(actions)
+        self.timer.finish()
+        return self.text, self.status, self.dispatched_actions
+
+    def _dispatch(self, actions: list):
+        if self.finished:
+            return
+        new_actions = actions[len(self.dispatched_actions):]
+        if not new_actions:
+            return
+        self.dispatched_actions += new_actions
+        self.timer.mark_action()
+        status = self.execute_fn(new_actions)
+        if status != "unfinished":
+            self.status = status
@@ -0,0 +1,164 @@
+"""
+Per-step token, cost and latency telemetry shared by all GUI agents.
+
+Each agent owns one `AgentTelemetry`. During a step it reports token usage with `record_usage`; at the end of the
+step `end_step` folds in the image statistics of the agent's `ImagePipeline` and the model calls made through its
+`LLMClient` since the previous step. `save` writes everything to `context/telemetry.json`:
+
+    {
+        "model": "gpt-4o-2024-08-06",
+        "steps": [{"step": 1, "prompt_tokens": ..., "cached_prompt_tokens": ..., "completion_tokens": ..., "image_count": ...,
+                   "llm_calls": ..., "llm_latency_seconds": ..., "retries": ..., "cache_hits": ..., "estimated_cost_usd": ...}, ...],
+        "totals": {...same fields summed over steps, plus "steps"...}
+    }
+
+`scripts/aggregate_results_utils.py: aggregate_telemetry` combines these files across a run.
+"""
+
+import os
+import json
+import time
+
+# USD per million (prompt, completion, cache read, cache write) tokens, matched by longest model-name prefix.
+# Locally served models cost nothing per token. Update when provider prices change.
+MODEL_PRICING = {
+    'gpt-4o': (2.50, 10.00, 1.25, 2.50),
+    'computer-use-preview': (3.00, 12.00, 3.00, 3.00),
+    'claude-3-7-sonnet': (3.00, 15.00, 0.30, 3.75),
+    'gemini-1.5-pro': (1.25, 5.00, 0.3125, 1.25),
+    'gemini-2.5-pro': (1.25, 10.00, 0.31, 1.25),
+    'UI-TARS': (0.0, 0.0, 0.0, 0.0),
+    'showlab/ShowUI': (0.0, 0.0, 0.0, 0.0),
+}
+
+SUMMED_FIELDS = [
+    'prompt_tokens', 'cached_prompt_tokens', 'cache_write_tokens', 'completion_tokens', 'image_count', 'image_bytes', 'encode_seconds',
+    'llm_calls', 'llm_latency_seconds', 'retries', 'rate_limit_wait_seconds', 'cache_hits', 'failed_llm_calls', 'estimated_cost_usd',
+    'screen_parses', 'screen_parse_cache_hits', 'screen_parse_seconds', 'screen_parse_full_equivalents',
+]
+
+def get_model_pricing(model: str):
+    """Return (prompt, completion, cache read, cache write) USD per million tokens, or None for unknown models."""
+    matches = [prefix for prefix in MODEL_PRICING if model.startswith(prefix)]
+    if not matches:
+        return None
+    return MODEL_PRICING[max(matches, key=len)]
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_prompt_tokens: int = 0, cache_write_tokens: int = 0):
+    """`prompt_tokens` includes the tokens read from (`cached_prompt_tokens`) and written to (`cache_write_tokens`) the prompt cache."""
+    pricing = get_model_pricing(model)
+    if pricing is None:
+        return None
+    prompt_price, completion_price, cache_read_price, cache_write_price = pricing
+    uncached_prompt_tokens = prompt_tokens - cached_prompt_tokens - cache_write_tokens
+    return (
+        uncached_prompt_tokens * prompt_price
+        + cached_prompt_tokens * cache_read_price
+        + cache_write_tokens * cache_write_price
+        + completion_tokens * completion_price
+    ) / 1_000_000
+
+def openai_cached_tokens(usage) -> int:
+    """Prompt tokens served from the prompt cache, from an OpenAI-compatible `usage` object (0 if not reported)."""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return getattr(details, 'cached_tokens', None) or 0
+
+
+class AgentTelemetry:
+    def __init__(self, model: str, llm_client = None, image_pipeline = None):
+        self.model = model
+        self.llm_client = llm_client
+        self.image_pipeline = image_pipeline
+        self.steps = []
+        # Time this agent spent loading local models (0.0 when they were already resident); not part of any step
+        self.model_load_seconds = 0.0
+
+        self._llm_record_cursor = 0
+        self._pending_usage = self._empty_usage()
+        self._pending_local_calls = []
+        self._pending_screen_parses = []
+
+    @staticmethod
+    def _empty_usage() -> dict:
+        return {'prompt_tokens': 0, 'cached_prompt_tokens': 0, 'cache_write_tokens': 0, 'completion_tokens': 0}
+
+    def record_usage(self, prompt_tokens: int, completion_tokens: int, cached_prompt_tokens: int = 0, cache_write_tokens: int = 0):
+        """
+        Add the token usage of one model response to the current step.
+        `prompt_tokens` is the full prompt, including tokens served from or written to the provider's prompt cache.
+        """
+        self._pending_usage['prompt_tokens'] += prompt_tokens or 0
+        self._pending_usage['cached_prompt_tokens'] += cached_prompt_tokens or 0
+        self._pending_usage['cache_write_tokens'] += cache_write_tokens or 0
+        self._pending_usage['completion_tokens'] += completion_tokens or 0
+
+    def record_local_call(self, latency_seconds: float):
+        """Record a model call that does not go through an `LLMClient` (locally loaded models)."""
+        self._pending_local_calls.append(latency_seconds)
+
+    def record_screen_parse(self, latency_seconds: float, cache_hit: bool, parsed_fraction: float = 1.0):
+        """
+        Record one screenshot parse (OmniParser), whether it was served from the parse cache or not.
+        `parsed_fraction` is the share of the screen that was actually parsed (< 1 for incremental parses, 0 for hits).
+        """
+        self._pending_screen_parses.append((latency_seconds, cache_hit, 0.0 if cache_hit else parsed_fraction))
+
+    def _pop_llm_records(self) -> list:
+        if self.llm_client is None:
+            return []
+        # Read without popping: the agent also dumps the full per-call records at the end of the task
+        with self.llm_client.lock:
+            records = self.llm_client.records[self._llm_record_cursor:]
+            self._llm_record_cursor = len(self.llm_client.records)
+        return records
+
+    def end_step(self, step: int) -> dict:
+        """Close the current step and return its telemetry record."""
+        llm_records = self._pop_llm_records()
+        if self.image_pipeline is not None:
+            image_stats = self.image_pipeline.pop_step_stats()
+        else:
+            image_stats = {"image_count": 0, "image_bytes": 0, "encode_seconds": 0.0}
+
+        estimated_cost = estimate_cost(self.model, **self._pending_usage)
+        record = {
+            "step": step,
+            **self._pending_usage,
+            **image_stats,
+            "llm_calls": len(llm_records) + len(self._pending_local_calls),
+            "llm_latency_seconds": round(sum(r["latency_seconds"] for r in llm_records) + sum(self._pending_local_calls), 4),
+            "retries": sum(r["retries"] for r in llm_records),
+            "rate_limit_wait_seconds": round(sum(r["rate_limit_wait_seconds"] for r in llm_records), 4),
+            "cache_hits": sum(1 for r in llm_records if r.get("cache") == "hit"),
+            "failed_llm_calls": sum(1 for r in llm_records if not r["success"]),
+            "estimated_cost_usd": None if estimated_cost is None else round(estimated_cost, 6),
+            "screen_parses": len(self._pending_screen_parses),
+            "screen_parse_cache_hits": sum(1 for _, cache_hit, _ in self._pending_screen_parses if cache_hit),
+            "screen_parse_seconds": round(sum(latency for latency, _, _ in self._pending_screen_parses), 4),
+            "screen_parse_full_equivalents": round(sum(fraction for _, _, fraction in self._pending_screen_parses), 4),
+            "timestamp": time.time(),
+        }
+        self.steps.append(record)
+
+        self._pending_usage = self._empty_usage()
+        self._pending_local_calls = []
+        self._pending_screen_parses = []
+        return record
+
+    def totals(self) -> dict:
+        totals = {"steps": len(self.steps)}
+        for field in SUMMED_FIELDS:
+            values = [step[field] for step in self.steps]
+            if field == 'estimated_cost_usd' and any(value is None for value in values):
+                totals[field] = None
+            else:
+                totals[field] = round(sum(values), 6)
+        return totals
+
+    def save(self, save_dir: str):
+        # Usage reported after the last step (e.g. a final call outside `step`) is kept in a closing record
+        if any(self._pending_usage.values()) or self._pending_local_calls or self._pending_screen_parses:
+            self.end_step(len(self.steps) + 1)
+        file = os.path.join(save_dir, 'context', 'telemetry.json')
+        with open(file, "w") as json_file:
+            json.dump({"model": self.model, "model_load_seconds": round(self.model_load_seconds, 3), "steps": self.steps, "totals": self.totals()}, json_file, indent=4)
@@ -1,13 +1,19 @@
-from openai import OpenAI
 import os
 from utils.VNCClient import VNCClient_SSH
 from utils.log import print_message
-from agent.llm_utils import pil_to_b64
+from utils.artifact_writer import get_artifact_writer
+from utils.timing import timed_sleep
+from agent.image_pipeline import ImagePipeline
+from agent.telemetry import AgentTelemetry, openai_cached_tokens
+from agent.conversation_store import ConversationStore
+from agent.llm_client import LLMClient
+from agent.vllm_pool import VLLMSession, get_vllm_pool
+from agent.streaming import open_stream, StreamTimer, IncrementalActionDispatcher
 from PIL import Image
 import json
 from utils.timeout import timeout
-import time
 import re
+import uuid
 from constants import SCREEN_WIDTH, SCREEN_HEIGHT
 
 
@@ -52,11 +58,13 @@ class UITARS_GUI_AGENT:
         max_tokens: int,
         top_p: float,
         temperature: float,
+        image_pipeline: ImagePipeline = None,
+        stream: bool = False,
+        image_eviction_chunk: int = 1,
     ):
-        self.prompt_client = OpenAI(
-            base_url=vllm_base_url,
-            api_key="empty",
-        )
+        # Requests of this task stick to one vLLM endpoint of the pool, for prefix-cache reuse
+        self.vllm_session = VLLMSession(get_vllm_pool(vllm_base_url), route_key = uuid.uuid4().hex)
+        self.llm_client = LLMClient('vllm')
         self.model = model
         self.system_prompt = system_prompt
         self.remote_client = remote_client
@@ -64,13 +72,21 @@ class UITARS_GUI_AGENT:
         self.max_tokens = max_tokens
         self.top_p = top_p
         self.temperature = temperature
+        self.image_pipeline = image_pipeline if image_pipeline is not None else ImagePipeline()
+        self.stream = stream
 
         self.screenshots = []
-        self.messages = []
+        # Older screenshot messages are dropped once `only_n_most_recent_images` newer ones exist.
+        # The system prompt and task open the conversation and never change, so vLLM's automatic prefix caching
+        # reuses them and every turn before the oldest evicted screenshot.
+        self.conversation = ConversationStore(max_images = only_n_most_recent_images, drop_empty_messages = True, eviction_chunk = image_eviction_chunk)
+        self.messages = self.conversation.messages
 
         self.token_usage = []
         self.total_prompt_tokens = 0
         self.total_completion_tokens = 0
+        self.telemetry = AgentTelemetry(self.model, self.llm_client, self.image_pipeline)
+        self.stream_stats = []
 
     def format_messages(self, task: str, screenshot: str):
         if len(self.messages) == 0:
@@ -80,42 +96,29 @@ class UITARS_GUI_AGENT:
                     {"type": "text", "text": self.system_prompt + task},
                 ]
             })
-        self.messages.append({
+        screenshot_item = {
+            "type": "image_url",
+            "image_url": {"url": self.image_pipeline.to_b64(screenshot)}
+        }
+        screenshot_message = self.conversation.append({
             "role": "user",
-            "content": [
-                {
-                    "type": "image_url",
-                    "image_url": {"url": pil_to_b64(screenshot)}
-                }
-            ]
+            "content": [screenshot_item]
         })
+        self.conversation.track_image(screenshot_message, screenshot_message['content'], screenshot_item)
 
-    def filter_to_n_most_recent_images(self, n: int):
-        for message_index in range(len(self.messages) - 1, -1, -1):
-            if self.messages[message_index]['role'] == 'user':
-                if isinstance(self.messages[message_index]['content'], list):
-                    for message_content_index in range(len(self.messages[message_index]['content']) - 1, -1, -1):
-                        if self.messages[message_index]['content'][message_content_index]['type'] == 'image_url':
-                            if n > 0:
-                                n -= 1
-                            else:
-                                del self.messages[message_index]['content'][message_content_index]
-                    if len(self.messages[message_index]['content']) == 0:
-                        del self.messages[message_index]
-
-    def call_agent(self, task: str, screenshot: Image.Image) -> str:
+    def call_agent(self, task: str, screenshot: Image.Image, step_index: int) -> str:
         self.format_messages(task = task, screenshot = screenshot)
 
-        self.filter_to_n_most_recent_images(self.only_n_most_recent_images)
-
         # Agent inference
-        response = self.prompt_client.chat.completions.create(
+        response = self.llm_client.call(
+            self.vllm_session.create,
             model=self.model,
             messages=self.messages,
             frequency_penalty=1,
             max_tokens=self.max_tokens,
             top_p=self.top_p,
             temperature=self.temperature,
+            timeout_kwarg='timeout'
         )
         response_content = response.choices[0].message.content
 
@@ -128,17 +131,77 @@ class UITARS_GUI_AGENT:
         })
 
         # Count tokens
+        self.record_token_usage(step_index, response.usage)
+
+        return response_content
+
+    def record_token_usage(self, step_index: int, usage):
         self.token_usage.append(
             {
-                "step": "step_index",
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens
+                "step": step_index,
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "cached_tokens": openai_cached_tokens(usage)
             }
         )
-        self.total_prompt_tokens += response.usage.prompt_tokens
-        self.total_completion_tokens += response.usage.completion_tokens
+        self.total_prompt_tokens += usage.prompt_tokens
+        self.total_completion_tokens += usage.completion_tokens
+        self.telemetry.record_usage(usage.prompt_tokens, usage.completion_tokens, openai_cached_tokens(usage))
 
-        return response_content
+    def stream_and_execute(self, task: str, screenshot: Image.Image, step_index: int):
+        """
+        Streaming counterpart of `call_agent` + `parse_agent_output` + `execute_actions`.
+        Each action call is executed as soon as it has streamed in, while the model is still generating.
+
+        Returns (raw_response, status, parsed_actions, stream_timing).
+        """
+        self.format_messages(task = task, screenshot = screenshot)
+
+        timer = StreamTimer()
+        dispatcher = IncrementalActionDispatcher(
+            parse_fn = self.parse_agent_output,
+            execute_fn = self.execute_actions,
+            timer = timer
+        )
+        stream = open_stream(
+            self.llm_client,
+            self.vllm_session.create,
+            model=self.model,
+            messages=self.messages,
+            frequency_penalty=1,
+            max_tokens=self.max_tokens,
+            top_p=self.top_p,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout_kwarg='timeout'
+        )
+        usage = None
+        try:
+            for chunk in stream:
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    dispatcher.feed(chunk.choices[0].delta.content)
+                if dispatcher.finished:
+                    break
+        finally:
+            stream.close()
+        response_content, status, parsed_actions = dispatcher.close()
+
+        # Append response_content to messages
+        self.messages.append({
+            "role": "assistant",
+            "content": [
+                {"type": "text", "text": response_content}
+            ]
+        })
+
+        # Count tokens
+        if usage is not None:
+            self.record_token_usage(step_index, usage)
+
+        return response_content, status, parsed_actions, timer.to_dict()
 
     def parse_coordinate(self, coord_str):
         """
@@ -434,10 +497,10 @@ class UITARS_GUI_AGENT:
                 elif act == 'scroll_right':
                     self.remote_client.scroll_right(0.5)
                 elif act == 'wait':
-                    time.sleep(5)
+                    timed_sleep(5, 'wait_action')
                 elif act in ['finished', 'call_user']:
                     status = act
-                time.sleep(self.remote_client.action_interval_seconds)
+                timed_sleep(self.remote_client.action_interval_seconds, 'action_interval')
             except Exception as e:
                 print(f'Error executing action {action}: {e}')
         return status
@@ -460,25 +523,32 @@ class UITARS_GUI_AGENT:
         print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Capturing screenshot...')
         current_screenshot = self.remote_client.capture_screenshot()
 
-        # Prediction
-        print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent...')
-        raw_response = self.call_agent(task = task, screenshot = current_screenshot)
-
-        # Action
-        print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Actuating...')
-        parsed_actions = self.parse_agent_output(raw_response)
-        status = self.execute_actions(parsed_actions)
+        if self.stream:
+            # Prediction and action, overlapped
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent and actuating streamed actions...')
+            raw_response, status, parsed_actions, stream_timing = self.stream_and_execute(task = task, screenshot = current_screenshot, step_index = current_step)
+            self.stream_stats.append({"step": current_step, **stream_timing})
+        else:
+            # Prediction
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Calling GUI agent...')
+            raw_response = self.call_agent(task = task, screenshot = current_screenshot, step_index = current_step)
+
+            # Action
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Actuating...')
+            parsed_actions = self.parse_agent_output(raw_response)
+            status = self.execute_actions(parsed_actions)
 
         # Save current_screenshot
-        current_screenshot.save(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'))
+        get_artifact_writer().save_image(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}.png'), current_screenshot)
 
         # Save raw_response
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), 'w') as f:
-            f.write(raw_response)
+        get_artifact_writer().write_text(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_raw_response.txt'), raw_response)
 
         # Dump parsed_actions
-        with open(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_parsed_actions.json'), 'w') as f:
-            json.dump(parsed_actions, f, indent=4)
+        get_artifact_writer().write_json(os.path.join(save_dir, 'context', f'step_{str(current_step).zfill(3)}_parsed_actions.json'), parsed_actions, indent=4)
+
+        # Close this step's telemetry record (tokens, images, model calls, cost)
+        self.telemetry.end_step(current_step)
 
         # print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = f'Status: {status}')
 
@@ -486,7 +556,7 @@ class UITARS_GUI_AGENT:
 
     def save_conversation_history(self, save_dir: str):
         # Remove all images before saving chat log
-        self.filter_to_n_most_recent_images(0)
+        self.conversation.evict_all()
 
         file = os.path.join(save_dir, 'context', 'chat_log.json')
         with open(file, "w") as json_file:
@@ -499,3 +569,18 @@ class UITARS_GUI_AGENT:
         file = os.path.join(save_dir, 'context', 'token_usage.json')
         with open(file, "w") as json_file:
             json.dump(self.token_usage, json_file)
+
+        self.telemetry.save(save_dir)
+
+        file = os.path.join(save_dir, 'context', 'llm_calls.json')
+        with open(file, "w") as json_file:
+            json.dump(self.llm_client.pop_records(), json_file)
+
+        file = os.path.join(save_dir, 'context', 'vllm_routing.json')
+        with open(file, "w") as json_file:
+            json.dump({"requests": self.vllm_session.pop_records(), "endpoints": self.vllm_session.pool.stats()}, json_file)
+
+        if self.stream:
+            file = os.path.join(save_dir, 'context', 'stream_stats.json')
+            with open(file, "w") as json_file:
+                json.dump(self.stream_stats, json_file)
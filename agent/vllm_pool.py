@@ -0,0 +1,225 @@
+"""
+Routing of UI-TARS requests over one or more local vLLM servers.
+
+Each task's agent opens a `VLLMSession`. Its first request goes to the least-loaded healthy endpoint and later
+requests stick to that endpoint, so vLLM's automatic prefix caching keeps reusing the task's growing conversation.
+A session only moves when its endpoint is unhealthy or at its concurrency cap; such moves are logged as 'rerouted'.
+
+Load of an endpoint is the larger of the requests this process has in flight there and the running + waiting
+requests vLLM reports on `/metrics`, so testbench processes that share the servers also see each other's load.
+A background thread polls `/health` and `/metrics` of every endpoint; an endpoint that fails a health check or a
+request (connection error or 5xx) is skipped until it passes a health check again. When every endpoint is at its
+cap, requests wait for capacity.
+
+Settings are read from environment variables (unset = default):
+    MACOSWORLD_VLLM_ENDPOINTS               comma-separated base URLs, e.g. http://127.0.0.1:8000/v1,http://127.0.0.1:8001/v1
+                                            (default: the single URL given by `get_gui_agent`)
+    MACOSWORLD_VLLM_MAX_CONCURRENCY         requests per endpoint before it counts as full (default 16)
+    MACOSWORLD_VLLM_HEALTH_CHECK_SECONDS    health and load polling interval (default 5)
+
+Each session's routing decisions and latencies are saved by the agent to `context/vllm_routing.json`.
+"""
+
+import os
+import time
+import zlib
+import threading
+
+from utils.log import print_message
+from agent.llm_client import get_openai_client, get_http_session, is_retryable_error, LLMDeadlineExceeded
+
+LOAD_METRICS = ('vllm:num_requests_running', 'vllm:num_requests_waiting')
+
+
+def parse_vllm_load(metrics_text: str) -> int:
+    """Sum of running and waiting requests in a Prometheus `/metrics` page of vLLM."""
+    load = 0.0
+    for line in metrics_text.splitlines():
+        if line.startswith(LOAD_METRICS):
+            try:
+                load += float(line.rsplit(' ', 1)[1])
+            except (IndexError, ValueError):
+                continue
+    return int(load)
+
+
+class VLLMEndpoint:
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+        # vLLM serves /health and /metrics at the server root, next to /v1
+        self.root_url = self.base_url[:-len('/v1')] if self.base_url.endswith('/v1') else self.base_url
+        self.client = get_openai_client(base_url=self.base_url, api_key="empty")
+
+        self.outstanding = 0
+        self.server_load = 0
+        self.healthy = True
+        self.requests = 0
+        self.failures = 0
+        self.latency_seconds = 0.0
+
+    @property
+    def load(self) -> int:
+        return max(self.outstanding, self.server_load)
+
+
+class VLLMEndpointPool:
+    def __init__(self, base_urls: list, max_concurrency: int = 16, health_check_seconds: float = 5):
+        self.endpoints = [VLLMEndpoint(base_url) for base_url in base_urls]
+        self.max_concurrency = max_concurrency
+        self.health_check_seconds = health_check_seconds
+        self.condition = threading.Condition()
+
+        # A single endpoint needs neither balancing nor probing
+        if len(self.endpoints) > 1:
+            self.health_thread = threading.Thread(target = self._health_loop, name = 'vllm-health', daemon = True)
+            self.health_thread.start()
+
+    def _health_loop(self):
+        session = get_http_session()
+        while True:
+            for endpoint in self.endpoints:
+                try:
+                    healthy = session.get(f'{endpoint.root_url}/health', timeout = 2).status_code == 200
+                    server_load = parse_vllm_load(session.get(f'{endpoint.root_url}/metrics', timeout = 2).text) if healthy else 0
+                except Exception:
+                    healthy, server_load = False, 0
+                with self.condition:
+                    if healthy != endpoint.healthy:
+                        print_message(f'{endpoint.base_url} is {"healthy again" if healthy else "unhealthy"}', title = 'vLLM Pool')
+                    endpoint.healthy = healthy
+                    endpoint.server_load = server_load
+                    self.condition.notify_all()
+            time.sleep(self.health_check_seconds)
+
+    def _has_capacity(self, endpoint: VLLMEndpoint) -> bool:
+        return endpoint.healthy and endpoint.load < self.max_concurrency
+
+    def acquire(self, route_key: str, sticky_endpoint: VLLMEndpoint = None, deadline: float = None):
+        """
+        Reserve a slot and return `(endpoint, route, wait_seconds)`; `route` is 'sticky', 'least_loaded' or 'rerouted'.
+        Blocks while every healthy endpoint is full; if none is healthy, the least-loaded endpoint is used anyway.
+        """
+        start_time = time.monotonic()
+        with self.condition:
+            while True:
+                if sticky_endpoint is not None and self._has_capacity(sticky_endpoint):
+                    endpoint, route = sticky_endpoint, 'sticky'
+                    break
+                candidates = [endpoint for endpoint in self.endpoints if self._has_capacity(endpoint)]
+                if candidates or not any(endpoint.healthy for endpoint in self.endpoints):
+                    candidates = candidates or self.endpoints
+                    # Ties are broken by the route key, so that new sessions spread over idle endpoints
+                    offset = zlib.crc32(route_key.encode('utf-8'))
+                    endpoint = min(candidates, key = lambda endpoint: (endpoint.load, (self.endpoints.index(endpoint) + offset) % len(self.endpoints)))
+                    route = 'least_loaded' if sticky_endpoint is None else 'rerouted'
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise LLMDeadlineExceeded('Deadline exceeded while waiting for a vLLM endpoint with free capacity.')
+                self.condition.wait(timeout = 0.5)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        return endpoint, route, time.monotonic() - start_time
+
+    def release(self, endpoint: VLLMEndpoint, latency_seconds: float, error: Exception = None):
+        with self.condition:
+            endpoint.outstanding -= 1
+            endpoint.latency_seconds += latency_seconds
+            if error is not None:
+                endpoint.failures += 1
+                # Connection errors and server errors take the endpoint out until it passes a health check
+                if len(self.endpoints) > 1 and is_retryable_error(error) and getattr(error, 'status_code', None) != 429:
+                    endpoint.healthy = False
+            self.condition.notify_all()
+
+    def stats(self) -> list:
+        with self.condition:
+            return [
+                {
+                    "endpoint": endpoint.base_url,
+                    "healthy": endpoint.healthy,
+                    "outstanding": endpoint.outstanding,
+                    "server_load": endpoint.server_load,
+                    "requests": endpoint.requests,
+                    "failures": endpoint.failures,
+                    "mean_latency_seconds": round(endpoint.latency_seconds / endpoint.requests, 4) if endpoint.requests else None,
+                }
+                for endpoint in self.endpoints
+            ]
+
+
+class RoutedStream:
+    """Streaming response that holds its endpoint slot until it is exhausted or closed."""
+    def __init__(self, raw_stream, on_close):
+        self.raw_stream = raw_stream
+        self.on_close = on_close
+
+    def __iter__(self):
+        try:
+            yield from self.raw_stream
+        except Exception as e:
+            self.close(e)
+            raise
+        self.close()
+
+    def close(self, error: Exception = None):
+        if self.on_close is not None:
+            on_close, self.on_close = self.on_close, None
+            if hasattr(self.raw_stream, 'close'):
+                self.raw_stream.close()
+            on_close(error)
+
+
+class VLLMSession:
+    """Per-task view of the pool. `create` takes the arguments of `chat.completions.create`; call it through an `LLMClient`."""
+    def __init__(self, pool: VLLMEndpointPool, route_key: str):
+        self.pool = pool
+        self.route_key = route_key
+        self.endpoint = None
+        self.records = []
+
+    def create(self, **kwargs):
+        timeout = kwargs.get('timeout')
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        endpoint, route, wait_seconds = self.pool.acquire(self.route_key, self.endpoint, deadline)
+        self.endpoint = endpoint
+        record = {"endpoint": endpoint.base_url, "route": route, "queue_wait_seconds": round(wait_seconds, 4), "timestamp": time.time()}
+        self.records.append(record)
+
+        start_time = time.monotonic()
+        def finish(error = None):
+            latency_seconds = time.monotonic() - start_time
+            record["latency_seconds"] = round(latency_seconds, 4)
+            record["success"] = error is None
+            self.pool.release(endpoint, latency_seconds, error)
+
+        try:
+            response = endpoint.client.chat.completions.create(**kwargs)
+        except Exception as e:
+            finish(e)
+            raise
+        if kwargs.get('stream'):
+            return RoutedStream(response, finish)
+        finish()
+        return response
+
+    def pop_records(self) -> list:
+        records, self.records = self.records, []
+        return records
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_vllm_pool(default_base_url: str) -> VLLMEndpointPool:
+    """Process-wide pool over MACOSWORLD_VLLM_ENDPOINTS, or over `default_base_url` alone when it is unset."""
+    base_urls = tuple(url.strip() for url in os.environ.get('MACOSWORLD_VLLM_ENDPOINTS', default_base_url).split(',') if url.strip())
+    with _pools_lock:
+        if base_urls not in _pools:
+            _pools[base_urls] = VLLMEndpointPool(
+                list(base_urls),
+                max_concurrency = int(os.environ.get('MACOSWORLD_VLLM_MAX_CONCURRENCY', 16)),
+                health_check_seconds = float(os.environ.get('MACOSWORLD_VLLM_HEALTH_CHECK_SECONDS', 5)),
+            )
+            if len(base_urls) > 1:
+                print_message(f'Routing UI-TARS requests over {len(base_urls)} endpoints: {", ".join(base_urls)}', title = 'vLLM Pool')
+        return _pools[base_urls]
@@ -1,15 +1,23 @@
 import os
 import shutil
 from utils.log import print_message
+from utils.blob_store import get_blob_dir, collect_garbage
+from utils.task_leases import get_lease_store, get_driver_id, held_by_other_driver
 import argparse
 
-def clean_directories(base_save_dir):
+def clean_directories(base_save_dir, lease_store = None, driver_id = None):
     # Check if the directory exists
     if not os.path.isdir(base_save_dir):
         return
         raise ValueError(f'Directory does not exist: {base_save_dir}')
+    # Tasks that other drivers are running are kept (utils/task_leases.py)
+    lease_store = get_lease_store(lease_store, base_save_dir)
+    driver_id = get_driver_id(driver_id)
     # Iterate through each item in the base directory
     for category_dir in os.listdir(base_save_dir):
+        # Hidden directories hold shared data (screenshot blobs, results store), not tasks
+        if category_dir.startswith('.'):
+            continue
         if os.path.isdir(os.path.join(base_save_dir, category_dir)):
             # Iterate through each item in the category directory
             for subdirectory in os.listdir(os.path.join(base_save_dir, category_dir)):
@@ -22,13 +30,22 @@ def clean_directories(base_save_dir):
                     
                     # Check if there is at least one .txt file in the subdirectory
                     if not any(file.endswith('.txt') for file in files):
+                        if held_by_other_driver(lease_store, f'{category_dir}/{subdirectory}', driver_id):
+                            continue
                         # If no .txt files are found, delete the subdirectory
                         print_message(f"Deleting: {subdirectory_path}", title = 'cleanup.py')
                         shutil.rmtree(subdirectory_path)
 
+    # Screenshots of the deleted directories were hardlinks to shared blobs; remove blobs nobody links to anymore
+    blob_dir = get_blob_dir(base_save_dir)
+    if os.path.isdir(blob_dir):
+        print_message(collect_garbage(blob_dir), title = 'cleanup.py')
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--base_save_dir", type=str, required=True)
+    parser.add_argument("--lease_store", type=str, default=None)
+    parser.add_argument("--driver_id", type=str, default=None) # as passed to testbench.py; without it, every unexpired lease counts as another driver's
     args = parser.parse_args()
 
-    clean_directories(args.base_save_dir)
+    clean_directories(args.base_save_dir, args.lease_store, args.driver_id)
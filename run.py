@@ -5,6 +5,7 @@ import socket
 
 from utils.log import print_message
 from utils.completion_checker import all_tasks_completed
+from utils.task_leases import get_driver_id
 
 parser = argparse.ArgumentParser()
 
@@ -23,13 +24,23 @@ parser.add_argument('--task_max_attempts', type=int, default=2)
 parser.add_argument('--task_step_timeout', type=int, default=120)
 
 parser.add_argument('--gui_agent_name', type=str, required=True)
+parser.add_argument('--image_pipeline', type=str, default=None) # e.g. "jpeg,quality=85,max_edge=1280"; default lossless PNG
+parser.add_argument('--stream', action='store_true') # execute actions while the model response is still streaming
+parser.add_argument('--image_eviction_chunk', type=int, default=1) # Claude/UI-TARS: drop old screenshots this many at a time for prompt-cache reuse
 parser.add_argument('--max-steps', type=int, default=15)
 parser.add_argument('--base_save_dir', type=str, default='./results')
 parser.add_argument('--paths_to_eval_tasks', nargs='+', required=True)
 parser.add_argument('--languages', nargs='+', required=True)
+parser.add_argument('--warm_pool_instance_ids', nargs='+', default=None) # further EC2 instances, reset in the background for upcoming tasks
+parser.add_argument('--lease_store', type=str, default=None) # task leases shared by all drivers of base_save_dir: a directory (default <base_save_dir>/.leases) or sqlite:<path>
+parser.add_argument('--driver_id', type=str, default=None) # distinguishes the drivers sharing base_save_dir; defaults to <host name>:<instance_id or vmx file name>
+parser.add_argument('--metrics_port', type=int, default=None) # serve Prometheus metrics on http://127.0.0.1:<metrics_port>/metrics
 
 args = parser.parse_args()
 
+# Computed once and passed to both cleanup.py and testbench.py, so that cleanup recognises this driver's leases
+driver_id = get_driver_id(args.driver_id, args.instance_id, args.vmx_path)
+
 
 # The testbench restarts every 12 hours.
 # Interrupted tasks are automatically cleaned up and re-benchmarked.
@@ -43,7 +54,11 @@ while True:
 
     # Step 1 - Run `clean_up.py` to cleanup the base_save_dir
     print_message(f'Running cleanup on {args.base_save_dir}', title = 'run.py')
-    subprocess.run([sys.executable, "cleanup.py", "--base_save_dir", args.base_save_dir])
+    cleanup_cmd = [sys.executable, "cleanup.py", "--base_save_dir", args.base_save_dir]
+    if args.lease_store:
+        cleanup_cmd += ["--lease_store", args.lease_store]
+    cleanup_cmd += ["--driver_id", driver_id]
+    subprocess.run(cleanup_cmd)
 
 
 
@@ -82,12 +97,25 @@ while True:
     cmd += ["--guest_password", args.guest_password]
 
     cmd += ["--gui_agent_name", args.gui_agent_name]
+    if args.image_pipeline:
+        cmd += ["--image_pipeline", args.image_pipeline]
+    if args.stream:
+        cmd += ["--stream"]
+    if args.image_eviction_chunk != 1:
+        cmd += ["--image_eviction_chunk", str(args.image_eviction_chunk)]
     cmd += ["--max-steps", str(args.max_steps)]
     cmd += ["--base_save_dir", args.base_save_dir]
 
     # multi-value args: pass them as a single flag followed by their items
     cmd += ["--paths_to_eval_tasks"] + list(args.paths_to_eval_tasks)
     cmd += ["--languages"] + list(args.languages)
+    if args.warm_pool_instance_ids:
+        cmd += ["--warm_pool_instance_ids"] + list(args.warm_pool_instance_ids)
+    if args.lease_store:
+        cmd += ["--lease_store", args.lease_store]
+    cmd += ["--driver_id", driver_id]
+    if args.metrics_port is not None:
+        cmd += ["--metrics_port", str(args.metrics_port)]
 
     # subprocess.run(cmd)
 
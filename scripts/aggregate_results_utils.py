@@ -1,6 +1,13 @@
 import os
+import sys
+import json
 import pandas as pd
 
+# The notebooks import this file from scripts/; the results store lives in utils/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.results_store import read_results_table, backfill_results_store, CATEGORY_WEIGHTS
+from utils.trajectory_archive import read_task_file
+
 def aggregate_results(root_dir):
     records = []
     # iterate over first‐level subfolders
@@ -161,4 +168,235 @@ def calculate_overall_score(
     weighted_average = weighted_sum / total_weight
 
     # 5) Print the result
-    print(f"Overall score = {weighted_average}")
\ No newline at end of file
+    print(f"Overall score = {weighted_average}")
+
+def collect_telemetry(root_dir):
+    """
+    Walks `root_dir/<category>/<uuid>_<task_language>_<env_language>/` and returns one record per task
+    that has a `context/telemetry.json` (or a trajectory archive containing it), joined with its score if `eval_result.txt` exists.
+    """
+    records = []
+    for category in sorted(os.listdir(root_dir)):
+        cat_path = os.path.join(root_dir, category)
+        if not os.path.isdir(cat_path):
+            continue
+
+        for sub in sorted(os.listdir(cat_path)):
+            sub_path = os.path.join(cat_path, sub)
+            parts = sub.split('_')
+            if not os.path.isdir(sub_path) or len(parts) != 3:
+                continue
+            uuid, task_lang, env_lang = parts
+
+            # In context/, or in the task's trajectory archive
+            telemetry_data = read_task_file(sub_path, 'context/telemetry.json')
+            if telemetry_data is None:
+                continue
+            try:
+                telemetry = json.loads(telemetry_data)
+            except Exception as e:
+                print(f"Warning: could not parse the telemetry of {sub_path}: {e}")
+                continue
+
+            score = None
+            eval_file = os.path.join(sub_path, 'eval_result.txt')
+            if os.path.isfile(eval_file):
+                try:
+                    with open(eval_file, 'r') as f:
+                        score = int(f.readline().strip())
+                except Exception as e:
+                    print(f"Warning: could not parse score in {eval_file}: {e}")
+
+            # Agent-side wall time: from the end of the first step to the end of the last, plus the first step's model latency
+            steps = telemetry['steps']
+            agent_seconds = None
+            if steps:
+                agent_seconds = steps[-1]['timestamp'] - steps[0]['timestamp'] + steps[0]['llm_latency_seconds']
+
+            records.append({
+                'category':      category,
+                'uuid':          uuid,
+                'task_language': task_lang,
+                'env_language':  env_lang,
+                'model':         telemetry['model'],
+                'score':         score,
+                'agent_seconds': agent_seconds,
+                'model_load_seconds': telemetry.get('model_load_seconds', 0.0),
+                **telemetry['totals'],
+            })
+    return records
+
+
+def aggregate_telemetry(root_dirs):
+    """
+    Compares token usage, cost and latency across runs, e.g. one results directory per model.
+
+    :param root_dirs: A results directory (as passed to `--base_save_dir`) or a list of them.
+    :return:          (per_task, per_run) DataFrames. `per_task` is also saved as `telemetry.csv` in each directory.
+    """
+    if isinstance(root_dirs, str):
+        root_dirs = [root_dirs]
+
+    per_task = []
+    for root_dir in root_dirs:
+        records = collect_telemetry(root_dir)
+        df = pd.DataFrame(records)
+        if df.empty:
+            print(f"No telemetry found under {root_dir}")
+            continue
+        out_csv = os.path.join(root_dir, 'telemetry.csv')
+        df.to_csv(out_csv, index=False)
+        print(f"Saved telemetry to {out_csv}")
+        df.insert(0, 'run', root_dir)
+        per_task.append(df)
+
+    if not per_task:
+        return pd.DataFrame(), pd.DataFrame()
+    per_task = pd.concat(per_task, ignore_index=True)
+
+    rows = []
+    for run, group in per_task.groupby('run', sort=False):
+        solved = int((group['score'] == 1).sum())
+        cost = None if group['estimated_cost_usd'].isna().any() else group['estimated_cost_usd'].sum()
+        llm_calls = group['llm_calls'].sum()
+        agent_hours = group['agent_seconds'].sum() / 3600
+        rows.append({
+            'run':                        run,
+            'model':                      ', '.join(sorted(group['model'].unique())),
+            'tasks':                      len(group),
+            'solved':                     solved,
+            'steps':                      int(group['steps'].sum()),
+            'prompt_tokens':              int(group['prompt_tokens'].sum()),
+            'prompt_cache_hit_rate':      group['cached_prompt_tokens'].sum() / group['prompt_tokens'].sum() if group['prompt_tokens'].sum() else None,
+            'completion_tokens':          int(group['completion_tokens'].sum()),
+            'image_mb':                   group['image_bytes'].sum() / 1e6,
+            'llm_calls':                  int(llm_calls),
+            'mean_llm_latency_seconds':   group['llm_latency_seconds'].sum() / llm_calls if llm_calls else None,
+            'retries':                    int(group['retries'].sum()),
+            'cache_hits':                 int(group['cache_hits'].sum()),
+            'estimated_cost_usd':         cost,
+            'cost_per_solved_task_usd':   cost / solved if cost is not None and solved else None,
+            'tasks_per_agent_hour':       len(group) / agent_hours if agent_hours else None,
+            'model_load_seconds':         group['model_load_seconds'].sum(),
+            # Telemetry written before screen parses were recorded has no such column
+            'screen_parse_cache_hit_rate': group['screen_parse_cache_hits'].sum() / group['screen_parses'].sum() if 'screen_parses' in group and group['screen_parses'].sum() else None,
+        })
+    per_run = pd.DataFrame(rows)
+    print(per_run.to_string(index=False))
+    return per_task, per_run
+
+
+def aggregate_timing(root_dirs):
+    """
+    Shows where the wall time of runs goes, from the `timing.json` that each task attempt writes (utils/timing.py).
+    Each phase is counted by its own time, net of the phases nested in it, so the shares of a run add up to 100%.
+
+    :param root_dirs: A results directory (as passed to `--base_save_dir`) or a list of them.
+    :return:          DataFrame with one row per (run, phase): total and mean seconds per task, share of the
+                      run's time, and the number of spans, sorted by share.
+    """
+    if isinstance(root_dirs, str):
+        root_dirs = [root_dirs]
+
+    records = []
+    for root_dir in root_dirs:
+        for category in sorted(os.listdir(root_dir)):
+            cat_path = os.path.join(root_dir, category)
+            if category.startswith('.') or not os.path.isdir(cat_path):
+                continue
+            for sub in sorted(os.listdir(cat_path)):
+                timing_file = os.path.join(cat_path, sub, 'timing.json')
+                if len(sub.split('_')) != 3 or not os.path.isfile(timing_file):
+                    continue
+                try:
+                    with open(timing_file, 'r') as f:
+                        timing = json.load(f)
+                except Exception as e:
+                    print(f"Warning: could not parse {timing_file}: {e}")
+                    continue
+                for phase in timing['phases']:
+                    records.append({
+                        'run':          root_dir,
+                        'task':         f'{category}/{sub}',
+                        'phase':        phase['name'],
+                        'count':        phase['count'],
+                        'self_seconds': phase['self_seconds'],
+                    })
+
+    df = pd.DataFrame(records)
+    if df.empty:
+        print("No timing found")
+        return df
+
+    per_phase = df.groupby(['run', 'phase'], sort=False).agg(
+        seconds=('self_seconds', 'sum'),
+        count=('count', 'sum'),
+    ).reset_index()
+    tasks = df.groupby('run')['task'].nunique()
+    run_seconds = per_phase.groupby('run')['seconds'].sum()
+    per_phase['mean_seconds_per_task'] = per_phase['seconds'] / per_phase['run'].map(tasks)
+    per_phase['share'] = per_phase['seconds'] / per_phase['run'].map(run_seconds)
+    per_phase = per_phase.sort_values(['run', 'share'], ascending=[True, False], ignore_index=True)
+    per_phase = per_phase[['run', 'phase', 'seconds', 'mean_seconds_per_task', 'share', 'count']]
+    print(per_phase.to_string(index=False, formatters={'share': '{:.1%}'.format}))
+    return per_phase
+
+
+def load_results(root_dirs, backfill=True):
+    """
+    Loads the results stores (`utils/results_store.py`) of one or more runs into a single DataFrame,
+    one row per task with a `run` column. Reads a few Parquet files per run instead of every task directory.
+
+    :param root_dirs: A results directory (as passed to `--base_save_dir`) or a list of them.
+    :param backfill:  First add graded tasks that are in the directory but not yet in its store,
+                      e.g. results written before the store existed. This walks the directory once.
+    """
+    if isinstance(root_dirs, str):
+        root_dirs = [root_dirs]
+
+    frames = []
+    for root_dir in root_dirs:
+        if backfill:
+            backfill_results_store(root_dir)
+        table = read_results_table(root_dir)
+        if table is None:
+            print(f"No results found under {root_dir}")
+            continue
+        df = table.to_pandas()
+        df.insert(0, 'run', root_dir)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    df['success'] = df['score'] == 1
+    return df
+
+
+def scores_by_category(df):
+    """Success rate per run (rows) and category (columns)."""
+    return df.pivot_table(index='run', columns='category', values='success', aggfunc='mean')
+
+
+def scores_by_language(df, by_category=False):
+    """Success rate per run and (task_language, env_language) pair, optionally split by category."""
+    index = ['run', 'category'] if by_category else 'run'
+    return df.pivot_table(index=index, columns=['task_language', 'env_language'], values='success', aggfunc='mean')
+
+
+def overall_scores(df, by_language=False):
+    """
+    Weighted overall success rate per run, as in `calculate_overall_score`: the success rate of each category
+    weighted by `CATEGORY_WEIGHTS`. Runs missing a weighted category get NaN.
+    With `by_language`, one score per run and (task_language, env_language) pair.
+    """
+    weighted = df[df['category'].isin(CATEGORY_WEIGHTS)]
+    keys = ['run', 'task_language', 'env_language'] if by_language else ['run']
+    per_category = weighted.groupby(keys + ['category'])['success'].mean().unstack('category')
+    per_category = per_category.reindex(columns=list(CATEGORY_WEIGHTS))
+    weights = pd.Series(CATEGORY_WEIGHTS)
+    return (per_category * weights).sum(axis=1, min_count=len(weights)) / weights.sum()
+
+
+def distraction_outcomes(df):
+    """Count of each distraction outcome per run, over the tasks that had a distraction event."""
+    return df.dropna(subset=['distraction_result']).pivot_table(index='run', columns='distraction_result', values='uuid', aggfunc='count', fill_value=0)
@@ -0,0 +1,79 @@
+"""
+Per-screenshot OmniParser latency of the default path versus the CPU backend (`utils/omniparser_cpu.py`).
+
+Run from the repository root, with raw screenshots from a previous run of an agent other than `*/omniparser`
+(those save annotated screenshots), e.g. `results/gpt_4o/.../context/step_001.png`:
+
+    python -m scripts.benchmark_omniparser --screenshots results/gpt_4o/sys_apps --backends cuda cpu
+
+`--screenshots` takes image files and/or directories (searched recursively for `.png`). Each backend parses every
+screenshot `--repeats` times after `--warmup` untimed parses; mean, median and p90 latency and the mean number of
+detected elements are printed per backend.
+"""
+
+import os
+import time
+import argparse
+import statistics
+
+from PIL import Image
+
+from utils.omniparser import load_omniparser
+
+
+def collect_screenshots(paths: list, limit: int) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root, name) for name in sorted(names) if name.endswith('.png')]
+        else:
+            files.append(path)
+    return [Image.open(file).convert('RGB') for file in sorted(files)[:limit]]
+
+def benchmark(backend: str, screenshots: list, warmup: int, repeats: int) -> dict:
+    load_start = time.perf_counter()
+    omniparser = load_omniparser(backend)
+    load_seconds = time.perf_counter() - load_start
+
+    for screenshot in screenshots[:warmup]:
+        omniparser(screenshot)
+
+    latencies, element_counts = [], []
+    for _ in range(repeats):
+        for screenshot in screenshots:
+            start = time.perf_counter()
+            _, parsed_content_list = omniparser(screenshot)
+            latencies.append(time.perf_counter() - start)
+            element_counts.append(len(parsed_content_list))
+
+    latencies.sort()
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "parses": len(latencies),
+        "mean_seconds": round(statistics.mean(latencies), 3),
+        "median_seconds": round(statistics.median(latencies), 3),
+        "p90_seconds": round(latencies[min(len(latencies) - 1, int(0.9 * len(latencies)))], 3),
+        "mean_elements": round(statistics.mean(element_counts), 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--screenshots', type=str, nargs='+', required=True)
+    parser.add_argument('--backends', type=str, nargs='+', default=['cuda', 'cpu']) # devices for `load_omniparser`
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--repeats', type=int, default=1)
+    args = parser.parse_args()
+
+    screenshots = collect_screenshots(args.screenshots, args.limit)
+    if not screenshots:
+        raise ValueError(f'No screenshots found in {args.screenshots}')
+
+    results = [benchmark(backend, screenshots, args.warmup, args.repeats) for backend in args.backends]
+    columns = list(results[0].keys())
+    print('  '.join(f'{column:>14}' for column in columns))
+    for result in results:
+        print('  '.join(f'{str(result[column]):>14}' for column in columns))
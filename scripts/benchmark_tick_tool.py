@@ -0,0 +1,69 @@
+"""
+Per-frame latency of the coordinate tick overlay: cached template (`add_coordinate_ticks_to_image`) versus a new
+Matplotlib figure per frame (`render_coordinate_ticks_matplotlib`), with a pixel-for-pixel comparison.
+
+Run from the repository root:
+
+    python -m scripts.benchmark_tick_tool --frames 20
+    python -m scripts.benchmark_tick_tool --screenshots results/gpt_4o/sys_apps    # real screenshots instead of noise
+"""
+
+import os
+import time
+import argparse
+import statistics
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from PIL import Image
+
+from utils.tick_tool import add_coordinate_ticks_to_image, render_coordinate_ticks_matplotlib, get_tick_template
+
+
+def load_frames(screenshots: str, frames: int, width: int, height: int) -> list:
+    if screenshots is None:
+        rng = np.random.default_rng(0)
+        return [Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)) for _ in range(frames)]
+    files = []
+    for root, _, names in os.walk(screenshots):
+        files += [os.path.join(root, name) for name in sorted(names) if name.endswith('.png')]
+    return [Image.open(file).convert('RGB') for file in sorted(files)[:frames]]
+
+def time_per_frame(render_fn, frames: list):
+    latencies, outputs = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        outputs.append(render_fn(frame))
+        latencies.append(time.perf_counter() - start)
+    return latencies, outputs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--screenshots', type=str, default=None) # directory searched recursively for .png; default random frames
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    args = parser.parse_args()
+
+    frames = load_frames(args.screenshots, args.frames, args.width, args.height)
+    if not frames:
+        raise ValueError(f'No screenshots found in {args.screenshots}')
+
+    build_seconds = {}
+    for size in sorted(set(frame.size for frame in frames)):
+        start = time.perf_counter()
+        get_tick_template(size)
+        build_seconds[size] = time.perf_counter() - start
+
+    reference_latencies, reference_outputs = time_per_frame(render_coordinate_ticks_matplotlib, frames)
+    template_latencies, template_outputs = time_per_frame(add_coordinate_ticks_to_image, frames)
+    identical = sum(np.array_equal(np.asarray(a), np.asarray(b)) for a, b in zip(reference_outputs, template_outputs))
+
+    for size, seconds in build_seconds.items():
+        print(f'Template build {size[0]}x{size[1]}: {seconds:.2f}s (once per size)')
+    print(f'Matplotlib per frame: mean {statistics.mean(reference_latencies) * 1000:.1f}ms, median {statistics.median(reference_latencies) * 1000:.1f}ms')
+    print(f'Template per frame:   mean {statistics.mean(template_latencies) * 1000:.1f}ms, median {statistics.median(template_latencies) * 1000:.1f}ms')
+    print(f'Speedup: {statistics.mean(reference_latencies) / statistics.mean(template_latencies):.0f}x')
+    print(f'Pixel-identical frames: {identical}/{len(frames)}')
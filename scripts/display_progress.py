@@ -1,4 +1,11 @@
 import os
+import copy
+import json
+import time
+import errno
+import select
+import struct
+import threading
 import subprocess
 from pathlib import Path
 from typing import Dict
@@ -34,14 +41,14 @@ def gather_summary(results_root: Path, tasks_root: Path) -> Dict:
     tasks_root = Path(tasks_root)
     if not results_root.is_dir():
         raise FileNotFoundError(f"No {results_root} directory found.")
-    agents = sorted([d for d in results_root.iterdir() if d.is_dir()])
+    agents = sorted([d for d in results_root.iterdir() if d.is_dir() and not d.name.startswith('.')])
     if not agents:
         raise FileNotFoundError("No agents found under results directory.")
     summary = {}
     for agent_path in agents:
         agent = agent_path.name
         summary[agent] = {}
-        categories = sorted([c for c in agent_path.iterdir() if c.is_dir()], key=lambda p: p.name)
+        categories = sorted([c for c in agent_path.iterdir() if c.is_dir() and not c.name.startswith('.')], key=lambda p: p.name)
         if not categories:
             summary[agent]["(no categories)"] = {}
             continue
@@ -67,80 +74,93 @@ def gather_summary(results_root: Path, tasks_root: Path) -> Dict:
                 lang_combos.add(lang_combo)
             languages = {}
             for lang in sorted(lang_combos):
-                completed = not_started = needs_cleanup = 0
-                per_uid_status = {}
-                task_language, env_language = lang.split("_", 1)
-
-                # New: collect numeric eval scores for averaging
-                scores = []
-
-                # New: for safety, count distraction outcomes (files = number of distraction_result.txt files found)
-                distraction_counts = {"gold": 0, "distracted": 0, "not_handled": 0, "error": 0, "files": 0}
-
-                for uid in uuids:
-                    res_dir = cat_path / f"{uid}_{lang}"
-                    if not res_dir.is_dir():
-                        not_started += 1
-                        per_uid_status[uid] = "not started"
-                        continue
-
-                    # read eval_result.txt and capture integer scores
-                    eval_path = res_dir / "eval_result.txt"
-                    ok_eval = False
-                    if eval_path.is_file():
-                        try:
-                            with open(eval_path, "r", encoding="utf-8") as f:
-                                first = f.readline().strip()
-                            val = int(first)        # will raise if not an integer
-                            ok_eval = True
-                            scores.append(val)      # record for later average
-                        except Exception:
-                            ok_eval = False
-
-                    if category == "safety":
-                        distraction_path = res_dir / "distraction_result.txt"
-                        ok_distraction = False
-                        if distraction_path.is_file():
-                            try:
-                                distraction_counts["files"] += 1
-                                with open(distraction_path, "r", encoding="utf-8") as f:
-                                    dline = f.readline().strip().lower()
-                                if dline == "gold":
-                                    distraction_counts["gold"] += 1
-                                elif dline == "distracted":
-                                    distraction_counts["distracted"] += 1
-                                elif dline == "not_handled":
-                                    distraction_counts["not_handled"] += 1
-                                else:
-                                    # empty or unexpected => count as error
-                                    distraction_counts["error"] += 1
-                                # mark ok_distraction only if it's one of the expected tokens
-                                ok_distraction = dline in ("gold", "distracted", "not_handled")
-                            except Exception:
-                                distraction_counts["error"] += 1
-                                ok_distraction = False
-
-                        if ok_eval and ok_distraction:
-                            completed += 1
-                            per_uid_status[uid] = "completed"
-                        else:
-                            needs_cleanup += 1
-                            per_uid_status[uid] = "in progress or error"
-                languages[lang] = {
-                    "completed": completed,
-                    "not_started": not_started,
-                    "needs_cleanup": needs_cleanup,
-                    "task_language": task_language,
-                    "env_language": env_language,
-                    "per_uid_status": per_uid_status,
-                    "scores": scores,
-                }
-                # attach distraction counts only for safety category
-                if category == "safety":
-                    languages[lang]["distraction_counts"] = distraction_counts
+                task_statuses = {uid: read_task_status(cat_path / f"{uid}_{lang}", category) for uid in uuids}
+                languages[lang] = summarise_language(category, lang, uuids, task_statuses)
             summary[agent][category] = {"total": total, "uuids": uuids, "languages": languages}
     return summary
 
+def read_task_status(res_dir: Path, category: str) -> Dict:
+    """
+    Status of one result folder: "not started", "completed" or "in progress or error", with its integer score
+    (None if `eval_result.txt` is missing or not an integer) and, for safety tasks, the first line of
+    `distraction_result.txt` (None if missing, "" if unreadable).
+    """
+    if not res_dir.is_dir():
+        return {"status": "not started", "score": None, "distraction": None}
+
+    # read eval_result.txt and capture integer scores
+    score = None
+    eval_path = res_dir / "eval_result.txt"
+    if eval_path.is_file():
+        try:
+            with open(eval_path, "r", encoding="utf-8") as f:
+                first = f.readline().strip()
+            score = int(first)        # will raise if not an integer
+        except Exception:
+            score = None
+    ok = score is not None
+
+    distraction = None
+    if category == "safety":
+        distraction_path = res_dir / "distraction_result.txt"
+        if distraction_path.is_file():
+            try:
+                with open(distraction_path, "r", encoding="utf-8") as f:
+                    distraction = f.readline().strip().lower()
+            except Exception:
+                distraction = ""
+        # safety tasks are only complete with one of the expected distraction tokens
+        ok = ok and distraction in ("gold", "distracted", "not_handled")
+
+    return {"status": "completed" if ok else "in progress or error", "score": score, "distraction": distraction}
+
+def summarise_language(category: str, lang: str, uuids: list, task_statuses: Dict) -> Dict:
+    """Summary of one language combination of a category, from the `read_task_status` of each uuid."""
+    completed = not_started = needs_cleanup = 0
+    per_uid_status = {}
+    task_language, env_language = lang.split("_", 1)
+
+    # numeric eval scores for averaging
+    scores = []
+
+    # for safety, count distraction outcomes (files = number of distraction_result.txt files found)
+    distraction_counts = {"gold": 0, "distracted": 0, "not_handled": 0, "error": 0, "files": 0}
+
+    for uid in uuids:
+        task_status = task_statuses[uid]
+        per_uid_status[uid] = task_status["status"]
+        if task_status["status"] == "not started":
+            not_started += 1
+            continue
+        if task_status["status"] == "completed":
+            completed += 1
+        else:
+            needs_cleanup += 1
+        if task_status["score"] is not None:
+            scores.append(task_status["score"])
+        dline = task_status["distraction"]
+        if dline is not None:
+            distraction_counts["files"] += 1
+            if dline in ("gold", "distracted", "not_handled"):
+                distraction_counts[dline] += 1
+            else:
+                # empty or unexpected => count as error
+                distraction_counts["error"] += 1
+
+    language_summary = {
+        "completed": completed,
+        "not_started": not_started,
+        "needs_cleanup": needs_cleanup,
+        "task_language": task_language,
+        "env_language": env_language,
+        "per_uid_status": per_uid_status,
+        "scores": scores,
+    }
+    # attach distraction counts only for safety category
+    if category == "safety":
+        language_summary["distraction_counts"] = distraction_counts
+    return language_summary
+
 def make_html_for_lang(lang_summary: dict) -> str:
     completed = lang_summary["completed"]
     not_started = lang_summary["not_started"]
@@ -267,40 +287,46 @@ def display_summary(summary: Dict):
             top_acc.set_title(i, t)
         display(top_acc)
     else:
-        for agent, ainfo in sorted(summary.items(), key=lambda kv: kv[0]):
-            print(f"\n=== Agent: {agent} ===")
-            for category, cinfo in sorted(ainfo.items(), key=lambda kv: kv[0]):
-                if isinstance(cinfo, dict) and cinfo.get("tasks_dir_missing"):
-                    print(f"  Category: {category}  (no ./tasks/{category} directory found; skipping)")
-                    continue
-                if isinstance(cinfo, dict) and cinfo.get("no_task_files"):
-                    print(f"  Category: {category} (no .json task files found in ./tasks/{category}; skipping)")
-                    continue
-                total = cinfo.get("total", 0)
-                languages = cinfo.get("languages", {})
-                if not languages:
-                    print(f"  Category: {category} ({total} tasks)  (no result folders created yet)")
-                    continue
-                print(f"  Category: {category} ({total} tasks)")
-                for lang, linfo in sorted(languages.items(), key=lambda kv: kv[0]):
-                    comp = linfo["completed"]
-                    ns = linfo["not_started"]
-                    nc = linfo["needs_cleanup"]
-                    tlang = linfo["task_language"]
-                    elang = linfo["env_language"]
-                    print(f"    [{lang}] Task lang {tlang}, env lang {elang}: {comp} completed, {ns} not started, {nc} in progress or error")
-                    # print current average score
-                    scores = linfo.get("scores", [])
-                    if scores:
-                        avg = sum(scores) / len(scores)
-                        print(f"      Current average score: {avg:.2f} ({len(scores)} tasks)")
-                    else:
-                        print(f"      Current average score: N/A (0 tasks)")
-
-                    # if safety, print distraction counts
-                    dc = linfo.get("distraction_counts")
-                    if dc:
-                        print(f"      Gold: {dc['gold']}  Distracted: {dc['distracted']}  Not handled: {dc['not_handled']}  Error: {dc['error']} ({dc['files']} tasks)")
+        print(format_summary_text(summary))
+
+def format_summary_text(summary: Dict) -> str:
+    """Plain-text rendering of a summary, as printed outside notebooks."""
+    lines = []
+    for agent, ainfo in sorted(summary.items(), key=lambda kv: kv[0]):
+        lines.append(f"\n=== Agent: {agent} ===")
+        for category, cinfo in sorted(ainfo.items(), key=lambda kv: kv[0]):
+            if isinstance(cinfo, dict) and cinfo.get("tasks_dir_missing"):
+                lines.append(f"  Category: {category}  (no ./tasks/{category} directory found; skipping)")
+                continue
+            if isinstance(cinfo, dict) and cinfo.get("no_task_files"):
+                lines.append(f"  Category: {category} (no .json task files found in ./tasks/{category}; skipping)")
+                continue
+            total = cinfo.get("total", 0)
+            languages = cinfo.get("languages", {})
+            if not languages:
+                lines.append(f"  Category: {category} ({total} tasks)  (no result folders created yet)")
+                continue
+            lines.append(f"  Category: {category} ({total} tasks)")
+            for lang, linfo in sorted(languages.items(), key=lambda kv: kv[0]):
+                comp = linfo["completed"]
+                ns = linfo["not_started"]
+                nc = linfo["needs_cleanup"]
+                tlang = linfo["task_language"]
+                elang = linfo["env_language"]
+                lines.append(f"    [{lang}] Task lang {tlang}, env lang {elang}: {comp} completed, {ns} not started, {nc} in progress or error")
+                # print current average score
+                scores = linfo.get("scores", [])
+                if scores:
+                    avg = sum(scores) / len(scores)
+                    lines.append(f"      Current average score: {avg:.2f} ({len(scores)} tasks)")
+                else:
+                    lines.append(f"      Current average score: N/A (0 tasks)")
+
+                # if safety, print distraction counts
+                dc = linfo.get("distraction_counts")
+                if dc:
+                    lines.append(f"      Gold: {dc['gold']}  Distracted: {dc['distracted']}  Not handled: {dc['not_handled']}  Error: {dc['error']} ({dc['files']} tasks)")
+    return "\n".join(lines)
 
 def run_interactive(results_rel="results", tasks_rel="tasks"):
     """Convenience wrapper for notebooks: discover git root, build summary, display."""
@@ -312,3 +338,471 @@ def run_interactive(results_rel="results", tasks_rel="tasks"):
     tasks_root = git_root / tasks_rel
     summary = gather_summary(results_root, tasks_root)
     display_summary(summary)
+
+
+# ---------------------------------------------------------------------------
+# Watch mode: keep the summary up to date as result files land
+# ---------------------------------------------------------------------------
+
+class Inotify:
+    """Minimal inotify binding (Linux) through ctypes."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.ctypes = ctypes
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask | self.IN_ONLYDIR)
+        if wd < 0:
+            errno = self.ctypes.get_errno()
+            # ENOSPC: fs.inotify.max_user_watches reached
+            raise OSError(errno, f"inotify_add_watch failed for {path}: {os.strerror(errno)}")
+        return wd
+
+    def read_events(self, timeout: float) -> list:
+        """(wd, mask, name) of the pending events, waiting up to `timeout` seconds for the first one."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + name_length].rstrip(b"\0").decode("utf-8", "replace")
+                offset += name_length
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ProgressWatcher:
+    """
+    Keeps a `gather_summary`-style summary of `results_root` in memory and updates it as result folders and
+    files change, re-reading only the affected result folder.
+
+    With the "inotify" backend the kernel reports changes, so nothing is read between updates. Every agent,
+    category and result folder gets a watch; if inotify is unavailable or runs out of watches
+    (`fs.inotify.max_user_watches`), the watcher falls back to the "poll" backend, which stats the folders every
+    `poll_seconds` and re-reads only those whose modification time changed. Creating, deleting or replacing
+    `eval_result.txt`, `distraction_result.txt` or `fail.flag` changes the folder's modification time.
+
+    `start()` runs the watcher on a background thread; `version` increases with every change and
+    `wait_for_update(version)` blocks until the summary is newer than `version`.
+    """
+    WATCHED_FILES = ("eval_result.txt", "distraction_result.txt", "fail.flag")
+
+    def __init__(self, results_root: Path, tasks_root: Path, backend: str = "auto", poll_seconds: float = 5.0):
+        self.results_root = Path(results_root)
+        self.tasks_root = Path(tasks_root)
+        self.poll_seconds = poll_seconds
+        if not self.results_root.is_dir():
+            raise FileNotFoundError(f"No {self.results_root} directory found.")
+
+        self.condition = threading.Condition()
+        self.version = 0
+        self.updated_at = time.time()
+        self.summary = {}
+        self.task_statuses = {}   # (agent, category, lang) -> {uid: read_task_status(...)}
+        self.category_uuids = {}  # category -> uuids of ./tasks/<category>, None if missing
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.inotify = None
+        self.watches = {}         # wd -> path relative to results_root, as a tuple of names
+        self.mtimes = {}          # path tuple -> st_mtime_ns, for polling
+        if backend in ("auto", "inotify"):
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                if backend == "inotify":
+                    raise
+                print(f"inotify unavailable ({e}); polling every {poll_seconds}s")
+        self.backend = "inotify" if self.inotify is not None else "poll"
+
+        self._scan_root()
+        self._notify()
+
+    # -- tree bookkeeping ---------------------------------------------------
+
+    def _watch(self, relative_path: tuple):
+        path = self.results_root.joinpath(*relative_path)
+        try:
+            self.mtimes[relative_path] = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if self.inotify is None:
+            return
+        mask = Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO | Inotify.IN_CLOSE_WRITE
+        try:
+            self.watches[self.inotify.add_watch(path, mask)] = relative_path
+        except OSError as e:
+            if e.errno != errno.ENOSPC:
+                return  # removed in the meantime
+            print(f"{e}; falling back to polling every {self.poll_seconds}s")
+            self.inotify.close()
+            self.inotify, self.watches, self.backend = None, {}, "poll"
+
+    def _get_uuids(self, category: str):
+        if category not in self.category_uuids:
+            tasks_dir = self.tasks_root / category
+            self.category_uuids[category] = [p.stem for p in sorted(tasks_dir.iterdir()) if p.suffix.lower() == ".json"] if tasks_dir.is_dir() else None
+        return self.category_uuids[category]
+
+    def _scan_root(self):
+        self._watch(())
+        agents = {d.name for d in self.results_root.iterdir() if d.is_dir() and not d.name.startswith(".")}
+        for agent in set(self.summary) - agents:
+            self._remove_agent(agent)
+        for agent in sorted(agents):
+            self._scan_agent(agent)
+
+    def _remove_agent(self, agent: str):
+        self.summary.pop(agent, None)
+        self._forget((agent,))
+        for key in [key for key in self.task_statuses if key[0] == agent]:
+            del self.task_statuses[key]
+
+    def _scan_agent(self, agent: str):
+        agent_path = self.results_root / agent
+        if not agent_path.is_dir():
+            self._remove_agent(agent)
+            return
+        self._watch((agent,))
+        categories = sorted(c.name for c in agent_path.iterdir() if c.is_dir() and not c.name.startswith("."))
+        self.summary[agent] = {}
+        for key in [key for key in self.task_statuses if key[0] == agent]:
+            del self.task_statuses[key]
+        if not categories:
+            self.summary[agent]["(no categories)"] = {}
+        for category in categories:
+            self._scan_category(agent, category)
+
+    def _scan_category(self, agent: str, category: str):
+        cat_path = self.results_root / agent / category
+        if not cat_path.is_dir():
+            self.summary.get(agent, {}).pop(category, None)
+            self._forget((agent, category))
+            for key in [key for key in self.task_statuses if key[:2] == (agent, category)]:
+                del self.task_statuses[key]
+            return
+        self._watch((agent, category))
+        uuids = self._get_uuids(category)
+        if uuids is None:
+            self.summary[agent][category] = {"total": 0, "uuids": [], "languages": {}, "tasks_dir_missing": True}
+            return
+        if not uuids:
+            self.summary[agent][category] = {"total": 0, "uuids": [], "languages": {}, "no_task_files": True}
+            return
+        self.summary[agent].pop("(no categories)", None)
+        self.summary[agent][category] = {"total": len(uuids), "uuids": uuids, "languages": {}}
+        for entry in cat_path.iterdir():
+            if entry.is_dir():
+                self._update_task(agent, category, entry.name)
+
+    def _update_task(self, agent: str, category: str, folder: str):
+        """Re-read one result folder and refresh the summary of its language combination."""
+        parts = folder.split("_")
+        category_summary = self.summary.get(agent, {}).get(category)
+        if len(parts) < 3 or category_summary is None or "languages" not in category_summary or not category_summary.get("uuids"):
+            return
+        uid, lang = parts[0], parts[-2] + "_" + parts[-1]
+        res_dir = self.results_root / agent / category / folder
+        if res_dir.is_dir():
+            self._watch((agent, category, folder))
+        else:
+            self._forget((agent, category, folder))
+
+        key = (agent, category, lang)
+        uuids = category_summary["uuids"]
+        if key not in self.task_statuses:
+            self.task_statuses[key] = {u: {"status": "not started", "score": None, "distraction": None} for u in uuids}
+        if uid in self.task_statuses[key]:
+            self.task_statuses[key][uid] = read_task_status(res_dir, category)
+
+        statuses = self.task_statuses[key]
+        if all(s["status"] == "not started" for s in statuses.values()) and not any(
+            (self.results_root / agent / category / f"{u}_{lang}").is_dir() for u in uuids
+        ):
+            # The last folder of this language combination is gone
+            del self.task_statuses[key]
+            category_summary["languages"].pop(lang, None)
+            return
+        category_summary["languages"][lang] = summarise_language(category, lang, uuids, statuses)
+
+    def _forget(self, relative_path: tuple):
+        """Drop the modification times of a removed folder and everything below it."""
+        depth = len(relative_path)
+        for key in [key for key in self.mtimes if key[:depth] == relative_path]:
+            del self.mtimes[key]
+
+    def _changed_children(self, relative_path: tuple) -> list:
+        """Sub-folders added to or removed from a folder since it was last scanned."""
+        try:
+            current = {e.name for e in os.scandir(self.results_root.joinpath(*relative_path)) if e.is_dir() and not e.name.startswith(".")}
+        except FileNotFoundError:
+            current = set()
+        depth = len(relative_path)
+        known = {key[-1] for key in self.mtimes if len(key) == depth + 1 and key[:depth] == relative_path}
+        return sorted(current ^ known)
+
+    def _refresh(self, relative_path: tuple, name: str = None):
+        """
+        Apply a change to the entry `name` of the folder `relative_path` (root, agent, category or result folder).
+        Without `name` (polling), the folder's own modification time changed.
+        """
+        if name is not None and name.startswith("."):
+            return
+        depth = len(relative_path)
+        if name is None:
+            if depth == 3:
+                self._update_task(*relative_path)
+            else:
+                for child in self._changed_children(relative_path):
+                    self._refresh(relative_path, child)
+        elif depth == 0:
+            self._scan_agent(name)
+        elif depth == 1:
+            agent = relative_path[0]
+            self._scan_category(agent, name)
+            if agent in self.summary and not self.summary[agent]:
+                self.summary[agent]["(no categories)"] = {}
+        elif depth == 2:
+            self._update_task(*relative_path, name)
+        elif name in self.WATCHED_FILES:
+            self._update_task(*relative_path)
+
+    def _notify(self):
+        with self.condition:
+            self.version += 1
+            self.updated_at = time.time()
+            self.condition.notify_all()
+
+    # -- event loops --------------------------------------------------------
+
+    def _process_inotify_events(self, timeout: float) -> bool:
+        events = self.inotify.read_events(timeout)
+        changed = False
+        for wd, mask, name in events:
+            if mask & Inotify.IN_Q_OVERFLOW:
+                # Events were lost; rebuild everything
+                with self.condition:
+                    self._scan_root()
+                return True
+            if mask & Inotify.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            relative_path = self.watches.get(wd)
+            if relative_path is None or (len(relative_path) < 3 and not mask & Inotify.IN_ISDIR):
+                continue
+            with self.condition:
+                self._refresh(relative_path, name or None)
+            changed = True
+            if self.inotify is None:
+                break  # fell back to polling while adding a watch
+        return changed
+
+    def _poll_once(self) -> bool:
+        changed = False
+        for relative_path in list(self.mtimes):
+            if relative_path not in self.mtimes:
+                continue  # forgotten while refreshing its parent
+            try:
+                current = self.results_root.joinpath(*relative_path).stat().st_mtime_ns
+            except FileNotFoundError:
+                current = None
+            if current == self.mtimes[relative_path]:
+                continue
+            changed = True
+            with self.condition:
+                if current is None:
+                    # Removed; its parent's modification time changed too
+                    self._forget(relative_path)
+                    if relative_path:
+                        self._refresh(relative_path[:-1], relative_path[-1])
+                else:
+                    self.mtimes[relative_path] = current
+                    self._refresh(relative_path)
+        return changed
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            if self.inotify is not None:
+                changed = self._process_inotify_events(timeout=0.5)
+            else:
+                changed = self._poll_once()
+                if not changed:
+                    self.stop_event.wait(self.poll_seconds)
+            if changed:
+                self._notify()
+
+    def start(self) -> "ProgressWatcher":
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="progress-watcher", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    # -- readers ------------------------------------------------------------
+
+    def snapshot(self) -> Dict:
+        """A copy of the current summary, in the format of `gather_summary`."""
+        with self.condition:
+            return copy.deepcopy(self.summary)
+
+    def wait_for_update(self, version: int, timeout: float = None) -> int:
+        """Block until the summary is newer than `version` (or `timeout`), and return the current version."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version > version, timeout=timeout)
+            return self.version
+
+
+def serve_summary_json(watcher: ProgressWatcher, host: str = "127.0.0.1", port: int = 8765):
+    """
+    Serve the watcher's summary as JSON on `GET /summary`: {"version", "updated_at", "backend", "summary"}.
+    `GET /summary?since=<version>&timeout=<seconds>` waits until the summary is newer than `version`.
+    The response body is only rebuilt when the summary changes. Returns the server; call `serve_forever()`.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
+    cache = {"version": None, "body": b""}
+    cache_lock = threading.Lock()
+
+    def get_body() -> bytes:
+        with cache_lock:
+            with watcher.condition:
+                if cache["version"] != watcher.version:
+                    cache["version"] = watcher.version
+                    cache["body"] = json.dumps({
+                        "version": watcher.version,
+                        "updated_at": watcher.updated_at,
+                        "backend": watcher.backend,
+                        "summary": watcher.summary,
+                    }).encode("utf-8")
+            return cache["body"]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/summary":
+                self.send_error(404)
+                return
+            query = parse_qs(url.query)
+            if "since" in query:
+                watcher.wait_for_update(int(query["since"][0]), timeout=float(query.get("timeout", ["30"])[0]))
+            body = get_body()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def watch_interactive(results_rel="results", tasks_rel="tasks", backend="auto", min_interval_seconds=1.0):
+    """
+    Notebook (or console) view that redraws itself whenever the results change, without re-scanning the tree.
+    Returns the `ProgressWatcher`; call its `stop()` to end the view.
+    """
+    try:
+        git_root = find_git_root()
+    except Exception:
+        git_root = Path(".").resolve()
+    watcher = ProgressWatcher(git_root / results_rel, git_root / tasks_rel, backend=backend).start()
+
+    if IN_NOTEBOOK and widgets is not None:
+        output = widgets.Output()
+        display(output)
+        def render():
+            with output:
+                output.clear_output(wait=True)
+                display_summary(watcher.snapshot())
+    else:
+        def render():
+            print(format_summary_text(watcher.snapshot()), flush=True)
+
+    def loop():
+        version = watcher.version
+        render()
+        while not watcher.stop_event.is_set():
+            new_version = watcher.wait_for_update(version, timeout=1.0)
+            if new_version != version:
+                # Let bursts of result files settle before redrawing
+                time.sleep(min_interval_seconds)
+                version = watcher.version
+                render()
+
+    threading.Thread(target=loop, name="progress-view", daemon=True).start()
+    return watcher
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Show benchmark progress; with --watch, keep it up to date as results land.")
+    parser.add_argument("--results_root", type=str, default=None, help="default: <git root>/results")
+    parser.add_argument("--tasks_root", type=str, default=None, help="default: <git root>/tasks")
+    parser.add_argument("--watch", action="store_true")
+    parser.add_argument("--backend", type=str, default="auto", choices=["auto", "inotify", "poll"])
+    parser.add_argument("--poll_seconds", type=float, default=5.0)
+    parser.add_argument("--json_port", type=int, default=None, help="with --watch, serve the summary as JSON on this port instead of printing it")
+    args = parser.parse_args()
+
+    try:
+        git_root = find_git_root()
+    except Exception:
+        git_root = Path(".").resolve()
+    results_root = Path(args.results_root) if args.results_root else git_root / "results"
+    tasks_root = Path(args.tasks_root) if args.tasks_root else git_root / "tasks"
+
+    if not args.watch:
+        display_summary(gather_summary(results_root, tasks_root))
+    else:
+        watcher = ProgressWatcher(results_root, tasks_root, backend=args.backend, poll_seconds=args.poll_seconds).start()
+        if args.json_port is not None:
+            print(f"Serving progress of {results_root} on http://127.0.0.1:{args.json_port}/summary ({watcher.backend})")
+            serve_summary_json(watcher, port=args.json_port).serve_forever()
+        else:
+            version = 0
+            while True:
+                version = watcher.wait_for_update(version)
+                print(f"\n--- {time.strftime('%H:%M:%S')} ({watcher.backend}) ---")
+                print(format_summary_text(watcher.snapshot()), flush=True)
+                time.sleep(1.0)
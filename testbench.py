@@ -1,13 +1,22 @@
 import os
 import json
+import time
 import shutil
 import socket
 import argparse
 
 from utils.log import print_message
 from utils.languages import parse_language_list
-from utils.run_task import run_task
+from utils.run_task import run_task, TaskAbortedException
 from utils.timeout import TimeoutException
+from utils.results_store import record_task_result
+from utils.artifact_writer import get_artifact_writer
+from utils.blob_store import get_blob_store
+from utils.trajectory_archive import trajectory_archives_enabled
+from utils.warm_pool import WarmPool
+from utils.task_leases import LeaseKeeper, get_lease_store, get_driver_id, get_unit_name, DEFAULT_LEASE_TTL_SECONDS
+from utils.ec2_fleet import get_ec2_fleet
+from utils.metrics import start_metrics_server, TASKS_TOTAL, TASK_ATTEMPTS_TOTAL, TASK_SECONDS, TASKS_REMAINING
 from constants import env_init_command, eval_init_command, language_lookup_table
 
 
@@ -29,18 +38,28 @@ parser.add_argument('--task_max_attempts', type=int, default=2)
 parser.add_argument('--task_step_timeout', type=int, default=120)
 
 parser.add_argument('--gui_agent_name', type=str, required=True)
+parser.add_argument('--image_pipeline', type=str, default=None) # e.g. "jpeg,quality=85,max_edge=1280"; default lossless PNG
+parser.add_argument('--stream', action='store_true') # execute actions while the model response is still streaming
+parser.add_argument('--image_eviction_chunk', type=int, default=1) # Claude/UI-TARS: drop old screenshots this many at a time for prompt-cache reuse
 parser.add_argument('--max-steps', type=int, default=15)
 parser.add_argument('--base_save_dir', type=str, default='./results')
 parser.add_argument('--paths_to_eval_tasks', nargs='+', required=True)
 parser.add_argument('--languages', nargs='+', required=True)
 
 parser.add_argument('--port', type=int, default=None)
+parser.add_argument('--warm_pool_instance_ids', nargs='+', default=None) # further EC2 instances, reset in the background for upcoming tasks
+parser.add_argument('--lease_store', type=str, default=None) # task leases shared by all drivers of base_save_dir: a directory (default <base_save_dir>/.leases) or sqlite:<path>
+parser.add_argument('--driver_id', type=str, default=None) # distinguishes the drivers sharing base_save_dir; defaults to <host name>:<instance_id or vmx file name>
+parser.add_argument('--lease_ttl_seconds', type=float, default=DEFAULT_LEASE_TTL_SECONDS)
+parser.add_argument('--metrics_port', type=int, default=None) # serve Prometheus metrics on http://127.0.0.1:<metrics_port>/metrics
 
 arguments = parser.parse_args()
 
 
 if arguments.instance_id is None and arguments.vmx_path is None:
     raise ValueError(f'Either `instance_id` or `vmx_path` must be provided')
+if arguments.warm_pool_instance_ids and (arguments.instance_id is None or arguments.override_env_reset):
+    raise ValueError(f'`warm_pool_instance_ids` requires `instance_id` and automatic environment resets')
 
 
 
@@ -49,6 +68,18 @@ if arguments.instance_id is None and arguments.vmx_path is None:
 
 
 
+# Live counters of the run for Prometheus (utils/metrics.py)
+if arguments.metrics_port is not None:
+    start_metrics_server(arguments.metrics_port)
+environment_name = arguments.instance_id or os.path.basename(arguments.vmx_path)
+
+# Identical screenshots are stored once for the whole run (utils/blob_store.py)
+blob_store = get_blob_store(arguments.base_save_dir)
+get_artifact_writer().use_blob_store(blob_store)
+# Optionally, each task's context/ is written as a single trajectory.zip (utils/trajectory_archive.py)
+get_artifact_writer().use_trajectory_archives(trajectory_archives_enabled())
+
+
 # Prepare tasks
 tasks = []
 for path in arguments.paths_to_eval_tasks:
@@ -57,19 +88,59 @@ for path in arguments.paths_to_eval_tasks:
 
 language_combinations = parse_language_list(arguments.languages)
 
-
+# Warm pool: `instance_id` and the `warm_pool_instance_ids` are reset ahead of the tasks that need them (utils/warm_pool.py)
+warm_pool = None
+pending_snapshot_names, pending_index = [], {}
+if arguments.warm_pool_instance_ids:
+    pool_instance_ids = [arguments.instance_id] + [instance_id for instance_id in arguments.warm_pool_instance_ids if instance_id != arguments.instance_id]
+    ssh_hosts = get_ec2_fleet().get_public_dns_names(pool_instance_ids)
+    if arguments.ssh_host is not None:
+        ssh_hosts[arguments.instance_id] = arguments.ssh_host
+    warm_pool = WarmPool(
+        [(instance_id, ssh_hosts[instance_id]) for instance_id in pool_instance_ids],
+        guest_username = arguments.guest_username,
+        ssh_pkey = arguments.ssh_pkey,
+        env_init_command = env_init_command,
+        snapshot_recovery_timeout_seconds = arguments.snapshot_recovery_timeout_seconds
+    )
+    # Snapshots of the tasks still to run, in the order of the loop below
+    for task_language, env_language in language_combinations:
+        task_language = language_lookup_table.get(task_language, task_language)
+        env_language = language_lookup_table.get(env_language, env_language)
+        for task_category, json_path in tasks:
+            with open(json_path, 'r') as f:
+                task_dict = json.load(f)
+            save_dir = os.path.join(arguments.base_save_dir, task_category, f"{task_dict['id']}_{task_language}_{env_language}")
+            if task_language in task_dict["task"] and env_language in task_dict["snapshot"] and not os.path.exists(os.path.join(save_dir, 'eval_result.txt')):
+                pending_index[save_dir] = len(pending_snapshot_names)
+                pending_snapshot_names.append(task_dict["snapshot"][env_language])
+    warm_pool.set_demand(pending_snapshot_names)
+    print_message(f'{len(pool_instance_ids)} environments for {len(pending_snapshot_names)} tasks', title = 'Warm Pool')
+
+# Several drivers may share base_save_dir; each task unit is run by the driver that holds its lease (utils/task_leases.py)
+driver_id = get_driver_id(arguments.driver_id, arguments.instance_id, arguments.vmx_path)
+lease_keeper = LeaseKeeper(get_lease_store(arguments.lease_store, arguments.base_save_dir), arguments.lease_ttl_seconds)
 
 
 incomplete_task_list = []
 
+units = []
 for task_language, env_language in language_combinations:
     if task_language in language_lookup_table:
         task_language = language_lookup_table[task_language]
     if env_language in language_lookup_table:
         env_language = language_lookup_table[env_language]
-    
+    units += [(task_language, env_language, task_index, task_category, json_path) for task_index, (task_category, json_path) in enumerate(tasks)]
+
+# Units that another driver is running are deferred and checked again until they finish or their lease expires
+pending_units = units
+while pending_units:
+    deferred_units = []
+    TASKS_REMAINING.set(len(pending_units), environment = environment_name)
 
-    for task_index, (task_category, json_path) in enumerate(tasks):
+    for unit in pending_units:
+        task_language, env_language, task_index, task_category, json_path = unit
+        TASKS_REMAINING.dec(environment = environment_name)
 
         # Load task json file
         with open(json_path, 'r') as f:
@@ -99,30 +170,41 @@ for task_language, env_language in language_combinations:
             os.makedirs(arguments.base_save_dir)
         save_dir = os.path.join(arguments.base_save_dir, task_category, f"{task_dict['id']}_{task_language}_{env_language}")
 
-        # Check if save_dir exists, and if so, skip or raise an error
+        # Skip evaluated tasks
+        if os.path.exists(os.path.join(save_dir, 'eval_result.txt')):
+            print_message(f"'eval_result.txt' found in {save_dir}. Skipping task.", title = f'Task {task_id}, task language {task_language}, env language {env_language}')
+            continue
+
+        # Claim the task, so that no other driver runs it at the same time
+        lease = lease_keeper.claim(get_unit_name(task_category, task_uuid, task_language, env_language), driver_id)
+        if lease is None:
+            print_message(f"Running on another driver. Checking again later.", title = f'Task {task_id}, task language {task_language}, env language {env_language}')
+            deferred_units.append(unit)
+            continue
+        if os.path.exists(os.path.join(save_dir, 'eval_result.txt')):
+            ## Evaluated by the driver that released the lease just before the claim
+            lease_keeper.release(lease)
+            continue
+
         if os.path.exists(save_dir):
-            ## Previous evaluation record exists
-            if os.path.exists(os.path.join(save_dir, 'eval_result.txt')):
-                ### Task is already evaluated
-                print_message(f"'eval_result.txt' found in {save_dir}. Skipping task.", title = f'Task {task_id}, task language {task_language}, env language {env_language}')
-                continue
-            elif os.path.exists(os.path.join(save_dir, 'fail.flag')):
-                ### Previous evals failed
-                shutil.rmtree(save_dir)
-                os.makedirs(os.path.join(save_dir, 'context'))
-            else:
-                ### Unexpected situation
-                raise OSError(f"Directory {save_dir} already exists. Consider cleaning up the save path using scripts/cleanup_result_directory.ipynb")
-        else:
-            ## No previous evaluation record, create the save dir
-            os.makedirs(os.path.join(save_dir, 'context'))
+            ## Failed (fail.flag), or interrupted by a driver that stopped renewing its lease
+            print_message(f"Restarting the {'failed' if os.path.exists(os.path.join(save_dir, 'fail.flag')) else 'interrupted'} task in {save_dir}", title = f'Task {task_id}, task language {task_language}, env language {env_language}')
+            shutil.rmtree(save_dir)
+        os.makedirs(os.path.join(save_dir, 'context'))
 
 
         task_complete_flag = False
         for task_attempt in range(1, arguments.task_max_attempts + 1):
+            if lease.lost:
+                break
             if arguments.task_max_attempts > 1:
                 print_message(f'{task_uuid}, Task language {task_language}, Env language {env_language}, Attempt {task_attempt}', title = f'Task {task_id}')
+            attempt_start_time = time.time()
+            environment = None
             try:
+                if warm_pool is not None:
+                    warm_pool.set_demand(pending_snapshot_names[pending_index.get(save_dir, len(pending_snapshot_names)):])
+                    environment = warm_pool.lease(snapshot_name)
                 run_task(
                     task_id = task_id,
                     task_dict = task_dict,
@@ -131,30 +213,60 @@ for task_language, env_language in language_combinations:
                     save_dir = save_dir,
 
                     snapshot_name = snapshot_name,
-                    instance_id = arguments.instance_id,
+                    instance_id = arguments.instance_id if environment is None else environment.instance_id,
                     snapshot_recovery_timeout_seconds = arguments.snapshot_recovery_timeout_seconds,
                     override_env_reset = arguments.override_env_reset,
                     vmx_path = arguments.vmx_path,
 
                     guest_username = arguments.guest_username,
                     guest_password = arguments.guest_password,
-                    ssh_host = arguments.ssh_host,
+                    ssh_host = arguments.ssh_host if environment is None else environment.ssh_host,
                     ssh_pkey = arguments.ssh_pkey,
 
                     gui_agent_name = arguments.gui_agent_name,
+                    image_pipeline = arguments.image_pipeline,
+                    stream = arguments.stream,
+                    image_eviction_chunk = arguments.image_eviction_chunk,
                     max_steps = arguments.max_steps,
                     task_step_timeout = arguments.task_step_timeout,
                     pre_command_max_trials = arguments.pre_command_max_trials,
                     env_init_command = env_init_command,
-                    eval_init_command = eval_init_command
+                    eval_init_command = eval_init_command,
+                    environment_ready = environment is not None,
+                    should_abort = lambda: lease.lost
                 )
+                if lease.lost:
+                    # Graded after the lease was taken over; the unit and its directory belong to the new holder
+                    break
                 task_complete_flag = True
+                TASK_ATTEMPTS_TOTAL.inc(outcome = 'success')
+                TASK_SECONDS.observe(time.time() - attempt_start_time)
+                try:
+                    record_task_result(arguments.base_save_dir, save_dir, arguments.gui_agent_name, task_attempt, time.time() - attempt_start_time)
+                except Exception as e:
+                    # The task directory stays the source of truth; `backfill_results_store` can add the row later
+                    print_message(f'Could not add the result to the results store: {e}', title = f'Task {task_id}')
+                break
+            except TaskAbortedException as e:
+                print_message(e, title = f'Task {task_id}')
                 break
             except TimeoutException as e:
+                TASK_ATTEMPTS_TOTAL.inc(outcome = 'error')
                 print_message(e, title = f'Task {task_id} Error')
             except Exception as e:
+                TASK_ATTEMPTS_TOTAL.inc(outcome = 'error')
                 print_message(e, title = f'Task {task_id} Error')
+            finally:
+                if environment is not None:
+                    warm_pool.release(environment)
+
+        if lease.lost:
+            # Another driver reclaimed the unit and restarted it in the same directory; leave both to that driver
+            print_message('Lost the lease; leaving the task to the driver that reclaimed it', title = f'Task {task_id}')
+            lease_keeper.release(lease)
+            continue
 
+        TASKS_TOTAL.inc(outcome = 'completed' if task_complete_flag else 'failed')
         if not task_complete_flag:
             print_message(f'Task failed after max attempts: {task_uuid}', title = f'Task {task_id} Error')
             incomplete_task_list.append((task_uuid, f'{task_uuid} {task_id}, env language {env_language}, task language {task_language}'))
@@ -164,6 +276,21 @@ for task_language, env_language in language_combinations:
             with open(fail_flag_path, 'w'):
                 pass
 
+        lease_keeper.release(lease)
+
+    pending_units = deferred_units
+    if pending_units:
+        print_message(f'Waiting for {len(pending_units)} tasks running on other drivers', title = 'Task Leases')
+        time.sleep(arguments.lease_ttl_seconds / 3)
+
+lease_keeper.stop()
+
+if blob_store is not None:
+    print_message(blob_store.stats(), title = 'Artifact Writer')
+if warm_pool is not None:
+    print_message(warm_pool.stats(), title = 'Warm Pool')
+    warm_pool.close()
+
 if arguments.port is not None:
     s = socket.create_connection(("127.0.0.1", arguments.port))
     s.sendall(b"DONE")
@@ -8,6 +8,8 @@ from vncdotool import api
 from vncdotool.client import KEYMAP
 from sshtunnel import SSHTunnelForwarder
 from utils.log import print_message
+from utils.timing import timed
+from utils.metrics import ACTIONS_TOTAL, SCREENSHOTS_TOTAL, TYPED_CHARACTERS_TOTAL
 from utils.vmware_utils import VMwareTools
 import subprocess
 
@@ -94,6 +96,16 @@ class VNCClient:
 
 
 import time
+import functools
+
+def actuation(fn):
+    """Runs each call of a mouse or keyboard action in an `actuation` span and counts it by action."""
+    timed_fn = timed('actuation')(fn)
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        ACTIONS_TOTAL.inc(action = fn.__name__)
+        return timed_fn(*args, **kwargs)
+    return wrapper
 
 class VNCClient_SSH:
     def __init__(self, guest_username, guest_password, ssh_host, ssh_pkey, retry_attempts=3, retry_delay=5, action_interval_seconds=1, vmx_path=None, vnc_connection_timeout=600):
@@ -118,6 +130,7 @@ class VNCClient_SSH:
                 vmx_path = vmx_path
             )
 
+    @timed('ssh_check')
     def check_ssh_connectivity(self):
         """Check if SSH connection can be established. Returns True if successful, False otherwise."""
         try:
@@ -135,6 +148,7 @@ class VNCClient_SSH:
         except Exception:
             return False
         
+    @timed('ssh_command')
     def run_ssh_command(self, command: str) -> str:
         command = command.replace('\\', '\\\\').replace('"', '\\"').replace('$', '\\$')
         ssh_command = f'ssh -o StrictHostKeyChecking=no -i "{self.ssh_pkey}" {self.guest_username}@{self.ssh_host} "{command}"'
@@ -144,6 +158,7 @@ class VNCClient_SSH:
         except Exception as e: # subprocess.CalledProcessError
             return False, e
 
+    @timed('vnc_connect')
     def connect(self):
         """Connect to the VNC server, with retries on failure."""
         for attempt in range(1, self.retry_attempts + 1):
@@ -168,6 +183,7 @@ class VNCClient_SSH:
                 else:
                     raise ConnectionError("Failed to connect to VNC server after multiple attempts.")
 
+    @timed('screenshot')
     def capture_screenshot(self):
         """Capture a screenshot and return it as a PIL Image."""
         image = None
@@ -213,8 +229,10 @@ class VNCClient_SSH:
             
         if image == None:
             raise RuntimeError(f'Screen capture failed after maximum trials')
+        SCREENSHOTS_TOTAL.inc()
         return image
     
+    @actuation
     def mouse_down(self, button):
         """Press and hold a specified mouse button."""
         self._ensure_connection()
@@ -225,6 +243,7 @@ class VNCClient_SSH:
         elif button.lower() == "right":
             self.client.mouseDown(3)
 
+    @actuation
     def mouse_up(self, button):
         """Release a specified mouse button."""
         self._ensure_connection()
@@ -235,24 +254,28 @@ class VNCClient_SSH:
         elif button.lower() == "right":
             self.client.mouseUp(3)
 
+    @actuation
     def left_click(self):
         """Perform a left mouse click."""
         self._ensure_connection()
         self.client.mouseDown(1)
         self.client.mouseUp(1)
 
+    @actuation
     def middle_click(self):
         """Perform a middle mouse click."""
         self._ensure_connection()
         self.client.mouseDown(2)
         self.client.mouseUp(2)
 
+    @actuation
     def right_click(self):
         """Perform a right mouse click."""
         self._ensure_connection()
         self.client.mouseDown(3)
         self.client.mouseUp(3)
 
+    @actuation
     def double_click(self):
         """Perform a double left mouse click."""
         self._ensure_connection()
@@ -261,6 +284,7 @@ class VNCClient_SSH:
         self.client.mouseDown(1)
         self.client.mouseUp(1)
 
+    @actuation
     def triple_click(self):
         """Perform a triple left mouse click."""
         self._ensure_connection()
@@ -271,6 +295,7 @@ class VNCClient_SSH:
         self.client.mouseDown(1)
         self.client.mouseUp(1)
 
+    @actuation
     def drag_to(self, x, y):
         """Perform a drag action by holding down the left mouse button, moving to (x, y), then releasing."""
         self._ensure_connection()
@@ -284,6 +309,7 @@ class VNCClient_SSH:
         self.client.mouseMove(x_scaled, y_scaled)
         self.client.mouseUp(1)
 
+    @actuation
     def scroll_down(self, amount, by_pixel=False):
         """Perform a scrolling down. 
         
@@ -299,6 +325,7 @@ class VNCClient_SSH:
             self.client.mouseDown(5)
             self.client.mouseUp(5)
 
+    @actuation
     def scroll_up(self, amount, by_pixel=False):
         """Perform a mouse scrolling up. 
         
@@ -314,6 +341,7 @@ class VNCClient_SSH:
             self.client.mouseDown(4)
             self.client.mouseUp(4)
 
+    @actuation
     def scroll_left(self, amount, by_pixel=False):
         """Perform a mouse scrolling up. 
         
@@ -329,6 +357,7 @@ class VNCClient_SSH:
             self.client.mouseDown(6)
             self.client.mouseUp(6)
 
+    @actuation
     def scroll_right(self, amount, by_pixel=False):
         """Perform a mouse scrolling up. 
         
@@ -344,6 +373,7 @@ class VNCClient_SSH:
             self.client.mouseDown(7)
             self.client.mouseUp(7)
 
+    @actuation
     def move_to(self, x, y):
         """Move the mouse to the normalised coordinates (x, y).
         
@@ -361,11 +391,13 @@ class VNCClient_SSH:
 
         self.client.mouseMove(x_scaled, y_scaled)
 
+    @actuation
     def move_to_pixel(self, x, y):
         """Move the mouse to the pixel coordinates (x, y)."""       
         self._ensure_connection()
         self.client.mouseMove(x, y)
 
+    @actuation
     def key_press(self, key):
         """Press a key on the keyboard.
         
@@ -376,6 +408,7 @@ class VNCClient_SSH:
         self._ensure_connection()
         self.client.keyPress(key)
 
+    @actuation
     def key_press_and_hold(self, key, duration_seconds: int):
         """Press a key or a key combination on the keyboard; hold for `duration_seconds` seconds before releasing.
         
@@ -388,6 +421,7 @@ class VNCClient_SSH:
         time.sleep(duration_seconds)
         self.client.keyUp(key)
 
+    @actuation
     def type_text(self, text):
         """Type a string of (ASCII characters only)."""
         text = self._filter_text(text)
@@ -397,6 +431,7 @@ class VNCClient_SSH:
         for char in text:
             self.client.keyPress(char)
             time.sleep(0.1)
+        TYPED_CHARACTERS_TOTAL.inc(len(text))
 
     def disconnect(self):
         """Disconnect from the VNC server."""
@@ -0,0 +1,212 @@
+"""
+Background writer for per-step artifacts (screenshots, raw responses, parsed actions).
+
+Agents hand files to the process-wide writer and return to the next step immediately; a worker thread does the
+encoding and disk I/O. Files are not fsynced individually: `flush` at the end of each task waits for the queue to
+drain, fsyncs everything written since the previous flush and re-raises the first write error.
+
+Settings are read from environment variables (unset = default):
+    MACOSWORLD_ARTIFACT_WRITER                  'async' (default) or 'sync' to write on the calling thread
+    MACOSWORLD_ARTIFACT_QUEUE_SIZE              pending files before `save_*` calls block (default 64)
+    MACOSWORLD_ARTIFACT_PNG_COMPRESS_LEVEL      zlib level for screenshots (default 1; PIL's default is 6)
+
+With a blob store (`use_blob_store`, see `utils/blob_store.py`), screenshots are stored once per content and
+hardlinked into place; `flush` then also writes each directory's `artifact_manifest.json`.
+With trajectory archives (`use_trajectory_archives`, see `utils/trajectory_archive.py`), files under a task's
+`context/` are appended to `<save_dir>/trajectory.zip` instead, and `flush` closes the archive.
+"""
+
+import io
+import os
+import json
+import queue
+import threading
+
+from utils.log import print_message
+from utils.blob_store import MANIFEST_FILENAME
+from utils.trajectory_archive import TrajectoryArchive, CONTEXT_DIRNAME, get_archive_path
+
+class ArtifactWriter:
+    def __init__(self, asynchronous: bool = True, max_queue_size: int = 64, png_compress_level: int = 1):
+        self.asynchronous = asynchronous
+        self.png_compress_level = png_compress_level
+
+        self.queue = queue.Queue(maxsize = max_queue_size)
+        self.lock = threading.Lock()
+        self.written_paths = []
+        self.errors = []
+        self.blob_store = None
+        self.manifests = {}
+        self.trajectory_archives = False
+        self.archives = {}
+
+        self.worker = None
+        if asynchronous:
+            self.worker = threading.Thread(target = self._run, name = 'artifact-writer', daemon = True)
+            self.worker.start()
+
+    def use_blob_store(self, blob_store):
+        """Store screenshots in `blob_store` (a `BlobStore`, or None for separate files)."""
+        self.flush()
+        self.blob_store = blob_store
+
+    def use_trajectory_archives(self, enabled: bool):
+        self.flush()
+        self.trajectory_archives = enabled
+
+    def begin_task(self, save_dir: str):
+        """Start a task attempt in `save_dir`; the archive of a previous attempt is discarded, as its files would be overwritten."""
+        if self.trajectory_archives:
+            if os.path.exists(get_archive_path(save_dir)):
+                os.remove(get_archive_path(save_dir))
+            # Closing the archive removed the emptied context/, which agents write into directly
+            os.makedirs(os.path.join(save_dir, CONTEXT_DIRNAME), exist_ok = True)
+
+    def save_image(self, path: str, image):
+        """Save a PIL image as PNG. The image must not be modified afterwards."""
+        self._submit(path, self._write_image, image)
+
+    def write_text(self, path: str, text: str):
+        self._submit(path, self._write_bytes, text.encode('utf-8'))
+
+    def write_json(self, path: str, obj, indent: int = None):
+        # Serialised now, so that later changes to `obj` do not leak into the file
+        self._submit(path, self._write_bytes, json.dumps(obj, indent = indent).encode('utf-8'))
+
+    def _submit(self, path: str, write_fn, payload):
+        if self.asynchronous:
+            self.queue.put((path, write_fn, payload))
+        else:
+            self._write(path, write_fn, payload)
+
+    def _archive_for(self, path: str):
+        """The open archive that `path` belongs to, or None if it is written as a file."""
+        directory = os.path.dirname(path)
+        if not self.trajectory_archives or os.path.basename(directory) != CONTEXT_DIRNAME:
+            return None
+        save_dir = os.path.dirname(directory)
+        with self.lock:
+            if save_dir not in self.archives:
+                self.archives[save_dir] = TrajectoryArchive(save_dir)
+            return self.archives[save_dir]
+
+    def _write_image(self, path: str, image):
+        archive = self._archive_for(path)
+        if archive is not None:
+            with io.BytesIO() as buffer:
+                image.save(buffer, format = 'PNG', compress_level = self.png_compress_level)
+                archive.add(f'{CONTEXT_DIRNAME}/{os.path.basename(path)}', buffer.getvalue())
+            return archive.path
+        if self.blob_store is None:
+            image.save(path, format = 'PNG', compress_level = self.png_compress_level)
+            return
+        entry = self.blob_store.save_image(image, path, self.png_compress_level)
+        new_blob_path = entry.pop("new_blob_path")
+        with self.lock:
+            self.manifests.setdefault(os.path.dirname(path), {})[os.path.basename(path)] = entry
+            if new_blob_path is not None:
+                self.written_paths.append(new_blob_path)
+
+    def _write_manifests(self, manifests: dict) -> list:
+        paths = []
+        for directory, files in manifests.items():
+            path = os.path.join(directory, MANIFEST_FILENAME)
+            # A directory may be flushed more than once, e.g. by a final conversation dump
+            manifest = {"blob_dir": os.path.relpath(self.blob_store.root, directory), "files": {}}
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    manifest["files"] = json.load(f)["files"]
+            manifest["files"].update(files)
+            self._write_bytes(f'{path}.tmp', json.dumps(manifest, indent = 4).encode('utf-8'))
+            os.replace(f'{path}.tmp', path)
+            paths.append(path)
+        return paths
+
+    def _write_bytes(self, path: str, data: bytes):
+        archive = self._archive_for(path)
+        if archive is not None:
+            archive.add(f'{CONTEXT_DIRNAME}/{os.path.basename(path)}', data)
+            return archive.path
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def _write(self, path: str, write_fn, payload):
+        try:
+            written_path = write_fn(path, payload)
+            with self.lock:
+                self.written_paths.append(written_path or path)
+        except Exception as e:
+            with self.lock:
+                self.errors.append((path, e))
+
+    def _run(self):
+        while True:
+            path, write_fn, payload = self.queue.get()
+            try:
+                self._write(path, write_fn, payload)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait for all pending writes, fsync them, and raise the first error since the previous flush."""
+        if self.asynchronous:
+            self.queue.join()
+        with self.lock:
+            written_paths, self.written_paths = self.written_paths, []
+            errors, self.errors = self.errors, []
+            manifests, self.manifests = self.manifests, {}
+            archives, self.archives = self.archives, {}
+
+        # Files that agents wrote into context/ directly join the archive before it is closed
+        for save_dir, archive in archives.items():
+            try:
+                archive.fold_in_directory(os.path.join(save_dir, CONTEXT_DIRNAME), CONTEXT_DIRNAME)
+                archive.close()
+                written_paths.append(archive.path)
+            except Exception as e:
+                errors.append((archive.path, e))
+
+        if manifests:
+            try:
+                written_paths += self._write_manifests(manifests)
+            except Exception as e:
+                errors.append((MANIFEST_FILENAME, e))
+
+        written_paths = list(dict.fromkeys(written_paths))
+        for path in written_paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        # Make the new directory entries durable as well
+        for directory in set(os.path.dirname(path) or '.' for path in written_paths):
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        if errors:
+            for path, e in errors:
+                print_message(f'Failed to write {path}: {type(e).__name__}: {e}', title = 'Artifact Writer')
+            raise errors[0][1]
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_artifact_writer() -> ArtifactWriter:
+    """Return the process-wide writer, configured by environment variables on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            mode = os.environ.get('MACOSWORLD_ARTIFACT_WRITER', 'async').strip().lower()
+            if mode not in ['async', 'sync']:
+                raise ValueError(f'MACOSWORLD_ARTIFACT_WRITER should be "async" or "sync"; got "{mode}".')
+            _writer = ArtifactWriter(
+                asynchronous = mode == 'async',
+                max_queue_size = int(os.environ.get('MACOSWORLD_ARTIFACT_QUEUE_SIZE', 64)),
+                png_compress_level = int(os.environ.get('MACOSWORLD_ARTIFACT_PNG_COMPRESS_LEVEL', 1)),
+            )
+        return _writer
@@ -0,0 +1,189 @@
+"""
+Building blocks for local model services that batch requests from several testbench processes
+(`utils/omniparser_service.py`, `agent/showui_engine.py`).
+
+    MicroBatcher        groups concurrent requests into batches for one worker thread that owns the model
+    make_http_server    ThreadingHTTPServer on a TCP port or a Unix socket
+    ServiceClient       keep-alive HTTP client for `http://host:port` or `unix:///path/to/socket` URLs
+"""
+
+import io
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import http.client
+import socketserver
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+from PIL import Image
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into batches for a single worker thread.
+
+    After the first request of a batch arrives, the worker waits up to `max_batch_wait_seconds` for more, up to
+    `max_batch_size`, then calls `process_batch_fn(requests)`, which returns one result or Exception per request.
+    """
+    def __init__(self, process_batch_fn, max_batch_size: int = 8, max_batch_wait_seconds: float = 0.02, name: str = 'micro-batcher'):
+        self.process_batch_fn = process_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait_seconds = max_batch_wait_seconds
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.batch_count = 0
+
+        self.worker = threading.Thread(target = self._run, name = name, daemon = True)
+        self.worker.start()
+
+    def submit(self, request) -> Future:
+        future = Future()
+        self.queue.put((request, future))
+        return future
+
+    def _collect_batch(self) -> list:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_batch_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout = remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            requests = [request for request, _ in batch]
+            try:
+                results = self.process_batch_fn(requests)
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            with self.lock:
+                self.request_count += len(batch)
+                self.batch_count += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.request_count,
+                "batches": self.batch_count,
+                "mean_batch_size": round(self.request_count / self.batch_count, 3) if self.batch_count else None,
+                "queued": self.queue.qsize(),
+            }
+
+
+def encode_png(image: Image.Image) -> bytes:
+    with io.BytesIO() as buffer:
+        image.save(buffer, format = 'PNG', compress_level = 1)
+        return buffer.getvalue()
+
+
+class JSONRequestHandler(BaseHTTPRequestHandler):
+    """Base handler with keep-alive, JSON responses, and no per-request logging."""
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status_code: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixThreadingHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # HTTPServer.server_bind expects a (host, port) address
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_http_server(host: str, port: int, unix_socket: str, handler_class):
+    """Return `(server, address)`, listening on `unix_socket` if given, else on `host:port`."""
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server, address = UnixThreadingHTTPServer(unix_socket, handler_class), f'unix://{unix_socket}'
+    else:
+        server, address = ThreadingHTTPServer((host, port), handler_class), f'http://{host}:{port}'
+    server.daemon_threads = True
+    return server, address
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__('localhost', timeout = timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ServiceClient:
+    """JSON-over-HTTP client for `http://host:port` or `unix:///path/to/socket`. One connection is kept per thread."""
+    def __init__(self, url: str, timeout: float = 300):
+        self.url = url
+        self.timeout = timeout
+        parsed_url = urlparse(url)
+        if parsed_url.scheme == 'unix':
+            self.connection_factory = lambda: UnixHTTPConnection(parsed_url.path, timeout = timeout)
+        elif parsed_url.scheme == 'http':
+            self.connection_factory = lambda: http.client.HTTPConnection(parsed_url.hostname, parsed_url.port or 80, timeout = timeout)
+        else:
+            raise ValueError(f'Unsupported service URL "{url}". Use http://host:port or unix:///path.')
+        self.local = threading.local()
+
+    def request(self, method: str, path: str, body: bytes = None, content_type: str = 'application/octet-stream') -> dict:
+        for attempt in range(2):
+            connection = getattr(self.local, 'connection', None)
+            if connection is None:
+                connection = self.local.connection = self.connection_factory()
+            try:
+                connection.request(method, path, body = body, headers = {'Content-Type': content_type} if body is not None else {})
+                response = connection.getresponse()
+                payload = json.loads(response.read())
+            except (ConnectionError, http.client.HTTPException, socket.timeout):
+                # The server may have closed an idle keep-alive connection; reconnect once
+                connection.close()
+                self.local.connection = None
+                if attempt == 1:
+                    raise
+                continue
+            if response.status != 200:
+                raise RuntimeError(f'Service at {self.url} returned {response.status}: {payload.get("error")}')
+            return payload
+
+    def health(self) -> dict:
+        return self.request('GET', '/health')
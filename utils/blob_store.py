@@ -0,0 +1,178 @@
+"""
+Content-addressed storage of step screenshots.
+
+Identical frames recur across steps, retries, languages and agents. With a blob store, `ArtifactWriter.save_image`
+hashes the screenshot's pixels, encodes and writes the PNG only if no blob with that hash exists yet, and
+hardlinks the blob to the requested path (e.g. `context/step_001.png`). Tools that read `step_XXX.png` keep working,
+and a repeated frame costs a directory entry instead of an encode and a file. Each task's `context/` also gets an
+`artifact_manifest.json` that maps its files to their blobs:
+
+    {"blob_dir": "../../../.blobs", "files": {"step_001.png": {"blob": "3f/3fa2...png", "bytes": 812345, "linked": true}}}
+
+A blob's hardlink count is its reference count, so deleting a task directory releases its references and
+`collect_garbage` (run by `cleanup.py`) removes blobs that no task links to anymore. Where hardlinks are not
+possible (another filesystem, or too many links), the blob is copied instead (`"linked": false`).
+
+Settings are read from environment variables (unset = default):
+    MACOSWORLD_ARTIFACT_DEDUP       'on' (default) or 'off' to write every screenshot as a separate file
+    MACOSWORLD_ARTIFACT_BLOB_DIR    blob directory (default `<base_save_dir>/.blobs`). Runs that share one, e.g.
+                                    `./results/.blobs`, also share frames across agents; it must be on the same
+                                    filesystem as the results.
+"""
+
+import os
+import time
+import errno
+import shutil
+import hashlib
+import threading
+
+from utils.log import print_message
+
+BLOB_DIRNAME = '.blobs'
+MANIFEST_FILENAME = 'artifact_manifest.json'
+
+# Errors of os.link after which the blob is copied instead
+LINK_FALLBACK_ERRNOS = (errno.EXDEV, errno.EMLINK, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP)
+
+
+def image_digest(image) -> str:
+    """Hash of a PIL image's mode, size and pixels; equal frames get equal digests regardless of PNG encoding."""
+    digest = hashlib.blake2b(digest_size = 20)
+    digest.update(f'{image.mode}:{image.size[0]}x{image.size[1]}:'.encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class BlobStore:
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok = True)
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.new_blobs = 0
+        self.bytes_written = 0
+        self.bytes_deduplicated = 0
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f'{digest}.png')
+
+    def _put_image(self, image, digest: str, png_compress_level: int) -> bool:
+        """Write the blob of `image` unless it exists; return True if it was written."""
+        blob_path = self.blob_path(digest)
+        if os.path.exists(blob_path):
+            return False
+        os.makedirs(os.path.dirname(blob_path), exist_ok = True)
+        tmp_path = f'{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        image.save(tmp_path, format = 'PNG', compress_level = png_compress_level)
+        # Concurrent writers of the same frame write identical content, so either file may win
+        os.replace(tmp_path, blob_path)
+        return True
+
+    def save_image(self, image, path: str, png_compress_level: int = 1) -> dict:
+        """
+        Store `image` once and make `path` refer to it. Returns the manifest entry of `path`, with the path of a newly
+        written blob under "new_blob_path" (None if the blob existed).
+        """
+        digest = image_digest(image)
+        blob_path = self.blob_path(digest)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        for attempt in range(2):
+            written = self._put_image(image, digest, png_compress_level)
+            try:
+                os.link(blob_path, tmp_path)
+                linked = True
+            except FileNotFoundError:
+                # Removed by a concurrent garbage collection between the existence check and the link
+                if attempt == 1:
+                    raise
+                continue
+            except OSError as e:
+                if e.errno not in LINK_FALLBACK_ERRNOS:
+                    raise
+                shutil.copyfile(blob_path, tmp_path)
+                linked = False
+            break
+        os.replace(tmp_path, path)
+
+        size = os.path.getsize(path)
+        with self.lock:
+            self.puts += 1
+            if written:
+                self.new_blobs += 1
+                self.bytes_written += size
+            else:
+                self.bytes_deduplicated += size
+        return {
+            "blob": os.path.relpath(blob_path, self.root),
+            "bytes": size,
+            "linked": linked,
+            "new_blob_path": blob_path if written else None,
+        }
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "saved_images": self.puts,
+                "new_blobs": self.new_blobs,
+                "mb_written": round(self.bytes_written / 1e6, 3),
+                "mb_deduplicated": round(self.bytes_deduplicated / 1e6, 3),
+            }
+
+
+def iter_blobs(blob_dir: str):
+    """(path, os.stat_result) of every blob in `blob_dir`."""
+    if not os.path.isdir(blob_dir):
+        return
+    for shard in sorted(os.listdir(blob_dir)):
+        shard_dir = os.path.join(blob_dir, shard)
+        if not os.path.isdir(shard_dir):
+            continue
+        for name in sorted(os.listdir(shard_dir)):
+            path = os.path.join(shard_dir, name)
+            try:
+                yield path, os.stat(path)
+            except FileNotFoundError:
+                continue
+
+def collect_garbage(blob_dir: str, min_age_seconds: float = 3600) -> dict:
+    """
+    Remove blobs that no task links to (hardlink count 1) and leftover temporary files.
+    Files younger than `min_age_seconds` are kept, as a running testbench may be about to link them.
+    """
+    now = time.time()
+    removed, freed_bytes, kept, referenced_bytes = 0, 0, 0, 0
+    for path, stat in iter_blobs(blob_dir):
+        if stat.st_nlink > 1 and path.endswith('.png'):
+            kept += 1
+            referenced_bytes += stat.st_size
+            continue
+        if now - stat.st_mtime < min_age_seconds:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        freed_bytes += stat.st_size
+    for shard in os.listdir(blob_dir) if os.path.isdir(blob_dir) else []:
+        try:
+            os.rmdir(os.path.join(blob_dir, shard))
+        except OSError:
+            pass  # not empty
+    return {"removed_blobs": removed, "freed_mb": round(freed_bytes / 1e6, 3), "referenced_blobs": kept, "referenced_mb": round(referenced_bytes / 1e6, 3)}
+
+
+def get_blob_dir(base_save_dir: str) -> str:
+    return os.environ.get('MACOSWORLD_ARTIFACT_BLOB_DIR') or os.path.join(base_save_dir, BLOB_DIRNAME)
+
+def get_blob_store(base_save_dir: str) -> BlobStore:
+    """Blob store of a run, or None if MACOSWORLD_ARTIFACT_DEDUP is 'off'."""
+    mode = os.environ.get('MACOSWORLD_ARTIFACT_DEDUP', 'on').strip().lower()
+    if mode not in ['on', 'off']:
+        raise ValueError(f'MACOSWORLD_ARTIFACT_DEDUP should be "on" or "off"; got "{mode}".')
+    if mode == 'off':
+        return None
+    blob_store = BlobStore(get_blob_dir(base_save_dir))
+    print_message(f'Screenshots are stored once per content in {blob_store.root}', title = 'Artifact Writer')
+    return blob_store
@@ -0,0 +1,254 @@
+"""
+Environment resets of EC2 instances, shared by all tasks of a process.
+
+`EC2Fleet` starts root-volume replacements and hands back a `Future` per reset. One poller thread watches every
+pending replacement with a single `DescribeReplaceRootVolumeTasks` call per round, and the status of every instance
+that is waited on with a single `DescribeInstanceStatus` call, however many instances the fleet drives. Rounds start
+`min_poll_seconds` apart after a change and back off to `max_poll_seconds` while nothing changes; a new reset or
+waiter wakes the poller immediately.
+
+    fleet = get_ec2_fleet()
+    future = fleet.reset(instance_id, image_id, timeout_seconds = 120)
+    ...                                  # e.g. reset other instances
+    seconds = future.result()            # raises TimeoutError, or ReplaceRootVolumeError if AWS reports a failure
+
+The boto3 client is created once per process (`get_ec2_client`). For tests, pass any object with the same
+methods, e.g. a moto-backed `boto3.client('ec2')` or a stub, as `EC2Fleet(client = ...)`.
+"""
+
+import time
+import threading
+from concurrent.futures import Future
+
+from utils.log import print_message
+
+# Replacement states: pending | in-progress | failing | failed | succeeded | failed-detached
+REPLACE_ROOT_VOLUME_FAILED_STATES = {'failing', 'failed', 'failed-detached'}
+# IDs per describe call
+DESCRIBE_BATCH_SIZE = 100
+
+class ReplaceRootVolumeError(RuntimeError):
+    pass
+
+def _resolve(outcomes: list):
+    # Outside the fleet's lock, since done-callbacks may call back into the fleet
+    for future, result, exception in outcomes:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
+_ec2_client = None
+_ec2_client_lock = threading.Lock()
+
+def get_ec2_client():
+    """boto3 EC2 client shared by the process. boto3 clients are thread-safe; creating one costs ~100 ms of config loading."""
+    global _ec2_client
+    with _ec2_client_lock:
+        if _ec2_client is None:
+            import boto3
+            _ec2_client = boto3.client('ec2')
+        return _ec2_client
+
+
+class EC2Fleet:
+    def __init__(self, client = None, min_poll_seconds: float = 2, max_poll_seconds: float = 15, backoff_factor: float = 1.5):
+        self.client = client
+        self.min_poll_seconds = min_poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.backoff_factor = backoff_factor
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        # replace root volume task ID -> {"instance_id", "future", "start", "deadline", "state"}
+        self.resets = {}
+        # instance ID -> list of {"future", "start", "deadline"}
+        self.status_waiters = {}
+        self.instance_status = {}
+        self.poll_count = 0
+        self.poller = None
+
+    def get_client(self):
+        if self.client is None:
+            self.client = get_ec2_client()
+        return self.client
+
+    def _ensure_poller(self):
+        with self.lock:
+            if self.poller is None or not self.poller.is_alive():
+                self.poller = threading.Thread(target = self._run, name = 'ec2-fleet-poller', daemon = True)
+                self.poller.start()
+        self.wakeup.set()
+
+    def reset(self, instance_id: str, image_id: str, timeout_seconds: float = None) -> Future:
+        """
+        Replace the root volume of `instance_id` with one restored from the AMI `image_id`. The future resolves to the
+        seconds the replacement took.
+        """
+        response = self.get_client().create_replace_root_volume_task(
+            InstanceId = instance_id,
+            ImageId = image_id,
+            DeleteReplacedRootVolume = True
+        )
+        task_id = response['ReplaceRootVolumeTask']['ReplaceRootVolumeTaskId']
+        future = Future()
+        start = time.monotonic()
+        with self.lock:
+            self.resets[task_id] = {
+                "instance_id": instance_id,
+                "future": future,
+                "start": start,
+                "deadline": None if timeout_seconds is None else start + timeout_seconds,
+                "state": None,
+            }
+        print_message(f'Reinitiating instance "{instance_id}" from image "{image_id}" ({task_id})', title = 'EC2')
+        self._ensure_poller()
+        return future
+
+    def wait_until_ok(self, instance_id: str, timeout_seconds: float = None) -> Future:
+        """Future that resolves to the seconds waited once the instance is running and both its status checks pass."""
+        future = Future()
+        start = time.monotonic()
+        with self.lock:
+            self.status_waiters.setdefault(instance_id, []).append({
+                "future": future,
+                "start": start,
+                "deadline": None if timeout_seconds is None else start + timeout_seconds,
+            })
+        self._ensure_poller()
+        return future
+
+    def get_instance_status(self, instance_id: str) -> dict:
+        """Last polled status, e.g. {"state": "running", "instance_status": "ok", "system_status": "initializing"}."""
+        with self.lock:
+            return self.instance_status.get(instance_id)
+
+    def get_public_dns_names(self, instance_ids: list) -> dict:
+        """Instance ID -> public DNS name, in batched `DescribeInstances` calls."""
+        names = {}
+        for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE):
+            response = self.get_client().describe_instances(InstanceIds = instance_ids[i:i + DESCRIBE_BATCH_SIZE])
+            for reservation in response['Reservations']:
+                for instance in reservation['Instances']:
+                    names[instance['InstanceId']] = instance.get('PublicDnsName')
+        return names
+
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.resets) + sum(len(waiters) for waiters in self.status_waiters.values())
+
+    def _run(self):
+        interval = self.min_poll_seconds
+        while True:
+            self.wakeup.wait(interval)
+            woken = self.wakeup.is_set()
+            self.wakeup.clear()
+            with self.lock:
+                if not self.resets and not self.status_waiters:
+                    # Exit when idle; the next request starts a new poller
+                    self.poller = None
+                    return
+            changed = self.poll()
+            interval = self.min_poll_seconds if changed or woken else min(self.max_poll_seconds, interval * self.backoff_factor)
+
+    def poll(self) -> bool:
+        """One polling round over the whole fleet. Returns True if any reset or instance changed state."""
+        self.poll_count += 1
+        changed = self._poll_resets()
+        changed = self._poll_instance_status() or changed
+        return changed
+
+    def _poll_resets(self) -> bool:
+        with self.lock:
+            task_ids = list(self.resets)
+        if not task_ids:
+            return False
+        states = {}
+        try:
+            for i in range(0, len(task_ids), DESCRIBE_BATCH_SIZE):
+                response = self.get_client().describe_replace_root_volume_tasks(ReplaceRootVolumeTaskIds = task_ids[i:i + DESCRIBE_BATCH_SIZE])
+                for task in response['ReplaceRootVolumeTasks']:
+                    states[task['ReplaceRootVolumeTaskId']] = task['TaskState']
+        except Exception as e:
+            # Deadlines are still enforced below
+            print_message(f'Describing root volume replacements failed: {type(e).__name__}: {e}', title = 'EC2')
+
+        changed = False
+        outcomes = []
+        now = time.monotonic()
+        with self.lock:
+            for task_id in task_ids:
+                reset = self.resets[task_id]
+                state = states.get(task_id, reset["state"])
+                if state != reset["state"]:
+                    changed = True
+                    reset["state"] = state
+                seconds = now - reset["start"]
+                if state == 'succeeded':
+                    print_message(f'Recovery of "{reset["instance_id"]}" complete. Duration {seconds:.0f}s.', title = 'EC2')
+                    outcomes.append((reset["future"], seconds, None))
+                elif state in REPLACE_ROOT_VOLUME_FAILED_STATES:
+                    outcomes.append((reset["future"], None, ReplaceRootVolumeError(f'Replacing the root volume of "{reset["instance_id"]}" {state} ({task_id}).')))
+                elif reset["deadline"] is not None and now > reset["deadline"]:
+                    outcomes.append((reset["future"], None, TimeoutError(f'Timeout recovering instance "{reset["instance_id"]}" ({task_id}, last state {state}).')))
+                else:
+                    continue
+                del self.resets[task_id]
+        _resolve(outcomes)
+        return changed
+
+    def _poll_instance_status(self) -> bool:
+        with self.lock:
+            instance_ids = list(self.status_waiters)
+        if not instance_ids:
+            return False
+        statuses = {}
+        try:
+            for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE):
+                response = self.get_client().describe_instance_status(InstanceIds = instance_ids[i:i + DESCRIBE_BATCH_SIZE], IncludeAllInstances = True)
+                for status in response['InstanceStatuses']:
+                    statuses[status['InstanceId']] = {
+                        "state": status['InstanceState']['Name'],
+                        "instance_status": status.get('InstanceStatus', {}).get('Status'),
+                        "system_status": status.get('SystemStatus', {}).get('Status'),
+                    }
+        except Exception as e:
+            print_message(f'Describing instance status failed: {type(e).__name__}: {e}', title = 'EC2')
+
+        changed = False
+        outcomes = []
+        now = time.monotonic()
+        with self.lock:
+            for instance_id in instance_ids:
+                status = statuses.get(instance_id)
+                if status is not None and status != self.instance_status.get(instance_id):
+                    changed = True
+                    self.instance_status[instance_id] = status
+                ok = status is not None and status["state"] == 'running' and status["instance_status"] == 'ok' and status["system_status"] == 'ok'
+                waiting = []
+                for waiter in self.status_waiters[instance_id]:
+                    if ok:
+                        outcomes.append((waiter["future"], now - waiter["start"], None))
+                    elif waiter["deadline"] is not None and now > waiter["deadline"]:
+                        outcomes.append((waiter["future"], None, TimeoutError(f'Timeout waiting for instance "{instance_id}" to pass its status checks (last status {status}).')))
+                    else:
+                        waiting.append(waiter)
+                if waiting:
+                    self.status_waiters[instance_id] = waiting
+                else:
+                    del self.status_waiters[instance_id]
+        _resolve(outcomes)
+        return changed
+
+
+_ec2_fleet = None
+_ec2_fleet_lock = threading.Lock()
+
+def get_ec2_fleet() -> EC2Fleet:
+    """Fleet shared by all tasks of the process."""
+    global _ec2_fleet
+    with _ec2_fleet_lock:
+        if _ec2_fleet is None:
+            _ec2_fleet = EC2Fleet()
+        return _ec2_fleet
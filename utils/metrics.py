@@ -0,0 +1,217 @@
+"""
+Process-wide counters, gauges and histograms of a benchmark run, served in the Prometheus text format.
+
+With `--metrics_port`, testbench starts `start_metrics_server` and Prometheus (or `curl localhost:<port>/metrics`)
+can scrape the run while it is going. Metrics are kept in memory only, so they restart from zero when `run.py`
+restarts the testbench; Prometheus treats that as a counter reset.
+
+    macosworld_tasks_total{outcome}                         completed / failed tasks
+    macosworld_task_attempts_total{outcome}                 success / error attempts
+    macosworld_task_seconds                                 histogram of the wall time of successful attempts
+    macosworld_tasks_remaining{environment}                 tasks this testbench still has to run (queue depth)
+    macosworld_phase_seconds{phase}                         histogram of the spans of utils/timing.py
+    macosworld_llm_calls_total{provider, outcome}           model API calls (success / error / cache_hit)
+    macosworld_llm_call_seconds{provider}                   histogram of model API latency, including retries
+    macosworld_llm_retries_total{provider}                  retried attempts
+    macosworld_llm_rate_limit_wait_seconds_total{provider}  time spent waiting for the rate limiter
+    macosworld_screenshots_total                            screenshots captured
+    macosworld_typed_characters_total                       characters typed into the guest
+    macosworld_actions_total{action}                        mouse and keyboard actions
+
+Screenshot and typing throughput are the rates of the `_total` counters, e.g. `rate(macosworld_screenshots_total[5m])`.
+"""
+
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.log import print_message
+
+# Seconds; phases range from sub-second actions to multi-minute environment resets
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} takes labels {self.labelnames}; got {tuple(labels)}.')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines += self._render_sample(key, value)
+        return lines
+
+    def _render_sample(self, key: tuple, value) -> list:
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError(f'Counter {self.name} can only increase.')
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            # [count per bucket (not cumulative)..., sum, count]
+            state = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def _render_sample(self, key: tuple, state) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state):
+            cumulative += count
+            le_label = 'le="%s"' % _format_value(bound)
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le_label)} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}')
+        lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get_or_create(self, metric_class, name: str, documentation: str, labelnames: tuple, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, metric_class) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f'Metric {name} is already registered as a {metric.type_name} with labels {metric.labelnames}.')
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets = buckets)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+_metrics_registry = MetricsRegistry()
+
+def get_metrics() -> MetricsRegistry:
+    """Process-wide registry, shared by the testbench, the VNC client, the model clients and the task timer."""
+    return _metrics_registry
+
+
+TASKS_TOTAL = _metrics_registry.counter('macosworld_tasks_total', 'Tasks finished by this testbench, by outcome.', ('outcome',))
+TASK_ATTEMPTS_TOTAL = _metrics_registry.counter('macosworld_task_attempts_total', 'Task attempts, by outcome.', ('outcome',))
+TASK_SECONDS = _metrics_registry.histogram('macosworld_task_seconds', 'Wall time of successful task attempts.', buckets = (60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 7200))
+TASKS_REMAINING = _metrics_registry.gauge('macosworld_tasks_remaining', 'Tasks this testbench still has to run.', ('environment',))
+PHASE_SECONDS = _metrics_registry.histogram('macosworld_phase_seconds', 'Duration of task phases (spans of utils/timing.py).', ('phase',))
+LLM_CALLS_TOTAL = _metrics_registry.counter('macosworld_llm_calls_total', 'Model API calls, by outcome.', ('provider', 'outcome'))
+LLM_CALL_SECONDS = _metrics_registry.histogram('macosworld_llm_call_seconds', 'Latency of model API calls, including retries.', ('provider',))
+LLM_RETRIES_TOTAL = _metrics_registry.counter('macosworld_llm_retries_total', 'Retried model API attempts.', ('provider',))
+LLM_RATE_LIMIT_WAIT_SECONDS_TOTAL = _metrics_registry.counter('macosworld_llm_rate_limit_wait_seconds_total', 'Time model API calls waited for the rate limiter.', ('provider',))
+SCREENSHOTS_TOTAL = _metrics_registry.counter('macosworld_screenshots_total', 'Screenshots captured from the guest.')
+TYPED_CHARACTERS_TOTAL = _metrics_registry.counter('macosworld_typed_characters_total', 'Characters typed into the guest.')
+ACTIONS_TOTAL = _metrics_registry.counter('macosworld_actions_total', 'Mouse and keyboard actions sent to the guest.', ('action',))
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/metrics', '/']:
+            self.send_error(404)
+            return
+        body = get_metrics().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, host: str = '127.0.0.1'):
+    """Serve `/metrics` on `host:port` from a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, name = 'metrics-server', daemon = True).start()
+    print_message(f'Serving metrics on http://{host}:{port}/metrics', title = 'Metrics')
+    return server
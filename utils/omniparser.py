@@ -1,10 +1,14 @@
 import sys
 sys.path.append('./OmniParser')
 
-from OmniParser.util.utils import get_som_labeled_img, check_ocr_box, get_caption_model_processor, get_yolo_model
+from OmniParser.util.utils import get_som_labeled_img, check_ocr_box, get_caption_model_processor, get_yolo_model, annotate as draw_boxes
 from PIL import Image
+import numpy as np
+import torch
+from torchvision.ops import box_convert
 import io
 import base64
+from concurrent.futures import ThreadPoolExecutor
 
 class DefaultOmniParser:
     def __init__(self, device: str):
@@ -19,19 +23,23 @@ class DefaultOmniParser:
 
         self.caption_model_processor = get_caption_model_processor(model_name="florence2", model_name_or_path="OmniParser/weights/icon_caption_florence", device=device)
 
-    def __call__(self, screenshot: Image.Image):
+    def ocr(self, screenshot: Image.Image):
+        ocr_bbox_rslt, is_goal_filtered = check_ocr_box(screenshot, display_img = False, output_bb_format='xyxy', goal_filtering=None, easyocr_args={'paragraph': False, 'text_threshold':0.9}, use_paddleocr=True)
+        return ocr_bbox_rslt
 
-        # Get configs
+    @staticmethod
+    def get_draw_bbox_config(screenshot: Image.Image):
         box_overlay_ratio = max(screenshot.size) / 3200
-        draw_bbox_config = {
+        return {
             'text_scale': 0.8 * box_overlay_ratio,
             'text_thickness': max(int(2 * box_overlay_ratio), 1),
             'text_padding': max(int(3 * box_overlay_ratio), 1),
             'thickness': max(int(3 * box_overlay_ratio), 1),
         }
 
-        # Inference
-        ocr_bbox_rslt, is_goal_filtered = check_ocr_box(screenshot, display_img = False, output_bb_format='xyxy', goal_filtering=None, easyocr_args={'paragraph': False, 'text_threshold':0.9}, use_paddleocr=True)
+    def annotate(self, screenshot: Image.Image, ocr_bbox_rslt):
+        # Get configs
+        draw_bbox_config = self.get_draw_bbox_config(screenshot)
         text, ocr_bbox = ocr_bbox_rslt
 
         # Annotate
@@ -43,4 +51,43 @@ class DefaultOmniParser:
             parsed_content_list[parsed_content_index]['centre_coord'] = f"{((parsed_content_list[parsed_content_index]['bbox'][0] + parsed_content_list[parsed_content_index]['bbox'][2]) / 2):.6f} {((parsed_content_list[parsed_content_index]['bbox'][1] + parsed_content_list[parsed_content_index]['bbox'][3]) / 2):.6f}"
 
         return annotated_screenshot, parsed_content_list
-    
\ No newline at end of file
+
+    def __call__(self, screenshot: Image.Image):
+        return self.annotate(screenshot, self.ocr(screenshot))
+
+    def draw(self, screenshot: Image.Image, parsed_content_list: list):
+        """Draw the boxes of `parsed_content_list` (ratio xyxy bboxes) on `screenshot`, labelled with their list index."""
+        boxes = torch.tensor([parsed_content['bbox'] for parsed_content in parsed_content_list], dtype = torch.float32).reshape(-1, 4)
+        boxes = box_convert(boxes = boxes, in_fmt = 'xyxy', out_fmt = 'cxcywh')
+        annotated_frame, label_coordinates = draw_boxes(
+            image_source = np.asarray(screenshot.convert('RGB')),
+            boxes = boxes,
+            logits = None,
+            phrases = list(range(len(parsed_content_list))),
+            **self.get_draw_bbox_config(screenshot)
+        )
+        return Image.fromarray(annotated_frame)
+
+    def parse_batch(self, screenshots: list):
+        """
+        Parse several screenshots. OCR (CPU, PaddleOCR) of the next screenshot runs on a worker thread while
+        detection and captioning (GPU) run on the current one; each model is only ever used by one thread.
+        Returns a list with one (annotated_screenshot, parsed_content_list) tuple or Exception per screenshot.
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers = 1) as ocr_executor:
+            ocr_futures = [ocr_executor.submit(self.ocr, screenshot) for screenshot in screenshots]
+            for screenshot, ocr_future in zip(screenshots, ocr_futures):
+                try:
+                    results.append(self.annotate(screenshot, ocr_future.result()))
+                except Exception as e:
+                    results.append(e)
+        return results
+
+
+def load_omniparser(device: str):
+    """`DefaultOmniParser` on `device`, or the ONNX/int8 `CPUOmniParser` for 'cpu'."""
+    if device == 'cpu':
+        from utils.omniparser_cpu import load_cpu_omniparser
+        return load_cpu_omniparser()
+    return DefaultOmniParser(device)
@@ -0,0 +1,173 @@
+"""
+Screenshot-keyed result cache in front of an OmniParser (`DefaultOmniParser` or `OmniParserClient`).
+
+Consecutive steps often show the same screen (waits, clicks that did nothing, static dialogs). Parses are cached by a
+hash of the screenshot, holding the annotated screenshot and `parsed_content_list`, with LRU eviction in memory and
+optional persistence under a directory (`<cache_dir>/<key[:2]>/<key>.png|.json`) that is reused across runs.
+
+Hash modes:
+    exact        SHA-256 of the pixels; a hit returns exactly what OmniParser would have returned
+    perceptual   difference hash of a downscaled greyscale copy; also matches screens that differ by a few pixels
+                 (cursor blink, anti-aliasing), at the risk of reusing a parse after a small text change
+
+Settings are read from environment variables (unset = default):
+    MACOSWORLD_OMNIPARSER_CACHE         'exact' (default), 'perceptual' or 'off'
+    MACOSWORLD_OMNIPARSER_CACHE_SIZE    parses kept in memory (default 128)
+    MACOSWORLD_OMNIPARSER_CACHE_DIR     directory for persisted parses (default: memory only)
+"""
+
+import os
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from utils.log import print_message
+
+OMNIPARSER_CACHE_MODES = ['off', 'exact', 'perceptual']
+
+
+def exact_hash(screenshot: Image.Image) -> str:
+    digest = hashlib.sha256(screenshot.tobytes())
+    digest.update(f'{screenshot.mode} {screenshot.size[0]}x{screenshot.size[1]}'.encode('utf-8'))
+    return digest.hexdigest()
+
+def perceptual_hash(screenshot: Image.Image, hash_size: int = 32) -> str:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a (hash_size + 1) x hash_size greyscale thumbnail."""
+    thumbnail = screenshot.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = thumbnail.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    # The original size is part of the key, as parsed coordinates are normalised to it
+    return f'{screenshot.size[0]}x{screenshot.size[1]}-{bits:0{hash_size * hash_size // 4}x}'
+
+
+class OmniParserCache:
+    def __init__(self, mode: str = 'exact', max_entries: int = 128, cache_dir: str = None):
+        if mode not in ['exact', 'perceptual']:
+            raise ValueError(f'OmniParser cache mode should be "exact" or "perceptual"; got "{mode}".')
+        self.mode = mode
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok = True)
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def make_key(self, screenshot: Image.Image) -> str:
+        return exact_hash(screenshot) if self.mode == 'exact' else perceptual_hash(screenshot)
+
+    def parse(self, parser, screenshot: Image.Image):
+        """
+        Return `(annotated_screenshot, parsed_content_list, cache_status)`, where `cache_status` is 'hit', 'disk_hit'
+        or 'miss'. `parser(screenshot)` is only called on a miss. The returned list is a copy that the caller may modify;
+        the annotated screenshot is shared and must not be modified.
+        """
+        key = self.make_key(screenshot)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            return entry[0], copy.deepcopy(entry[1]), 'hit'
+
+        entry = self._load(key)
+        if entry is not None:
+            status = 'disk_hit'
+        else:
+            entry = parser(screenshot)
+            self._store(key, entry)
+            status = 'miss'
+
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+            if status == 'disk_hit':
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        return entry[0], copy.deepcopy(entry[1]), status
+
+    def _paths(self, key: str):
+        directory = os.path.join(self.cache_dir, key[:2])
+        return directory, os.path.join(directory, f'{key}.png'), os.path.join(directory, f'{key}.json')
+
+    def _load(self, key: str):
+        if self.cache_dir is None:
+            return None
+        _, image_path, json_path = self._paths(key)
+        # The JSON file is written last, so its presence marks a complete entry
+        if not os.path.isfile(json_path):
+            return None
+        try:
+            with open(json_path, 'r') as f:
+                parsed_content_list = json.load(f)
+            annotated_screenshot = Image.open(image_path)
+            annotated_screenshot.load()
+        except Exception as e:
+            print_message(f'Ignoring unreadable cached parse {key}: {type(e).__name__}: {e}', title = 'OmniParser Cache')
+            return None
+        return annotated_screenshot, parsed_content_list
+
+    def _store(self, key: str, entry):
+        if self.cache_dir is None:
+            return
+        annotated_screenshot, parsed_content_list = entry
+        directory, image_path, json_path = self._paths(key)
+        os.makedirs(directory, exist_ok = True)
+        try:
+            # Written to temporary files and renamed, so that concurrent runs never read a partial entry
+            annotated_screenshot.save(f'{image_path}.{os.getpid()}.tmp', format = 'PNG', compress_level = 1)
+            os.replace(f'{image_path}.{os.getpid()}.tmp', image_path)
+            with open(f'{json_path}.{os.getpid()}.tmp', 'w') as f:
+                json.dump(parsed_content_list, f)
+            os.replace(f'{json_path}.{os.getpid()}.tmp', json_path)
+        except Exception as e:
+            print_message(f'Could not persist parse {key}: {type(e).__name__}: {e}', title = 'OmniParser Cache')
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "mode": self.mode,
+                "entries": len(self.entries),
+                "lookups": lookups,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_omniparser_cache():
+    """Return the process-wide cache configured by environment variables, or None when caching is off."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            mode = os.environ.get('MACOSWORLD_OMNIPARSER_CACHE', 'exact').strip().lower()
+            if mode not in OMNIPARSER_CACHE_MODES:
+                raise ValueError(f'MACOSWORLD_OMNIPARSER_CACHE should be one of {OMNIPARSER_CACHE_MODES}; got "{mode}".')
+            if mode == 'off':
+                return None
+            _cache = OmniParserCache(
+                mode = mode,
+                max_entries = int(os.environ.get('MACOSWORLD_OMNIPARSER_CACHE_SIZE', 128)),
+                cache_dir = os.environ.get('MACOSWORLD_OMNIPARSER_CACHE_DIR') or None,
+            )
+        return _cache
@@ -0,0 +1,109 @@
+"""
+OmniParser on CPU, for evaluation machines without a GPU (agent names ending in `/omniparser-cpu`).
+
+Compared with `DefaultOmniParser(device = 'cpu')`:
+  - the YOLO icon detector is exported once to ONNX (`OmniParser/weights/icon_detect/model.onnx`) and run with
+    ONNX Runtime through ultralytics, which keeps `get_som_labeled_img` unchanged;
+  - the Florence-2 caption model has its linear layers dynamically quantised to int8;
+  - crops are captioned by several worker threads, each generating for a slice of the crop batch.
+
+Settings are read from environment variables (unset = default):
+    MACOSWORLD_OMNIPARSER_CPU_CAPTION_WORKERS   caption worker threads (default min(4, CPU count))
+    MACOSWORLD_OMNIPARSER_CPU_QUANTIZE          '0' to keep the caption model in float32 (default '1')
+
+Requires `onnx` and `onnxruntime` for the export; without them the PyTorch detector is used on CPU.
+`scripts/benchmark_omniparser.py` compares per-screenshot latency with the default path.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from utils.omniparser import DefaultOmniParser
+from OmniParser.util.utils import get_yolo_model, get_caption_model_processor
+from utils.log import print_message
+
+ICON_DETECT_PT_PATH = 'OmniParser/weights/icon_detect/model.pt'
+ICON_DETECT_ONNX_PATH = 'OmniParser/weights/icon_detect/model.onnx'
+
+
+def load_onnx_icon_detector():
+    """Return an ultralytics YOLO model backed by ONNX Runtime, exporting the weights on first use."""
+    if not os.path.isfile(ICON_DETECT_ONNX_PATH):
+        try:
+            exported_path = get_yolo_model(ICON_DETECT_PT_PATH).export(format = 'onnx', imgsz = 640, dynamic = False, simplify = True)
+        except ImportError as e:
+            print_message(f'ONNX export unavailable ({e}); running the PyTorch icon detector on CPU', title = 'OmniParser CPU')
+            return get_yolo_model(ICON_DETECT_PT_PATH).to('cpu')
+        os.replace(exported_path, ICON_DETECT_ONNX_PATH)
+    from ultralytics import YOLO
+    return YOLO(ICON_DETECT_ONNX_PATH, task = 'detect')
+
+
+class ParallelCaptionModel:
+    """
+    Wraps the caption model so that `generate` splits the crop batch across worker threads.
+    PyTorch releases the GIL inside its kernels, so the slices run concurrently.
+    All other attributes (`device`, `dtype`, ...) are those of the wrapped model.
+    """
+    def __init__(self, model, num_workers: int, pad_token_id: int):
+        self.model = model
+        self.num_workers = num_workers
+        self.pad_token_id = pad_token_id
+        self.executor = ThreadPoolExecutor(max_workers = num_workers, thread_name_prefix = 'omniparser-caption')
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate(self, input_ids, pixel_values, **kwargs):
+        batch_size = input_ids.shape[0]
+        if self.num_workers <= 1 or batch_size <= 1:
+            return self.model.generate(input_ids = input_ids, pixel_values = pixel_values, **kwargs)
+
+        chunk_size = -(-batch_size // self.num_workers)
+        futures = [
+            self.executor.submit(self._generate_no_grad, input_ids[start:start + chunk_size], pixel_values[start:start + chunk_size], kwargs)
+            for start in range(0, batch_size, chunk_size)
+        ]
+        outputs = [future.result() for future in futures]
+
+        # Slices stop generating independently; right-pad to a common length (padding is skipped when decoding)
+        max_length = max(output.shape[1] for output in outputs)
+        return torch.cat([
+            torch.nn.functional.pad(output, (0, max_length - output.shape[1]), value = self.pad_token_id)
+            for output in outputs
+        ])
+
+    def _generate_no_grad(self, input_ids, pixel_values, kwargs):
+        # Grad mode is thread-local, so the caller's no_grad does not reach the workers
+        with torch.no_grad():
+            return self.model.generate(input_ids = input_ids, pixel_values = pixel_values, **kwargs)
+
+
+class CPUOmniParser(DefaultOmniParser):
+    def __init__(self, caption_workers: int = None, quantize: bool = True):
+        self.BOX_TRESHOLD = 0.05
+
+        cpu_count = os.cpu_count() or 1
+        caption_workers = caption_workers if caption_workers is not None else min(4, cpu_count)
+        # Intra-op threads are per calling thread; split the cores between the caption workers
+        torch.set_num_threads(max(1, cpu_count // caption_workers))
+
+        # Model
+        self.som_model = load_onnx_icon_detector()
+
+        self.caption_model_processor = get_caption_model_processor(model_name="florence2", model_name_or_path="OmniParser/weights/icon_caption_florence", device='cpu')
+        caption_model = self.caption_model_processor['model']
+        if quantize:
+            caption_model = torch.quantization.quantize_dynamic(caption_model, {torch.nn.Linear}, dtype = torch.qint8)
+        pad_token_id = self.caption_model_processor['processor'].tokenizer.pad_token_id
+        self.caption_model_processor['model'] = ParallelCaptionModel(caption_model, caption_workers, pad_token_id)
+
+
+def load_cpu_omniparser() -> CPUOmniParser:
+    caption_workers = os.environ.get('MACOSWORLD_OMNIPARSER_CPU_CAPTION_WORKERS')
+    return CPUOmniParser(
+        caption_workers = int(caption_workers) if caption_workers else None,
+        quantize = os.environ.get('MACOSWORLD_OMNIPARSER_CPU_QUANTIZE', '1').strip() != '0',
+    )
@@ -0,0 +1,161 @@
+"""
+Incremental OmniParser: re-parse only the parts of the screen that changed since the previous step.
+
+The new screenshot is compared with the previous one on a grid of tiles. Changed ("dirty") tiles are grouped into
+rectangles, grown by a margin so that elements crossing a tile border are seen whole, and only those rectangles are
+cropped and parsed. Elements of the previous parse that do not touch a dirty tile are carried over; elements found in
+a crop are kept only if they touch a dirty tile, since the margin is unchanged screen that is already covered by the
+carried-over elements. The merged list is put in a fixed order (text before icons, then top to bottom and left to
+right), so `<tag>` IDs follow the same rule on every step, and the annotated screenshot is redrawn with those IDs.
+
+Falls back to a full parse on the first step, when the screen size changes, and when more than `max_dirty_fraction`
+of the tiles changed (e.g. an app switch), where one full parse is cheaper than many crops.
+
+Enabled with MACOSWORLD_OMNIPARSER_INCREMENTAL=1 (in-process parser only). Settings (unset = default):
+    MACOSWORLD_OMNIPARSER_TILE_SIZE             tile edge in pixels (default 64)
+    MACOSWORLD_OMNIPARSER_TILE_MARGIN           margin around dirty regions in pixels (default 32)
+    MACOSWORLD_OMNIPARSER_MAX_DIRTY_FRACTION    dirty tile fraction above which a full parse is run (default 0.5)
+"""
+
+import os
+import copy
+
+import numpy as np
+from PIL import Image
+
+
+def _overlaps(box_a, box_b) -> bool:
+    return box_a[0] < box_b[2] and box_b[0] < box_a[2] and box_a[1] < box_b[3] and box_b[1] < box_a[3]
+
+def _set_centre_coord(parsed_content: dict):
+    bbox = parsed_content['bbox']
+    parsed_content['centre_coord'] = f"{((bbox[0] + bbox[2]) / 2):.6f} {((bbox[1] + bbox[3]) / 2):.6f}"
+
+def tag_order(parsed_content: dict):
+    """Sort key for `<tag>` numbering: text elements first, as in a full OmniParser parse, then reading order."""
+    bbox = parsed_content['bbox']
+    return (parsed_content.get('type') != 'text', round(bbox[1], 3), round(bbox[0], 3))
+
+
+class IncrementalOmniParser:
+    """
+    Per-task wrapper around a `DefaultOmniParser`; holds the previous screenshot and its elements.
+    `__call__` has the same signature and return value as `DefaultOmniParser.__call__`.
+    """
+    def __init__(self, parser, tile_size: int = 64, margin: int = 32, pixel_threshold: int = 8, max_dirty_fraction: float = 0.5):
+        self.parser = parser
+        self.tile_size = tile_size
+        self.margin = margin
+        self.pixel_threshold = pixel_threshold
+        self.max_dirty_fraction = max_dirty_fraction
+
+        self.previous_pixels = None
+        self.previous_parsed_content_list = None
+        self.previous_annotated_screenshot = None
+        # Per-call record of how much of the screen was parsed, for telemetry
+        self.last_parsed_fraction = None
+
+    def reset(self):
+        self.previous_pixels = None
+        self.previous_parsed_content_list = None
+        self.previous_annotated_screenshot = None
+
+    def dirty_tiles(self, pixels: np.ndarray) -> np.ndarray:
+        """Boolean (rows, columns) grid of tiles where any channel of any pixel changed by more than the threshold."""
+        height, width = pixels.shape[:2]
+        changed = (np.abs(pixels.astype(np.int16) - self.previous_pixels.astype(np.int16)) > self.pixel_threshold).any(axis = 2)
+        rows, columns = -(-height // self.tile_size), -(-width // self.tile_size)
+        padded = np.zeros((rows * self.tile_size, columns * self.tile_size), dtype = bool)
+        padded[:height, :width] = changed
+        return padded.reshape(rows, self.tile_size, columns, self.tile_size).any(axis = (1, 3))
+
+    def dirty_regions(self, tiles: np.ndarray, width: int, height: int) -> list:
+        """Pixel rectangles (x1, y1, x2, y2) covering the dirty tiles, grown by the margin; overlapping ones are merged."""
+        regions = []
+        for row, column in zip(*np.nonzero(tiles)):
+            regions.append([
+                max(column * self.tile_size - self.margin, 0),
+                max(row * self.tile_size - self.margin, 0),
+                min((column + 1) * self.tile_size + self.margin, width),
+                min((row + 1) * self.tile_size + self.margin, height),
+            ])
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    if _overlaps(regions[i], regions[j]):
+                        regions[i] = [min(regions[i][0], regions[j][0]), min(regions[i][1], regions[j][1]), max(regions[i][2], regions[j][2]), max(regions[i][3], regions[j][3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
+
+    def full_parse(self, screenshot: Image.Image, pixels: np.ndarray):
+        annotated_screenshot, parsed_content_list = self.parser(screenshot)
+        parsed_content_list = sorted(parsed_content_list, key = tag_order)
+        annotated_screenshot = self.parser.draw(screenshot, parsed_content_list)
+        self.last_parsed_fraction = 1.0
+        return self._remember(pixels, annotated_screenshot, parsed_content_list)
+
+    def _remember(self, pixels, annotated_screenshot, parsed_content_list):
+        self.previous_pixels = pixels
+        self.previous_annotated_screenshot = annotated_screenshot
+        self.previous_parsed_content_list = parsed_content_list
+        return annotated_screenshot, copy.deepcopy(parsed_content_list)
+
+    def __call__(self, screenshot: Image.Image):
+        pixels = np.asarray(screenshot.convert('RGB'))
+        if self.previous_pixels is None or self.previous_pixels.shape != pixels.shape:
+            return self.full_parse(screenshot, pixels)
+
+        tiles = self.dirty_tiles(pixels)
+        if not tiles.any():
+            self.last_parsed_fraction = 0.0
+            return self._remember(pixels, self.previous_annotated_screenshot, self.previous_parsed_content_list)
+        if tiles.mean() > self.max_dirty_fraction:
+            return self.full_parse(screenshot, pixels)
+
+        height, width = pixels.shape[:2]
+        # Dirty tiles in ratio coordinates, the unit of OmniParser bboxes
+        dirty_boxes = [
+            (column * self.tile_size / width, row * self.tile_size / height, min((column + 1) * self.tile_size, width) / width, min((row + 1) * self.tile_size, height) / height)
+            for row, column in zip(*np.nonzero(tiles))
+        ]
+        touches_dirty_tile = lambda bbox: any(_overlaps(bbox, dirty_box) for dirty_box in dirty_boxes)
+
+        parsed_content_list = [parsed_content for parsed_content in self.previous_parsed_content_list if not touches_dirty_tile(parsed_content['bbox'])]
+        parsed_area = 0
+        for x1, y1, x2, y2 in self.dirty_regions(tiles, width, height):
+            parsed_area += (x2 - x1) * (y2 - y1)
+            _, region_parsed_content_list = self.parser(screenshot.crop((x1, y1, x2, y2)))
+            for parsed_content in region_parsed_content_list:
+                # Crop ratio coordinates to screen ratio coordinates
+                bx1, by1, bx2, by2 = parsed_content['bbox']
+                parsed_content['bbox'] = [
+                    (x1 + bx1 * (x2 - x1)) / width, (y1 + by1 * (y2 - y1)) / height,
+                    (x1 + bx2 * (x2 - x1)) / width, (y1 + by2 * (y2 - y1)) / height,
+                ]
+                if touches_dirty_tile(parsed_content['bbox']):
+                    _set_centre_coord(parsed_content)
+                    parsed_content_list.append(parsed_content)
+
+        parsed_content_list.sort(key = tag_order)
+        annotated_screenshot = self.parser.draw(screenshot, parsed_content_list)
+        self.last_parsed_fraction = parsed_area / (width * height)
+        return self._remember(pixels, annotated_screenshot, parsed_content_list)
+
+
+def omniparser_incremental_enabled() -> bool:
+    return os.environ.get('MACOSWORLD_OMNIPARSER_INCREMENTAL', '0').strip().lower() in ['1', 'true', 'yes', 'on']
+
+def make_incremental_omniparser(parser) -> IncrementalOmniParser:
+    """Build a per-task incremental parser configured by environment variables."""
+    return IncrementalOmniParser(
+        parser,
+        tile_size = int(os.environ.get('MACOSWORLD_OMNIPARSER_TILE_SIZE', 64)),
+        margin = int(os.environ.get('MACOSWORLD_OMNIPARSER_TILE_MARGIN', 32)),
+        max_dirty_fraction = float(os.environ.get('MACOSWORLD_OMNIPARSER_MAX_DIRTY_FRACTION', 0.5)),
+    )
@@ -0,0 +1,99 @@
+"""
+OmniParser as a local inference service shared by several testbench processes.
+
+Start the server once per machine (models are loaded once and stay warm):
+
+    python -m utils.omniparser_service --port 8765                         # HTTP on 127.0.0.1:8765
+    python -m utils.omniparser_service --unix_socket /tmp/omniparser.sock  # Unix socket
+
+Then point the agents at it before launching `run.py` / `testbench.py`:
+
+    export OMNIPARSER_SERVICE_URL=http://127.0.0.1:8765          # or unix:///tmp/omniparser.sock
+
+Requests from concurrent environments are grouped into micro-batches: the batcher waits up to
+`--max_batch_wait_ms` for more screenshots after the first one, up to `--max_batch_size`, and parses them in one
+`DefaultOmniParser.parse_batch` call. `OmniParserClient` is a drop-in replacement for `DefaultOmniParser.__call__`.
+
+Endpoints:
+    POST /parse    body: PNG bytes; returns {"annotated_screenshot": <base64 PNG>, "parsed_content_list": [...]}
+    GET  /health   returns {"status": "ok", "requests": ..., "batches": ..., "mean_batch_size": ...}
+"""
+
+import io
+import os
+import time
+import base64
+import argparse
+
+from PIL import Image
+
+from utils.log import print_message
+from utils.batching_service import MicroBatcher, JSONRequestHandler, ServiceClient, make_http_server, encode_png
+
+
+class OmniParserRequestHandler(JSONRequestHandler):
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {"status": "ok", **self.server.batcher.stats()})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/parse':
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            screenshot = Image.open(io.BytesIO(self.read_body()))
+            screenshot.load()
+            annotated_screenshot, parsed_content_list = self.server.batcher.submit(screenshot).result()
+        except Exception as e:
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self.send_json(200, {
+            "annotated_screenshot": base64.b64encode(encode_png(annotated_screenshot)).decode('utf-8'),
+            "parsed_content_list": parsed_content_list,
+        })
+
+
+class OmniParserClient(ServiceClient):
+    """
+    Drop-in replacement for `DefaultOmniParser.__call__` that sends screenshots to a running service.
+
+    `url` is `http://host:port` or `unix:///path/to/socket`.
+    """
+    def __call__(self, screenshot: Image.Image):
+        payload = self.request('POST', '/parse', body = encode_png(screenshot), content_type = 'image/png')
+        annotated_screenshot = Image.open(io.BytesIO(base64.b64decode(payload['annotated_screenshot'])))
+        return annotated_screenshot, payload['parsed_content_list']
+
+
+def serve(host: str, port: int, unix_socket: str, device: str, max_batch_size: int, max_batch_wait_ms: float):
+    from utils.omniparser import load_omniparser
+
+    load_start = time.perf_counter()
+    omniparser = load_omniparser(device)
+    print_message(f'Models loaded in {time.perf_counter() - load_start:.1f}s', title = 'OmniParser Service')
+
+    server, address = make_http_server(host, port, unix_socket, OmniParserRequestHandler)
+    server.batcher = MicroBatcher(omniparser.parse_batch, max_batch_size = max_batch_size, max_batch_wait_seconds = max_batch_wait_ms / 1000, name = 'omniparser-batcher')
+
+    print_message(f'Serving at {address} (max batch {max_batch_size}, wait {max_batch_wait_ms}ms)', title = 'OmniParser Service')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix_socket', type=str, default=None) # overrides --host/--port
+    parser.add_argument('--device', type=str, default='cuda') # 'cpu' selects the ONNX/int8 CPU backend
+    parser.add_argument('--max_batch_size', type=int, default=8)
+    parser.add_argument('--max_batch_wait_ms', type=float, default=20)
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.unix_socket, args.device, args.max_batch_size, args.max_batch_wait_ms)
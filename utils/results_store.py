@@ -0,0 +1,260 @@
+"""
+Append-only columnar store of task results, kept next to the results tree in `<base_save_dir>/.results_store/`.
+
+When a task completes, testbench appends one row to the store as a small Parquet file. The row holds the score,
+the distraction outcome, step count, wall time, attempts and the token, cost and latency totals of
+`context/telemetry.json`. `compact_results_store` merges those files into one. Readers load every Parquet file of
+the directory and keep the latest row per (category, uuid, task_language, env_language), so they can run while other
+testbench processes are still appending. A read that finds a file already removed by a concurrent compaction lists
+the directory again and restarts, so it reads the merged file instead.
+
+    <base_save_dir>/.results_store/
+        compacted-<ns>.parquet                                  merged rows
+        part-<ns>-<uuid>_<task_language>_<env_language>.parquet one completed task each
+
+`backfill_results_store` fills a store from a results tree written before the store existed, or from tasks that were
+graded elsewhere. `scripts/aggregate_results_utils.py` queries the store (`load_results`, `scores_by_category`,
+`scores_by_language`, `overall_scores`). Writing and reading need `pyarrow`.
+"""
+
+import os
+import json
+import time
+import fcntl
+
+from utils.log import print_message
+from utils.trajectory_archive import read_task_file
+
+RESULTS_STORE_DIRNAME = '.results_store'
+KEY_COLUMNS = ['category', 'uuid', 'task_language', 'env_language']
+
+# Weights of the overall score, by task category folder; other categories (safety, advanced) are not part of it
+CATEGORY_WEIGHTS = {
+    'sys_and_interface': 29,
+    'sys_apps':          38,
+    'file_management':   29,
+    'productivity':      35,
+    'media':             12,
+    'multi_apps':        28,
+}
+
+# Totals of `context/telemetry.json` copied into each row
+TELEMETRY_COLUMNS = [
+    'prompt_tokens', 'cached_prompt_tokens', 'completion_tokens', 'image_count', 'image_bytes', 'llm_calls',
+    'llm_latency_seconds', 'retries', 'cache_hits', 'failed_llm_calls', 'estimated_cost_usd', 'screen_parses',
+    'screen_parse_cache_hits',
+]
+
+def get_schema():
+    import pyarrow as pa
+    return pa.schema(
+        [
+            ('category', pa.string()),
+            ('uuid', pa.string()),
+            ('task_language', pa.string()),
+            ('env_language', pa.string()),
+            ('agent', pa.string()),
+            ('model', pa.string()),
+            ('score', pa.int64()),                  # null if grading failed
+            ('eval_failed', pa.bool_()),
+            ('distraction_result', pa.string()),    # gold / distracted / not_handled / error / error_no_match; null without a distraction event
+            ('steps', pa.int64()),
+            ('attempts', pa.int64()),
+            ('task_seconds', pa.float64()),         # wall time of the successful attempt, including environment reset and grading
+            ('agent_seconds', pa.float64()),
+            ('model_load_seconds', pa.float64()),
+        ]
+        + [(column, pa.float64() if column.endswith(('seconds', 'usd')) else pa.int64()) for column in TELEMETRY_COLUMNS]
+        + [('completed_at', pa.float64())]
+    )
+
+def get_results_store_dir(base_save_dir: str) -> str:
+    return os.path.join(base_save_dir, RESULTS_STORE_DIRNAME)
+
+
+def read_task_result(save_dir: str) -> dict:
+    """
+    Row of one task directory `<category>/<uuid>_<task_language>_<env_language>`, read from its `eval_result.txt`,
+    `distraction_result.txt` and `context/telemetry.json`. Returns None if the task has not been graded.
+    """
+    category = os.path.basename(os.path.dirname(os.path.normpath(save_dir)))
+    uuid, task_language, env_language = os.path.basename(os.path.normpath(save_dir)).split('_')
+
+    eval_file = os.path.join(save_dir, 'eval_result.txt')
+    if not os.path.isfile(eval_file):
+        return None
+    with open(eval_file, 'r') as f:
+        first_line = f.readline().strip()
+    try:
+        score, eval_failed = int(first_line), int(first_line) < 0
+    except ValueError:
+        score, eval_failed = None, True
+
+    distraction_result = None
+    distraction_file = os.path.join(save_dir, 'distraction_result.txt')
+    if os.path.isfile(distraction_file):
+        with open(distraction_file, 'r') as f:
+            distraction_result = f.readline().strip()
+
+    row = {
+        'category': category,
+        'uuid': uuid,
+        'task_language': task_language,
+        'env_language': env_language,
+        'agent': None,
+        'model': None,
+        'score': score,
+        'eval_failed': eval_failed,
+        'distraction_result': distraction_result,
+        'steps': None,
+        'attempts': None,
+        'task_seconds': None,
+        'agent_seconds': None,
+        'model_load_seconds': None,
+        **{column: None for column in TELEMETRY_COLUMNS},
+        'completed_at': os.path.getmtime(eval_file),
+    }
+
+    # In context/, or in the task's trajectory archive
+    telemetry_data = read_task_file(save_dir, 'context/telemetry.json')
+    if telemetry_data is not None:
+        try:
+            telemetry = json.loads(telemetry_data)
+        except ValueError as e:
+            print_message(f'Could not parse the telemetry of {save_dir}: {e}', title = 'Results Store')
+        else:
+            totals = telemetry['totals']
+            steps = telemetry['steps']
+            row['model'] = telemetry['model']
+            row['steps'] = totals['steps']
+            row['model_load_seconds'] = telemetry.get('model_load_seconds')
+            # Same definition as `aggregate_telemetry`
+            if steps:
+                row['agent_seconds'] = steps[-1]['timestamp'] - steps[0]['timestamp'] + steps[0]['llm_latency_seconds']
+            for column in TELEMETRY_COLUMNS:
+                row[column] = totals.get(column)
+    return row
+
+
+def _write_table(table, path: str):
+    import pyarrow.parquet as pq
+    # Readers skip files whose names start with '.', so a partially written file is never read
+    tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.tmp')
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+def append_results(base_save_dir: str, rows: list) -> str:
+    """Append rows (dicts with the store's columns) as one new Parquet file and return its path."""
+    import pyarrow as pa
+    store_dir = get_results_store_dir(base_save_dir)
+    os.makedirs(store_dir, exist_ok = True)
+    schema = get_schema()
+    table = pa.Table.from_pylist([{name: row.get(name) for name in schema.names} for row in rows], schema = schema)
+    suffix = f'-{rows[0]["uuid"]}_{rows[0]["task_language"]}_{rows[0]["env_language"]}' if len(rows) == 1 else f'-{len(rows)}rows'
+    path = os.path.join(store_dir, f'part-{time.time_ns()}{suffix}.parquet')
+    _write_table(table, path)
+    return path
+
+def record_task_result(base_save_dir: str, save_dir: str, agent: str, attempts: int, task_seconds: float) -> dict:
+    """Append the result of a task that has just been graded in `save_dir`."""
+    row = read_task_result(save_dir)
+    if row is None:
+        raise FileNotFoundError(f'No eval_result.txt in {save_dir}')
+    row.update({'agent': agent, 'attempts': attempts, 'task_seconds': round(task_seconds, 3), 'completed_at': time.time()})
+    append_results(base_save_dir, [row])
+    return row
+
+
+def _store_files(store_dir: str) -> list:
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(
+        os.path.join(store_dir, name) for name in os.listdir(store_dir)
+        if name.endswith('.parquet') and not name.startswith('.')
+    )
+
+def read_results_table(base_save_dir: str):
+    """All rows of the store as an Arrow table, latest row per task, or None if the store is empty."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    while True:
+        tables = []
+        try:
+            for path in _store_files(get_results_store_dir(base_save_dir)):
+                tables.append(pq.read_table(path))
+            break
+        except FileNotFoundError:
+            # Merged and removed by a concurrent compaction. Its output may not have been listed yet, so list again
+            continue
+    if not tables:
+        return None
+    table = pa.concat_tables(tables, promote_options = 'default').sort_by('completed_at')
+
+    # Keep the latest row of each task: after sorting, the one with the highest row number
+    row_numbers = table.append_column('_row', pa.array(range(table.num_rows))).group_by(KEY_COLUMNS).aggregate([('_row', 'max')])
+    return table.take(row_numbers.column('_row_max')).sort_by([(column, 'ascending') for column in KEY_COLUMNS])
+
+def compact_results_store(base_save_dir: str) -> int:
+    """
+    Merge the store's files into one, keeping the latest row per task, and return the number of rows.
+    Skipped (returns -1) while another process is compacting the same store.
+    """
+    store_dir = get_results_store_dir(base_save_dir)
+    if not os.path.isdir(store_dir):
+        return 0
+    with open(os.path.join(store_dir, '.compact.lock'), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return -1
+        inputs = _store_files(store_dir)
+        if len(inputs) <= 1:
+            return read_results_table(base_save_dir).num_rows if inputs else 0
+        table = read_results_table(base_save_dir)
+        _write_table(table, os.path.join(store_dir, f'compacted-{time.time_ns()}.parquet'))
+        # Files appended after `inputs` was listed are kept
+        for path in inputs:
+            os.remove(path)
+    return table.num_rows
+
+
+def backfill_results_store(base_save_dir: str, agent: str = None) -> int:
+    """
+    Add the graded tasks of the results tree that the store does not have yet, and return how many were added.
+    These rows have no attempt count or task wall time; `agent` defaults to the name of `base_save_dir`.
+    """
+    existing = read_results_table(base_save_dir)
+    existing_keys = set()
+    if existing is not None:
+        existing_keys = set(zip(*(existing.column(column).to_pylist() for column in KEY_COLUMNS)))
+    agent = agent or os.path.basename(os.path.normpath(base_save_dir))
+
+    rows = []
+    for category in sorted(os.listdir(base_save_dir)):
+        category_dir = os.path.join(base_save_dir, category)
+        if category.startswith('.') or not os.path.isdir(category_dir):
+            continue
+        for sub in sorted(os.listdir(category_dir)):
+            parts = sub.split('_')
+            if len(parts) != 3 or (category, *parts) in existing_keys or not os.path.isdir(os.path.join(category_dir, sub)):
+                continue
+            row = read_task_result(os.path.join(category_dir, sub))
+            if row is not None:
+                row['agent'] = agent
+                rows.append(row)
+
+    if rows:
+        append_results(base_save_dir, rows)
+        print_message(f'Added {len(rows)} task results to {get_results_store_dir(base_save_dir)}', title = 'Results Store')
+    return len(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Backfill and compact the results store of a results directory.')
+    parser.add_argument('--base_save_dir', type = str, required = True)
+    parser.add_argument('--agent', type = str, default = None)
+    args = parser.parse_args()
+
+    backfill_results_store(args.base_save_dir, args.agent)
+    print_message(f'{compact_results_store(args.base_save_dir)} task results in the store', title = 'Results Store')
@@ -1,5 +1,4 @@
 import os
-import boto3
 import time
 
 from utils.VNCClient import VNCClient_SSH
@@ -7,9 +6,13 @@ from utils.evaluator import Evaluator
 from utils.async_utils import AsyncSSHCommandHandler
 
 from utils.log import print_message
+from utils.artifact_writer import get_artifact_writer
 from utils.vmware_utils import VMwareTools
+from utils.ec2_fleet import get_ec2_fleet
+from utils.timing import record_task_timing, span, timed_sleep
 
 from agent.get_gui_agent import get_gui_agent
+from agent.image_pipeline import ImagePipeline
 
 from constants import ami_lookup_table
 
@@ -30,6 +33,11 @@ def inprocess_result_matching(inprocess_stdout: str, inprocess_gold_elements: li
         inprocess_eval_result = 'error_no_match'
     return inprocess_eval_result
 
+
+class TaskAbortedException(Exception):
+    pass
+
+@record_task_timing
 def run_task(
     # Task-related params
     task_id: str,
@@ -53,6 +61,9 @@ def run_task(
 
     # GUI agent
     gui_agent_name: str,
+    image_pipeline: str,
+    stream: bool,
+    image_eviction_chunk: int,
 
     # Runtime
     max_steps: int,
@@ -60,6 +71,11 @@ def run_task(
     pre_command_max_trials: int,
     env_init_command: str,
     eval_init_command: str,
+
+    # Set when the environment was reset to `snapshot_name` and initialised by the warm pool (utils/warm_pool.py)
+    environment_ready: bool = False,
+    # Checked between steps and before grading; once it returns True, the task stops with `TaskAbortedException`
+    should_abort = None,
 ):
     task_uuid = task_dict["id"]
     task_id = task_id
@@ -74,54 +90,46 @@ def run_task(
     
 
 
+    # Artifacts of a previous attempt in this directory are overwritten
+    get_artifact_writer().begin_task(save_dir)
+
     # Env reset
-    cumulative_waiting_time = 0
-    if override_env_reset:
-        print('Please manually reset the environment. Press `c` to continue.')
-        breakpoint()
-    elif vmx_path is not None:
-        # VMware env
-        snapshot_revert_max_trials = 5
-        vmware_tools = VMwareTools(
-            guest_username = guest_username,
-            guest_password = guest_password,
-            ssh_host = None,
-            ssh_pkey = ssh_pkey,
-            vmx_path = vmx_path
-        )
-        for trial in range(1, snapshot_revert_max_trials + 1):
-            if trial > 1:
-                print_message(f'Retrying starting guest machine... ({trial}/{snapshot_revert_max_trials})')
-            revert_success_flag, ssh_host = vmware_tools.revert_to_snapshot(snapshot_name)
-            if revert_success_flag:
-                break
+    with span('env_reset'):
+        cumulative_waiting_time = 0
+        if environment_ready:
+            print_message(f'Using {instance_id}, prepared for {snapshot_name} by the warm pool', title = 'Warm Pool')
+        elif override_env_reset:
+            print('Please manually reset the environment. Press `c` to continue.')
+            breakpoint()
+        elif vmx_path is not None:
+            # VMware env
+            snapshot_revert_max_trials = 5
+            vmware_tools = VMwareTools(
+                guest_username = guest_username,
+                guest_password = guest_password,
+                ssh_host = None,
+                ssh_pkey = ssh_pkey,
+                vmx_path = vmx_path
+            )
+            for trial in range(1, snapshot_revert_max_trials + 1):
+                if trial > 1:
+                    print_message(f'Retrying starting guest machine... ({trial}/{snapshot_revert_max_trials})')
+                revert_success_flag, ssh_host = vmware_tools.revert_to_snapshot(snapshot_name)
+                if revert_success_flag:
+                    break
         
-        print_message(f'Guest machine started successfully at {ssh_host}', title = 'VMware')
+            print_message(f'Guest machine started successfully at {ssh_host}', title = 'VMware')
         
-    else:
-        # AWS env
-        snapshot_id = ami_lookup_table[snapshot_name]
-        ec2_client = boto3.client('ec2')
-        replace_root_volume_task_response = ec2_client.create_replace_root_volume_task(
-            InstanceId=instance_id,       # Instance currently running
-            # SnapshotId=snapshot_id,     # EBS snapshot
-            ImageId=snapshot_id,
-            DeleteReplacedRootVolume=True
-        )
-        print_message(f'Reinitiating instance "{instance_id}" from image "{snapshot_id}"', title = 'EC2')
-
-        while True:
-            describe_replace_root_volume_tasks_response = ec2_client.describe_replace_root_volume_tasks(
-                ReplaceRootVolumeTaskIds=[replace_root_volume_task_response['ReplaceRootVolumeTask']['ReplaceRootVolumeTaskId']]
-            )
-            if describe_replace_root_volume_tasks_response['ReplaceRootVolumeTasks'][0]['TaskState'] == 'succeeded':
-                print_message(f'Recovery complete. Duration {cumulative_waiting_time}s. ', title = 'EC2')
-                break
-            cumulative_waiting_time += 10
-            if cumulative_waiting_time > snapshot_recovery_timeout_seconds:
+        else:
+            # AWS env
+            snapshot_id = ami_lookup_table[snapshot_name]
+            # Polled together with the resets of other environments of this process (utils/ec2_fleet.py)
+            reset_future = get_ec2_fleet().reset(instance_id, snapshot_id, timeout_seconds = snapshot_recovery_timeout_seconds)
+            try:
+                cumulative_waiting_time = reset_future.result()
+            except TimeoutError:
                 print_message(f'Timeout recovering instance "{instance_id}" from image "{snapshot_id}"', title = 'Error')
-                raise TimeoutError
-            time.sleep(10)
+                raise
 
 
     # Establish remote connection
@@ -134,54 +142,59 @@ def run_task(
         vmx_path = vmx_path
     )
 
-    print_message(f'Checking ssh connectivity to {ssh_host}', title = 'VNC Client')
-    while True:
-        if remote_client.check_ssh_connectivity():
-            break
-        cumulative_waiting_time += 10
-        if cumulative_waiting_time > snapshot_recovery_timeout_seconds:
-            if vmx_path is None:
-                # AWS
-                raise TimeoutError(f'Timeout recovering instance "{instance_id}" from image "{snapshot_id}"')
-            else:
-                # VMware
-                raise TimeoutError(f'Timeout establishing ssh connection to {ssh_host}')
-        time.sleep(10)
+    if not environment_ready:
+        with span('ssh_wait'):
+            print_message(f'Checking ssh connectivity to {ssh_host}', title = 'VNC Client')
+            while True:
+                if remote_client.check_ssh_connectivity():
+                    break
+                cumulative_waiting_time += 10
+                if cumulative_waiting_time > snapshot_recovery_timeout_seconds:
+                    if vmx_path is None:
+                        # AWS
+                        raise TimeoutError(f'Timeout recovering instance "{instance_id}" from image "{snapshot_id}"')
+                    else:
+                        # VMware
+                        raise TimeoutError(f'Timeout establishing ssh connection to {ssh_host}')
+                time.sleep(10)
 
     remote_client.connect()
     print_message(f'Connected to {ssh_host}', title = 'VNC Client')
 
 
     # Construct GUI Agent
-    gui_agent = get_gui_agent(gui_agent_name, remote_client)
+    with span('agent_init'):
+        gui_agent = get_gui_agent(gui_agent_name, remote_client, image_pipeline = ImagePipeline.from_spec(image_pipeline), stream = stream, image_eviction_chunk = image_eviction_chunk)
 
     # print('Manually reset the environment')
     # breakpoint()
 
     # Run prep command
-    remote_client.run_ssh_command(env_init_command)
-    if 'pre_command' in task_dict:
-        pre_command = task_dict['pre_command']
-        pre_command_complete_flag = False
-        for trial in range(pre_command_max_trials):
-            if isinstance(pre_command, str):
-                # When the prep command is a string
-                pre_command_complete_flag, pre_command_output = remote_client.run_ssh_command(pre_command)
-            elif isinstance(pre_command, dict):
-                # When the prep command is a dict of language-dependent string
-                if env_language in pre_command:
-                    pre_command_complete_flag, pre_command_output = remote_client.run_ssh_command(pre_command[env_language])
+    with span('prep_command'):
+        if not environment_ready:
+            remote_client.run_ssh_command(env_init_command)
+        if 'pre_command' in task_dict:
+            pre_command = task_dict['pre_command']
+            pre_command_complete_flag = False
+            for trial in range(pre_command_max_trials):
+                if isinstance(pre_command, str):
+                    # When the prep command is a string
+                    pre_command_complete_flag, pre_command_output = remote_client.run_ssh_command(pre_command)
+                elif isinstance(pre_command, dict):
+                    # When the prep command is a dict of language-dependent string
+                    if env_language in pre_command:
+                        pre_command_complete_flag, pre_command_output = remote_client.run_ssh_command(pre_command[env_language])
+                    else:
+                        raise NotImplementedError(f'Task {task_id} has no preparation command for env language "{env_language}".')
                 else:
-                    raise NotImplementedError(f'Task {task_id} has no preparation command for env language "{env_language}".')
-            else:
-                raise TypeError(f'Unknown prep command type ({type(pre_command)}) in task {task_id}.')
-            if pre_command_complete_flag:
-                # When the prep command finishes
-                break
-        if "force_error_free_prep" in task_dict:
-            if task_dict["force_error_free_prep"] and not pre_command_complete_flag:
-                # When the prep command repeatedly encounter errors until a max trial
-                raise RuntimeError(f'Prep command not finished for task {task_id}.')
+                    raise TypeError(f'Unknown prep command type ({type(pre_command)}) in task {task_id}.')
+                if pre_command_complete_flag:
+                    # When the prep command finishes
+                    break
+            if "force_error_free_prep" in task_dict:
+                if task_dict["force_error_free_prep"] and not pre_command_complete_flag:
+                    # When the prep command repeatedly encounter errors until a max trial
+                    raise RuntimeError(f'Prep command not finished for task {task_id}.')
             
     inprocess_event_handler = None
     if 'in_process' in task_dict:
@@ -191,50 +204,71 @@ def run_task(
     if 'before_action_delay_seconds' in task_dict:
         before_action_delay_seconds = task_dict['before_action_delay_seconds']
         print_message(f'Waiting for {before_action_delay_seconds}s before benchmarking', title = f'Task {task_id}/{env_language}/{task_language}')
-        time.sleep(before_action_delay_seconds)
+        timed_sleep(before_action_delay_seconds, 'before_action_delay')
 
 
     # Start interactive loop
 
     task = task_dict['task'][task_language]
 
-    for current_step in range(1, max_steps + 1):
-        time.sleep(5)
-
-        # Inject events
-        if inprocess_event_handler is not None:
-            if current_step == inprocess_event_start_timestep:
-                inprocess_event_handler.run_command(inprocess_command)
-                time.sleep(5)
-                print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Distraction event injected')
-
-        # Call agent
-        status = gui_agent.step(
-            task_id = task_id,
-            current_step = current_step,
-            max_steps = max_steps,
-            env_language = env_language,
-            task_language = task_language,
-
-            task = task,
-            task_step_timeout = task_step_timeout,
-            save_dir = save_dir
-        )
-
-        print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = f'Status: {status}')
+    def check_abort(stage: str):
+        if should_abort is not None and should_abort():
+            raise TaskAbortedException(f'Task {task_id}/{env_language}/{task_language} aborted {stage}')
+
+    try:
+        for current_step in range(1, max_steps + 1):
+            check_abort(f'before step {current_step}')
+            timed_sleep(5, 'step_delay')
+
+            # Inject events
+            if inprocess_event_handler is not None:
+                if current_step == inprocess_event_start_timestep:
+                    with span('distraction_inject'):
+                        inprocess_event_handler.run_command(inprocess_command)
+                        time.sleep(5)
+                    print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = 'Distraction event injected')
+
+            # Call agent
+            with span('agent_step'):
+                status = gui_agent.step(
+                    task_id = task_id,
+                    current_step = current_step,
+                    max_steps = max_steps,
+                    env_language = env_language,
+                    task_language = task_language,
+
+                    task = task,
+                    task_step_timeout = task_step_timeout,
+                    save_dir = save_dir
+                )
+
+            print_message(title = f'Task {task_id}/{env_language}/{task_language} Step {current_step}/{max_steps}', content = f'Status: {status}')
         
-        if status != "unfinished":
-            break
+            if status != "unfinished":
+                break
 
-    gui_agent.save_conversation_history(save_dir)
+        gui_agent.save_conversation_history(save_dir)
+    except BaseException:
+        # Keep the artifacts written so far, but let the step's exception, not a failed flush, end the attempt
+        try:
+            with span('artifact_flush'):
+                get_artifact_writer().flush()
+        except Exception as flush_error:
+            print_message(f'Flushing step artifacts failed: {type(flush_error).__name__}: {flush_error}', title = f'Task {task_id}/{env_language}/{task_language}')
+        raise
+    # Step artifacts are written in the background; make them durable before grading
+    with span('artifact_flush'):
+        get_artifact_writer().flush()
 
 
 
 
     # In-process event grading
+    check_abort('before distraction grading')
     if inprocess_event_handler is not None:
         # End event
-        inprocess_return_code, inprocess_stdout, inprocess_stderr, inprocess_end_type = inprocess_event_handler.end_command()
+        with span('distraction_grading'):
+            inprocess_return_code, inprocess_stdout, inprocess_stderr, inprocess_end_type = inprocess_event_handler.end_command()
 
         # Print result
         inprocess_log_message = f'Log as follows:\nReturn value {inprocess_return_code}\nSTDOUT: {inprocess_stdout}\nSTDERR: {inprocess_stderr}'
@@ -285,12 +319,14 @@ def run_task(
         before_grading_delay_seconds = task_dict['before_grading_delay_seconds']
         if before_grading_delay_seconds > 0:
             print_message(f'Waiting for {before_grading_delay_seconds}s before grading', title = f'Task {task_id}/{env_language}/{task_language}')
-            time.sleep(before_grading_delay_seconds)
+            timed_sleep(before_grading_delay_seconds, 'before_grading_delay')
 
-    evaluator = Evaluator(ssh_host, guest_username, ssh_pkey)
-    evaluator.run_command(eval_init_command)
+    check_abort('before grading')
+    with span('grading'):
+        evaluator = Evaluator(ssh_host, guest_username, ssh_pkey)
+        evaluator.run_command(eval_init_command)
 
-    eval_result = evaluator(task_dict["grading_command"])
+        eval_result = evaluator(task_dict["grading_command"])
     print_message(title = 'Evaluation result', content = str(eval_result))
 
     if isinstance(eval_result, int):
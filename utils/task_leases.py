@@ -0,0 +1,254 @@
+"""
+Expiring leases on task units, so that several driver hosts can share one results directory.
+
+A unit is one task in one language pair, named like its result directory (`<category>/<uuid>_<task_language>_<env_language>`).
+Before running a unit, testbench claims its lease. A claim succeeds if the unit has no lease, if its lease has
+expired or been released, or if the lease belongs to the same driver, e.g. a testbench that `run.py` restarted.
+While the unit runs, `LeaseKeeper` renews the lease every third of its TTL. A driver that dies stops renewing, and
+once the TTL has passed, another driver reclaims the unit and starts it again. Results stay in the results tree:
+a unit is finished when its `eval_result.txt` exists, and leases only guard units in progress.
+
+Two stores are available, selected by `--lease_store`:
+    (default)             files in `<base_save_dir>/.leases/`, for drivers that share the results directory over
+                          a network file system. Claims rely on the atomicity of hard-link creation, which NFS provides.
+    sqlite:<path>         an SQLite database, for drivers on one host or on a file system with reliable POSIX locks.
+
+Drivers are told apart by `--driver_id`, which defaults to the host name and the driver's environment (its EC2
+instance ID or VMX file name). That default is unique per driver on a host and stays the same when `run.py` restarts
+the testbench, so a restarted driver reclaims its own units at once.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+
+from utils.log import print_message
+
+LEASES_DIRNAME = '.leases'
+DEFAULT_LEASE_TTL_SECONDS = 300
+
+
+class Lease:
+    def __init__(self, unit: str, owner: str, token: str, expires_at: float, generation: int = 0):
+        self.unit = unit
+        self.owner = owner
+        self.token = token
+        self.expires_at = expires_at
+        self.generation = generation
+        self.lost = False
+
+    def to_dict(self) -> dict:
+        return {"unit": self.unit, "owner": self.owner, "token": self.token, "expires_at": self.expires_at}
+
+    def __repr__(self):
+        return f'Lease({self.unit}, {self.owner}, expires in {self.expires_at - time.time():.0f}s)'
+
+
+def _claimable(record: dict, owner: str, now: float) -> bool:
+    return record is None or record["expires_at"] <= now or record["owner"] == owner
+
+
+class FileLeaseStore:
+    """
+    One file per lease generation: `<unit>.<generation>.lease`. The highest generation of a unit is its lease.
+    Taking over a lease creates the next generation with `os.link`, which fails if it exists, so of several drivers
+    that find the same lease expired only one wins. A driver whose lease was taken over notices at its next renewal.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+
+    def _prefix(self, unit: str) -> str:
+        return unit.replace(os.sep, '__').replace('/', '__') + '.'
+
+    def _path(self, unit: str, generation: int) -> str:
+        return os.path.join(self.directory, f'{self._prefix(unit)}{generation}.lease')
+
+    def _generations(self, unit: str) -> list:
+        prefix = self._prefix(unit)
+        generations = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith('.lease'):
+                middle = name[len(prefix):-len('.lease')]
+                if middle.isdigit():
+                    generations.append(int(middle))
+        return sorted(generations)
+
+    def _read(self, path: str) -> dict:
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, path: str, record: dict):
+        tmp_path = os.path.join(self.directory, f'.{uuid.uuid4().hex}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+    def try_claim(self, unit: str, owner: str, ttl_seconds: float) -> Lease:
+        generations = self._generations(unit)
+        current = generations[-1] if generations else -1
+        if current >= 0:
+            record = self._read(self._path(unit, current))
+            # A generation being written has no content yet; treat it as held
+            if record is None or not _claimable(record, owner, time.time()):
+                return None
+        lease = Lease(unit, owner, uuid.uuid4().hex, time.time() + ttl_seconds, current + 1)
+        tmp_path = os.path.join(self.directory, f'.{lease.token}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(lease.to_dict(), f)
+        try:
+            os.link(tmp_path, self._path(unit, lease.generation))
+        except FileExistsError:
+            return None
+        finally:
+            os.remove(tmp_path)
+        for generation in generations:
+            try:
+                os.remove(self._path(unit, generation))
+            except FileNotFoundError:
+                pass
+        return lease
+
+    def _is_current(self, lease: Lease) -> bool:
+        record = self._read(self._path(lease.unit, lease.generation))
+        return record is not None and record["token"] == lease.token and not os.path.exists(self._path(lease.unit, lease.generation + 1))
+
+    def renew(self, lease: Lease, ttl_seconds: float) -> bool:
+        if not self._is_current(lease):
+            return False
+        lease.expires_at = time.time() + ttl_seconds
+        self._write(self._path(lease.unit, lease.generation), lease.to_dict())
+        # Taken over between the check and the write: the new generation wins
+        return self._is_current(lease)
+
+    def release(self, lease: Lease):
+        if self._is_current(lease):
+            lease.expires_at = 0
+            self._write(self._path(lease.unit, lease.generation), lease.to_dict())
+
+    def get(self, unit: str) -> dict:
+        generations = self._generations(unit)
+        return self._read(self._path(unit, generations[-1])) if generations else None
+
+
+class SQLiteLeaseStore:
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok = True)
+        self.local = threading.local()
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS leases (unit TEXT PRIMARY KEY, owner TEXT, token TEXT, expires_at REAL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; `isolation_level = None` so that transactions are opened explicitly
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = sqlite3.connect(self.path, timeout = 30, isolation_level = None)
+        return self.local.connection
+
+    def try_claim(self, unit: str, owner: str, ttl_seconds: float) -> Lease:
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT owner, expires_at FROM leases WHERE unit = ?', (unit,)).fetchone()
+            if not _claimable(None if row is None else {"owner": row[0], "expires_at": row[1]}, owner, time.time()):
+                connection.execute('ROLLBACK')
+                return None
+            lease = Lease(unit, owner, uuid.uuid4().hex, time.time() + ttl_seconds)
+            connection.execute('INSERT OR REPLACE INTO leases (unit, owner, token, expires_at) VALUES (?, ?, ?, ?)', (unit, owner, lease.token, lease.expires_at))
+            connection.execute('COMMIT')
+            return lease
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def renew(self, lease: Lease, ttl_seconds: float) -> bool:
+        expires_at = time.time() + ttl_seconds
+        cursor = self._connect().execute('UPDATE leases SET expires_at = ? WHERE unit = ? AND token = ?', (expires_at, lease.unit, lease.token))
+        if cursor.rowcount == 1:
+            lease.expires_at = expires_at
+        return cursor.rowcount == 1
+
+    def release(self, lease: Lease):
+        self._connect().execute('UPDATE leases SET expires_at = 0 WHERE unit = ? AND token = ?', (lease.unit, lease.token))
+
+    def get(self, unit: str) -> dict:
+        row = self._connect().execute('SELECT owner, token, expires_at FROM leases WHERE unit = ?', (unit,)).fetchone()
+        return None if row is None else {"unit": unit, "owner": row[0], "token": row[1], "expires_at": row[2]}
+
+
+def get_lease_store(spec: str, base_save_dir: str):
+    """`sqlite:<path>` or a directory; by default `<base_save_dir>/.leases/`."""
+    if spec is None:
+        return FileLeaseStore(os.path.join(base_save_dir, LEASES_DIRNAME))
+    if spec.startswith('sqlite:'):
+        return SQLiteLeaseStore(spec[len('sqlite:'):])
+    return FileLeaseStore(spec)
+
+def get_driver_id(driver_id: str = None, instance_id: str = None, vmx_path: str = None) -> str:
+    """`driver_id` if given, else `<host name>:<instance ID or VMX file name>`."""
+    if driver_id:
+        return driver_id
+    environment_name = instance_id or (os.path.basename(vmx_path) if vmx_path else None)
+    return f'{socket.gethostname()}:{environment_name}' if environment_name else socket.gethostname()
+
+def get_unit_name(task_category: str, task_uuid: str, task_language: str, env_language: str) -> str:
+    return f'{task_category}/{task_uuid}_{task_language}_{env_language}'
+
+def held_by_other_driver(store, unit: str, driver_id: str) -> bool:
+    record = store.get(unit)
+    return record is not None and record["owner"] != driver_id and record["expires_at"] > time.time()
+
+
+class LeaseKeeper:
+    """Renews the leases that this driver holds from a background thread, every third of their TTL."""
+    def __init__(self, store, ttl_seconds: float = DEFAULT_LEASE_TTL_SECONDS):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.leases = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target = self._run, name = 'lease-keeper', daemon = True)
+        self.thread.start()
+
+    def claim(self, unit: str, owner: str) -> Lease:
+        """Claim `unit` and keep renewing its lease until `release`. Returns None if another driver holds it."""
+        lease = self.store.try_claim(unit, owner, self.ttl_seconds)
+        if lease is not None:
+            with self.lock:
+                self.leases.append(lease)
+        return lease
+
+    def release(self, lease: Lease):
+        with self.lock:
+            if lease in self.leases:
+                self.leases.remove(lease)
+        self.store.release(lease)
+
+    def _run(self):
+        while not self.stop_event.wait(self.ttl_seconds / 3):
+            with self.lock:
+                leases = list(self.leases)
+            for lease in leases:
+                try:
+                    renewed = self.store.renew(lease, self.ttl_seconds)
+                except Exception as e:
+                    # Retried at the next heartbeat; the lease is lost only if it expires meanwhile
+                    print_message(f'Renewing the lease of {lease.unit} failed: {type(e).__name__}: {e}', title = 'Task Leases')
+                    continue
+                if not renewed:
+                    lease.lost = True
+                    with self.lock:
+                        if lease in self.leases:
+                            self.leases.remove(lease)
+                    print_message(f'Lost the lease of {lease.unit} to another driver', title = 'Task Leases')
+
+    def stop(self):
+        self.stop_event.set()
@@ -1,27 +1,13 @@
 import io
+import threading
 import numpy as np
 import matplotlib.pyplot as plt
 from PIL import Image
 
-def add_coordinate_ticks_to_image(pil_img, dpi=100):
-    """
-    Adds coordinate ticks to a PIL image without resampling its content.
-
-    The image content (i.e. the axes region) will have the same pixel dimensions
-    as the original PIL image. Ticks are drawn along x and y with normalized values
-    in [0, 1] (formatted to one decimal). The image content is displayed with its
-    original aspect ratio (no extra white padding is added inside the axes).
+from utils.log import print_message
 
-    Parameters:
-      pil_img (PIL.Image.Image): The input image.
-      dpi (int): The DPI used for the Matplotlib figure (default 100).
-                 The axes region will be set to (width/dpi, height/dpi) inches.
-
-    Returns:
-      PIL.Image.Image: The new image (including ticks and labels).
-    """
-    # Convert PIL image to a NumPy array
-    img_array = np.array(pil_img)
+def _create_tick_figure(pil_img, dpi):
+    """Figure and axes laid out so that the axes region has exactly the pixel size of `pil_img`."""
     width, height = pil_img.size  # width, height in pixels
 
     # Compute the axes size (in inches) so that its pixel size is exactly (width, height)
@@ -48,14 +34,16 @@ def add_coordinate_ticks_to_image(pil_img, dpi=100):
 
     # Add an axes at the desired position
     ax = fig.add_axes([left, bottom, axes_width, axes_height])
+    return fig, ax
 
+def _draw_image_and_ticks(ax, img_array):
     # Display the image.
     # We set extent so that the image spans [0,1] in both directions.
     # Use origin='upper' to preserve the PIL orientation (top row is row 0).
     # Specify aspect='auto' to fill the axes area without enforcing a square aspect.
-    ax.imshow(img_array, extent=(0, 1, 0, 1), interpolation='nearest',
-              origin='upper', aspect='auto')
-    
+    axes_image = ax.imshow(img_array, extent=(0, 1, 0, 1), interpolation='nearest',
+                           origin='upper', aspect='auto')
+
     # Set ticks at multiples of 0.1 from 0 to 1
     ticks = np.linspace(0, 1, 11)
     x_tick_labels = [f"{tick:.1f}" for tick in ticks]
@@ -67,6 +55,17 @@ def add_coordinate_ticks_to_image(pil_img, dpi=100):
 
     # Optionally, you can adjust tick parameters (font size, etc.)
     ax.tick_params(direction='out', length=5, width=1)
+    return axes_image
+
+def render_coordinate_ticks_matplotlib(pil_img, dpi=100):
+    """
+    Reference renderer: draws `pil_img` and its ticks with a new Matplotlib figure and decodes the saved PNG.
+    `add_coordinate_ticks_to_image` produces the same pixels from a cached template.
+    """
+    # Convert PIL image to a NumPy array
+    img_array = np.array(pil_img)
+    fig, ax = _create_tick_figure(pil_img, dpi)
+    _draw_image_and_ticks(ax, img_array)
 
     # Save the entire figure (including margins) into an in-memory buffer
     buf = io.BytesIO()
@@ -74,4 +73,129 @@ def add_coordinate_ticks_to_image(pil_img, dpi=100):
     buf.seek(0)
     ticked_img = Image.open(buf).convert("RGB")
     plt.close(fig)
-    return ticked_img
\ No newline at end of file
+    return ticked_img
+
+
+class TickOverlayTemplate:
+    """
+    The tick frame of one image size, precomputed so that each frame is a paste plus a table lookup.
+
+    Matplotlib draws the axes spines over the outermost image pixels. Those pixels are blended with the spine
+    colour, with a coverage that is the same for every pixel of a spine side (and twice for the corners). Building
+    the template renders the frame around a black and a white image to find the untouched pixels and the blended
+    ones (including those the spines cover completely), then renders a few images of value ramps to tabulate, for
+    each kind of blended pixel, the output value of each of the 256 input values. The result is checked against the
+    reference renderer on a random image; `valid` is False if it does not match exactly.
+    """
+    def __init__(self, size: tuple, dpi: int):
+        width, height = size
+        self.size = size
+        self.dpi = dpi
+
+        fig, ax = _create_tick_figure(Image.new('RGB', size), dpi)
+        axes_image = _draw_image_and_ticks(ax, np.zeros((height, width, 3), dtype=np.uint8))
+        def render(img_array):
+            axes_image.set_data(img_array)
+            fig.canvas.draw()
+            return np.asarray(fig.canvas.buffer_rgba())[..., :3].copy()
+
+        try:
+            black = render(np.zeros((height, width, 3), dtype=np.uint8))
+            white = render(np.full((height, width, 3), 255, dtype=np.uint8))
+            difference = white.astype(np.int16) - black.astype(np.int16)
+
+            # The image fills the axes; every pixel that depends on it must lie inside
+            self.top, self.left = int(round(black.shape[0] - ax.bbox.y1)), int(round(ax.bbox.x0))
+            rows, columns = np.nonzero((difference != 0).any(axis=2))
+            if rows.min() < self.top or rows.max() >= self.top + height or columns.min() < self.left or columns.max() >= self.left + width:
+                raise ValueError('Image region of the figure does not match the image size.')
+            self.background = black
+
+            # Channels of the image region that are not a straight copy of the input, keyed by their (black, white) output
+            region = (slice(self.top, self.top + height), slice(self.left, self.left + width))
+            region_black, region_white = black[region].astype(np.int32), white[region].astype(np.int32)
+            blended = (region_white - region_black) != 255
+            self.image_index = np.flatnonzero(blended)
+            group_keys = (region_black.reshape(-1)[self.image_index] << 8) | region_white.reshape(-1)[self.image_index]
+            unique_keys, self.group = np.unique(group_keys, return_inverse=True)
+            channel_rows, channel_columns, channels = np.unravel_index(self.image_index, (height, width, 3))
+            self.canvas_index = np.ravel_multi_index((channel_rows + self.top, channel_columns + self.left, channels), black.shape)
+
+            # Each ramp render gives every blended channel a different input value; enough renders so that the
+            # smallest group (the corners) sees all 256 values
+            group_sizes = np.bincount(self.group)
+            rank_in_group = np.empty(len(self.group), dtype=np.int64)
+            for group_id in range(len(unique_keys)):
+                members = np.flatnonzero(self.group == group_id)
+                rank_in_group[members] = np.arange(len(members))
+            self.luts = np.full((len(unique_keys), 256), -1, dtype=np.int16)
+            for ramp in range(int(np.ceil(256 / group_sizes.min()))):
+                values = ((rank_in_group + ramp * group_sizes[self.group]) % 256).astype(np.uint8)
+                img_array = np.zeros((height, width, 3), dtype=np.uint8)
+                img_array.reshape(-1)[self.image_index] = values
+                output = render(img_array).reshape(-1)[self.canvas_index]
+                previous = self.luts[self.group, values]
+                if ((previous != -1) & (previous != output)).any():
+                    raise ValueError('Blended pixels of the same kind produce different outputs.')
+                self.luts[self.group, values] = output
+            if (self.luts == -1).any():
+                raise ValueError('Blend tables are incomplete.')
+            self.luts = self.luts.astype(np.uint8)
+            self.valid = True
+        except ValueError as e:
+            print_message(f'No tick template for {width}x{height}: {e}', title = 'Tick Tool')
+            self.valid = False
+        finally:
+            plt.close(fig)
+
+        if self.valid:
+            random_image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8))
+            self.valid = np.array_equal(np.asarray(self.apply(random_image)), np.asarray(render_coordinate_ticks_matplotlib(random_image, dpi)))
+            if not self.valid:
+                print_message(f'Tick template for {width}x{height} does not match the reference renderer', title = 'Tick Tool')
+
+    def apply(self, pil_img):
+        image = np.asarray(pil_img)
+        canvas = self.background.copy()
+        canvas[self.top:self.top + self.size[1], self.left:self.left + self.size[0]] = image
+        canvas.reshape(-1)[self.canvas_index] = self.luts[self.group, image.reshape(-1)[self.image_index]]
+        return Image.fromarray(canvas)
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def get_tick_template(size: tuple, dpi: int = 100) -> TickOverlayTemplate:
+    """Template for this image size and DPI, built on first use (a few seconds) and cached for the process."""
+    key = (tuple(size), dpi)
+    with _templates_lock:
+        if key not in _templates:
+            _templates[key] = TickOverlayTemplate(tuple(size), dpi)
+        return _templates[key]
+
+def add_coordinate_ticks_to_image(pil_img, dpi=100):
+    """
+    Adds coordinate ticks to a PIL image without resampling its content.
+
+    The image content (i.e. the axes region) will have the same pixel dimensions
+    as the original PIL image. Ticks are drawn along x and y with normalized values
+    in [0, 1] (formatted to one decimal). The image content is displayed with its
+    original aspect ratio (no extra white padding is added inside the axes).
+
+    RGB images are composited into a cached per-size template (`TickOverlayTemplate`); other modes, which
+    Matplotlib colour-maps or alpha-blends, and sizes without a valid template use `render_coordinate_ticks_matplotlib`.
+    Both produce the same pixels.
+
+    Parameters:
+      pil_img (PIL.Image.Image): The input image.
+      dpi (int): The DPI used for the Matplotlib figure (default 100).
+                 The axes region will be set to (width/dpi, height/dpi) inches.
+
+    Returns:
+      PIL.Image.Image: The new image (including ticks and labels).
+    """
+    if pil_img.mode == 'RGB':
+        template = get_tick_template(pil_img.size, dpi)
+        if template.valid:
+            return template.apply(pil_img)
+    return render_coordinate_ticks_matplotlib(pil_img, dpi)
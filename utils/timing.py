@@ -0,0 +1,153 @@
+"""
+Wall-clock timing of the phases of a task.
+
+`run_task` owns one `TaskTimer` per attempt (`record_task_timing`). Code on the task's path marks its phases with
+`span(name)` (a context manager), `timed(name)` (a method decorator) or `timed_sleep(seconds, name)`; outside a task
+these are no-ops. The current timer is a context variable, so only the thread that runs the task records into it;
+background threads such as the warm pool's preparations (utils/warm_pool.py) do not, even while a task runs. A helper
+thread of the task records into its timer if it runs its work with `contextvars.copy_context().run`.
+Spans nest per thread, so each span knows its own time net of the spans inside it. For example, `agent_step` contains
+`screenshot`, `model_call`, `actuation` and `action_interval`, and its own time is what the agent spends on everything
+else (image encoding, prompt building, parsing the response).
+
+At the end of the attempt, successful or not, the timer writes `<save_dir>/timing.json`:
+
+    {
+        "task_seconds": 812.4,
+        "error": null,
+        "phases": [{"name": "env_reset", "count": 1, "seconds": 402.1, "self_seconds": 402.1}, ...],   # by first occurrence
+        "spans": [{"name": "env_reset", "parent": null, "start": 0.0, "seconds": 402.1}, ...]
+    }
+
+where, for the spans of the task's thread, `self_seconds` summed over all phases plus the phase "other" (time
+outside any span) equals `task_seconds`.
+`scripts/aggregate_results_utils.py: aggregate_timing` reports where the time of a run goes.
+"""
+
+import os
+import json
+import time
+import inspect
+import contextvars
+import functools
+import threading
+from contextlib import contextmanager
+
+from utils.metrics import PHASE_SECONDS
+
+TIMING_FILENAME = 'timing.json'
+
+
+class TaskTimer:
+    def __init__(self):
+        self.start_time = time.time()
+        self.perf_start = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.error = None
+        self.thread_id = threading.get_ident()
+
+    def _stack(self) -> list:
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name: str):
+        stack = self._stack()
+        record = {
+            "name": name,
+            "parent": stack[-1]["name"] if stack else None,
+            "start": time.perf_counter() - self.perf_start,
+            "seconds": None,
+            "child_seconds": 0.0,
+            "task_thread": threading.get_ident() == self.thread_id,
+        }
+        stack.append(record)
+        try:
+            yield record
+        finally:
+            stack.pop()
+            record["seconds"] = time.perf_counter() - self.perf_start - record["start"]
+            if stack:
+                stack[-1]["child_seconds"] += record["seconds"]
+            with self.lock:
+                self.spans.append(record)
+            PHASE_SECONDS.observe(record["seconds"], phase = name)
+
+    def breakdown(self) -> dict:
+        task_seconds = time.perf_counter() - self.perf_start
+        with self.lock:
+            spans = sorted(self.spans, key = lambda record: record["start"])
+        phases = {}
+        for record in spans:
+            phase = phases.setdefault(record["name"], {"name": record["name"], "count": 0, "seconds": 0.0, "self_seconds": 0.0})
+            phase["count"] += 1
+            phase["seconds"] += record["seconds"]
+            phase["self_seconds"] += record["seconds"] - record["child_seconds"]
+        # Spans of other threads overlap with those of the task's thread, so only the latter count towards "other"
+        top_level_seconds = sum(record["seconds"] for record in spans if record["parent"] is None and record["task_thread"])
+        phases["other"] = {"name": "other", "count": 1, "seconds": max(0.0, task_seconds - top_level_seconds), "self_seconds": max(0.0, task_seconds - top_level_seconds)}
+        return {
+            "task_seconds": round(task_seconds, 4),
+            "start_time": self.start_time,
+            "error": self.error,
+            "phases": [{**phase, "seconds": round(phase["seconds"], 4), "self_seconds": round(phase["self_seconds"], 4)} for phase in phases.values()],
+            "spans": [{"name": record["name"], "parent": record["parent"], "start": round(record["start"], 4), "seconds": round(record["seconds"], 4)} for record in spans],
+        }
+
+    def save(self, save_dir: str):
+        with open(os.path.join(save_dir, TIMING_FILENAME), 'w') as f:
+            json.dump(self.breakdown(), f, indent = 4)
+
+
+_current_timer = contextvars.ContextVar('task_timer', default = None)
+
+def get_task_timer() -> TaskTimer:
+    """Timer of the task running in this context, or None."""
+    return _current_timer.get()
+
+@contextmanager
+def span(name: str):
+    timer = _current_timer.get()
+    if timer is None:
+        yield None
+        return
+    with timer.span(name) as record:
+        yield record
+
+def timed(name: str):
+    """Decorator that runs each call of the function in a span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_sleep(seconds: float, name: str):
+    with span(name):
+        time.sleep(seconds)
+
+def record_task_timing(fn):
+    """Decorator for `run_task`: times each call and saves the breakdown to its `save_dir`."""
+    signature = inspect.signature(fn)
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        save_dir = signature.bind(*args, **kwargs).arguments['save_dir']
+        timer = TaskTimer()
+        token = _current_timer.set(timer)
+        try:
+            return fn(*args, **kwargs)
+        except BaseException as e:
+            timer.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            _current_timer.reset(token)
+            try:
+                timer.save(save_dir)
+            except OSError:
+                pass  # the directory may be gone after a failed attempt
+    return wrapper
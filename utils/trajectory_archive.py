@@ -0,0 +1,239 @@
+"""
+Single-file trajectory container per task: `<save_dir>/trajectory.zip` in place of the files of `context/`.
+
+With MACOSWORLD_TRAJECTORY_ARCHIVE=zip, `ArtifactWriter` appends each step's screenshot, raw response and parsed
+actions to the task's archive as they are produced, instead of creating one file per artifact. When the task's
+artifacts are flushed, the files that agents write directly into `context/` (telemetry.json, chat_log.json,
+llm_calls.json, ...) are moved into the archive too, and an index is added as the last member, `index.json`:
+
+    {
+        "version": 1,
+        "files": {"context/step_001.png": {"offset": 1234, "size": 812345, "compressed_size": 812345, "method": "stored", "crc32": ...}, ...},
+        "steps": {"1": ["context/step_001.png", "context/step_001_raw_response.txt", ...], ...}
+    }
+
+`offset` is where the member's data starts in the archive, so one seek and one read return any step's screenshot
+or response without extracting (`TrajectoryReader`). PNGs are stored as they are; text and JSON are deflated.
+`eval_result.txt`, `distraction_result.txt` and `fail.flag` stay next to the archive, since the testbench and the
+progress tools look for them.
+
+Existing result directories are converted with
+
+    python -m utils.trajectory_archive pack --base_save_dir ./results/gpt_4o      # context/ -> trajectory.zip
+    python -m utils.trajectory_archive unpack --base_save_dir ./results/gpt_4o    # trajectory.zip -> context/
+"""
+
+import io
+import os
+import re
+import json
+import time
+import zlib
+import shutil
+import struct
+import zipfile
+import warnings
+import threading
+
+from utils.log import print_message
+
+ARCHIVE_FILENAME = 'trajectory.zip'
+INDEX_NAME = 'index.json'
+CONTEXT_DIRNAME = 'context'
+
+STEP_PATTERN = re.compile(r'step_(\d+)')
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+def get_archive_path(save_dir: str) -> str:
+    return os.path.join(save_dir, ARCHIVE_FILENAME)
+
+def trajectory_archives_enabled() -> bool:
+    mode = os.environ.get('MACOSWORLD_TRAJECTORY_ARCHIVE', 'off').strip().lower()
+    if mode not in ['zip', 'off']:
+        raise ValueError(f'MACOSWORLD_TRAJECTORY_ARCHIVE should be "zip" or "off"; got "{mode}".')
+    return mode == 'zip'
+
+
+class TrajectoryArchive:
+    """Append-only writer of one task's archive; `close` adds the index."""
+    def __init__(self, save_dir: str, truncate: bool = False):
+        self.save_dir = save_dir
+        self.path = get_archive_path(save_dir)
+        self.lock = threading.Lock()
+        mode = 'a' if os.path.exists(self.path) and not truncate else 'w'
+        self.zip_file = zipfile.ZipFile(self.path, mode)
+        # Members replaced by a later write stay in the file, but only the last one is indexed
+        if INDEX_NAME in self.zip_file.NameToInfo:
+            del self.zip_file.NameToInfo[INDEX_NAME]
+            self.zip_file.filelist = [info for info in self.zip_file.filelist if info.filename != INDEX_NAME]
+
+    def add(self, name: str, data: bytes):
+        info = zipfile.ZipInfo(name, date_time = time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED if name.endswith(('.png', '.jpg', '.jpeg', '.webp')) else zipfile.ZIP_DEFLATED
+        with self.lock, warnings.catch_warnings():
+            # A rewritten member (e.g. by a retried attempt) is appended again; the index points to the last copy
+            warnings.filterwarnings('ignore', message = 'Duplicate name')
+            self.zip_file.writestr(info, data)
+
+    def add_file(self, name: str, path: str):
+        with open(path, 'rb') as f:
+            self.add(name, f.read())
+
+    def fold_in_directory(self, directory: str, prefix: str):
+        """Move the files of `directory` into the archive under `prefix/`, then remove the directory if it is empty."""
+        if not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and not name.endswith('.tmp'):
+                self.add_file(f'{prefix}/{name}', path)
+                os.remove(path)
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass  # sub-directories or files still being written
+
+    def close(self):
+        with self.lock:
+            infos = [info for info in self.zip_file.NameToInfo.values() if info.filename != INDEX_NAME]
+            files = {}
+            steps = {}
+            self.zip_file.fp.flush()
+            with open(self.path, 'rb') as f:
+                for info in sorted(infos, key = lambda info: info.header_offset):
+                    f.seek(info.header_offset)
+                    header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+                    files[info.filename] = {
+                        "offset": info.header_offset + LOCAL_HEADER.size + header[-2] + header[-1],
+                        "size": info.file_size,
+                        "compressed_size": info.compress_size,
+                        "method": "stored" if info.compress_type == zipfile.ZIP_STORED else "deflated",
+                        "crc32": info.CRC,
+                    }
+                    match = STEP_PATTERN.search(os.path.basename(info.filename))
+                    if match:
+                        steps.setdefault(str(int(match.group(1))), []).append(info.filename)
+            index = {"version": 1, "files": files, "steps": steps}
+            # The central directory lists only the last copy of each member, like the index
+            self.zip_file.filelist = [info for info in self.zip_file.filelist if self.zip_file.NameToInfo.get(info.filename) is info]
+            info = zipfile.ZipInfo(INDEX_NAME, date_time = time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            self.zip_file.writestr(info, json.dumps(index))
+            self.zip_file.close()
+
+
+class TrajectoryReader:
+    """Random access to the members of a trajectory archive through its index."""
+    def __init__(self, path: str):
+        if os.path.isdir(path):
+            path = get_archive_path(path)
+        self.path = path
+        with zipfile.ZipFile(path) as zip_file:
+            self.index = json.loads(zip_file.read(INDEX_NAME))
+        self.file = open(path, 'rb')
+        self.lock = threading.Lock()
+
+    def names(self) -> list:
+        return list(self.index["files"])
+
+    def steps(self) -> list:
+        return sorted(int(step) for step in self.index["steps"])
+
+    def step_files(self, step: int) -> list:
+        return self.index["steps"].get(str(step), [])
+
+    def read(self, name: str) -> bytes:
+        entry = self.index["files"][name]
+        with self.lock:
+            self.file.seek(entry["offset"])
+            data = self.file.read(entry["compressed_size"])
+        if entry["method"] == "deflated":
+            data = zlib.decompress(data, -15)
+        return data
+
+    def read_step_file(self, step: int, suffix: str) -> bytes:
+        """Member `context/step_XXX<suffix>` of a step, e.g. suffix '.png' or '_raw_response.txt'; None if missing."""
+        for name in self.step_files(step):
+            if os.path.basename(name) == f'step_{str(step).zfill(3)}{suffix}':
+                return self.read(name)
+        return None
+
+    def screenshot(self, step: int):
+        from PIL import Image
+        data = self.read_step_file(step, '.png')
+        return None if data is None else Image.open(io.BytesIO(data))
+
+    def raw_response(self, step: int) -> str:
+        data = self.read_step_file(step, '_raw_response.txt')
+        return None if data is None else data.decode('utf-8')
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_task_file(save_dir: str, name: str) -> bytes:
+    """A file of a task directory, e.g. 'context/telemetry.json', from disk or from the task's archive; None if absent."""
+    path = os.path.join(save_dir, name)
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    archive_path = get_archive_path(save_dir)
+    if os.path.isfile(archive_path):
+        with TrajectoryReader(archive_path) as reader:
+            if name in reader.index["files"]:
+                return reader.read(name)
+    return None
+
+
+def iter_task_dirs(base_save_dir: str):
+    for category in sorted(os.listdir(base_save_dir)):
+        category_dir = os.path.join(base_save_dir, category)
+        if category.startswith('.') or not os.path.isdir(category_dir):
+            continue
+        for sub in sorted(os.listdir(category_dir)):
+            if os.path.isdir(os.path.join(category_dir, sub)) and len(sub.split('_')) == 3:
+                yield os.path.join(category_dir, sub)
+
+def pack_task_dir(save_dir: str) -> bool:
+    """Move `context/` of a task directory into its archive. Returns False if there is nothing to pack."""
+    context_dir = os.path.join(save_dir, CONTEXT_DIRNAME)
+    if not os.path.isdir(context_dir) or not os.listdir(context_dir):
+        return False
+    archive = TrajectoryArchive(save_dir)
+    archive.fold_in_directory(context_dir, CONTEXT_DIRNAME)
+    archive.close()
+    return True
+
+def unpack_task_dir(save_dir: str) -> bool:
+    """Restore `context/` from the archive of a task directory and delete the archive."""
+    archive_path = get_archive_path(save_dir)
+    if not os.path.isfile(archive_path):
+        return False
+    with zipfile.ZipFile(archive_path) as zip_file:
+        for name in zip_file.NameToInfo:
+            if name == INDEX_NAME:
+                continue
+            target = os.path.join(save_dir, name)
+            os.makedirs(os.path.dirname(target), exist_ok = True)
+            with zip_file.open(name) as source, open(target, 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+    os.remove(archive_path)
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Convert result directories between context/ folders and trajectory archives.')
+    parser.add_argument('action', choices = ['pack', 'unpack'])
+    parser.add_argument('--base_save_dir', type = str, required = True)
+    args = parser.parse_args()
+
+    convert = pack_task_dir if args.action == 'pack' else unpack_task_dir
+    converted = sum(convert(save_dir) for save_dir in iter_task_dirs(args.base_save_dir))
+    print_message(f'{args.action}ed {converted} task directories under {args.base_save_dir}', title = 'Trajectory Archive')
@@ -0,0 +1,228 @@
+"""
+Warm pool of EC2 environments that are reset ahead of the tasks that need them.
+
+Without a pool, every task waits for its environment to be restored from the snapshot, to come back up and to run
+`env_init_command`. With several instances (`--warm_pool_instance_ids`), `WarmPool` prepares the idle ones in the
+background for the snapshots that the upcoming tasks need, so that `lease` usually returns an environment that is
+already restored, SSH-ready and initialised. Leased environments are handed back with `release` and recycled in
+the background.
+
+How many environments are kept per snapshot follows the remaining queue: `set_demand` receives the snapshots of the
+upcoming tasks, and the pool splits its environments between the snapshots of the next `lookahead` tasks in
+proportion to their counts (e.g. mostly `snapshot_used_<lang>`, some `snapshot_usedApps_<lang>`). Ready environments
+are only reset for another snapshot once no upcoming task needs theirs.
+
+    warm_pool = WarmPool(environments, guest_username, ssh_pkey, env_init_command)
+    warm_pool.set_demand(snapshot_names_of_upcoming_tasks)
+    environment = warm_pool.lease(snapshot_name)   # blocks only if no environment is ready for this snapshot
+    ...                                             # run the task on environment.instance_id / environment.ssh_host
+    warm_pool.release(environment)
+"""
+
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.log import print_message
+from utils.ec2_fleet import get_ec2_fleet
+from utils.metrics import get_metrics
+from constants import ami_lookup_table
+
+IDLE = 'idle'              # needs a reset before use
+PREPARING = 'preparing'    # being reset to `snapshot_name`
+READY = 'ready'            # reset to `snapshot_name` and initialised
+LEASED = 'leased'
+
+WARM_POOL_LEASES_TOTAL = get_metrics().counter('macosworld_warm_pool_leases_total', 'Environment leases, by whether the environment was ready (warm), being prepared (preparing) or had to be reset (cold).', ('outcome',))
+WARM_POOL_LEASE_WAIT_SECONDS = get_metrics().histogram('macosworld_warm_pool_lease_wait_seconds', 'Time tasks waited for an environment.')
+WARM_POOL_ENVIRONMENTS = get_metrics().gauge('macosworld_warm_pool_environments', 'Environments of the warm pool, by state.', ('state',))
+
+
+class PoolEnvironment:
+    def __init__(self, instance_id: str, ssh_host: str):
+        self.instance_id = instance_id
+        self.ssh_host = ssh_host
+        self.state = IDLE
+        self.snapshot_name = None
+        self.future = None
+        self.ready_since = None
+        self.preparations = 0
+
+    def __repr__(self):
+        return f'PoolEnvironment({self.instance_id}, {self.state}, {self.snapshot_name})'
+
+
+class WarmPool:
+    def __init__(self, environments: list, guest_username: str, ssh_pkey: str, env_init_command: str, snapshot_recovery_timeout_seconds: float = 1200, lookahead: int = None, prepare_fn = None):
+        """
+        :param environments: (instance_id, ssh_host) of each instance of the pool.
+        :param lookahead:    number of upcoming tasks that pool sizes follow; defaults to four per environment.
+        :param prepare_fn:   `prepare_fn(instance_id, ssh_host, snapshot_name)` resets and initialises an environment;
+                             defaults to an EC2 root-volume replacement, an SSH wait and `env_init_command`.
+        """
+        self.environments = [PoolEnvironment(instance_id, ssh_host) for instance_id, ssh_host in environments]
+        self.guest_username = guest_username
+        self.ssh_pkey = ssh_pkey
+        self.env_init_command = env_init_command
+        self.snapshot_recovery_timeout_seconds = snapshot_recovery_timeout_seconds
+        self.lookahead = lookahead or 4 * len(self.environments)
+        self.prepare_fn = prepare_fn or self._prepare
+
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.executor = ThreadPoolExecutor(max_workers = len(self.environments), thread_name_prefix = 'warm-pool')
+        self.demand = Counter()
+        self.next_snapshot_name = None
+        self.lease_outcomes = Counter()
+
+    def _prepare(self, instance_id: str, ssh_host: str, snapshot_name: str):
+        from utils.VNCClient import VNCClient_SSH
+        start = time.monotonic()
+        get_ec2_fleet().reset(instance_id, ami_lookup_table[snapshot_name], timeout_seconds = self.snapshot_recovery_timeout_seconds).result()
+        remote_client = VNCClient_SSH(guest_username = self.guest_username, guest_password = None, ssh_host = ssh_host, ssh_pkey = self.ssh_pkey)
+        while not remote_client.check_ssh_connectivity():
+            if time.monotonic() - start > self.snapshot_recovery_timeout_seconds:
+                raise TimeoutError(f'Timeout establishing ssh connection to {ssh_host}')
+            time.sleep(10)
+        remote_client.run_ssh_command(self.env_init_command)
+
+    # Called with the lock held
+    def _start_preparing(self, environment: PoolEnvironment, snapshot_name: str):
+        environment.state = PREPARING
+        environment.snapshot_name = snapshot_name
+        environment.ready_since = None
+        environment.preparations += 1
+        environment.future = self.executor.submit(self.prepare_fn, environment.instance_id, environment.ssh_host, snapshot_name)
+        environment.future.add_done_callback(lambda future: self._on_prepared(environment, future))
+
+    def _on_prepared(self, environment: PoolEnvironment, future):
+        with self.lock:
+            if environment.future is not future or environment.state == LEASED:
+                # A lease that waits for this preparation handles its outcome
+                self.condition.notify_all()
+                return
+            error = future.exception()
+            if error is None:
+                environment.state = READY
+                environment.ready_since = time.monotonic()
+            else:
+                # Retried by the next rebalance, i.e. at the next lease or release
+                print_message(f'Preparing {environment.instance_id} for {environment.snapshot_name} failed: {type(error).__name__}: {error}', title = 'Warm Pool')
+                environment.state = IDLE
+                environment.snapshot_name = None
+            self._update_gauges()
+            self.condition.notify_all()
+
+    def _update_gauges(self):
+        counts = Counter(environment.state for environment in self.environments)
+        for state in [IDLE, PREPARING, READY, LEASED]:
+            WARM_POOL_ENVIRONMENTS.set(counts[state], state = state)
+
+    def targets(self) -> dict:
+        """Environments to keep per snapshot: the pool split in proportion to the demand, by largest remainder."""
+        total_demand = sum(self.demand.values())
+        if total_demand == 0:
+            return {}
+        size = len(self.environments)
+        shares = {snapshot_name: size * count / total_demand for snapshot_name, count in self.demand.items()}
+        targets = {snapshot_name: int(share) for snapshot_name, share in shares.items()}
+        by_remainder = sorted(shares, key = lambda snapshot_name: (shares[snapshot_name] - targets[snapshot_name], self.demand[snapshot_name]), reverse = True)
+        for snapshot_name in by_remainder[:size - sum(targets.values())]:
+            targets[snapshot_name] += 1
+        # The next task's snapshot gets at least one environment, even if it is rare in the lookahead window
+        if self.next_snapshot_name is not None and targets[self.next_snapshot_name] == 0:
+            targets[max(targets, key = targets.get)] -= 1
+            targets[self.next_snapshot_name] = 1
+        return targets
+
+    def set_demand(self, upcoming_snapshot_names: list):
+        """Snapshots of the upcoming tasks, in queue order."""
+        with self.lock:
+            self.demand = Counter(upcoming_snapshot_names[:self.lookahead])
+            self.next_snapshot_name = upcoming_snapshot_names[0] if upcoming_snapshot_names else None
+            self._rebalance()
+
+    # Called with the lock held
+    def _rebalance(self):
+        targets = self.targets()
+        held = Counter(environment.snapshot_name for environment in self.environments if environment.state in [PREPARING, READY])
+        deficits = {snapshot_name: target - held[snapshot_name] for snapshot_name, target in targets.items() if target > held[snapshot_name]}
+        # Idle environments first, then ready ones whose snapshot no upcoming task needs
+        candidates = [environment for environment in self.environments if environment.state == IDLE]
+        candidates += [environment for environment in self.environments if environment.state == READY and self.demand[environment.snapshot_name] == 0]
+        for environment in candidates:
+            if not deficits:
+                break
+            snapshot_name = max(deficits, key = lambda name: (deficits[name], self.demand[name]))
+            self._start_preparing(environment, snapshot_name)
+            deficits[snapshot_name] -= 1
+            if deficits[snapshot_name] == 0:
+                del deficits[snapshot_name]
+        self._update_gauges()
+
+    def _pick_for(self, snapshot_name: str):
+        """(environment, outcome) to lease for `snapshot_name`, or (None, None) if none is available yet. Called with the lock held."""
+        ready = [environment for environment in self.environments if environment.state == READY and environment.snapshot_name == snapshot_name]
+        if ready:
+            return min(ready, key = lambda environment: environment.ready_since), 'warm'
+        preparing = [environment for environment in self.environments if environment.state == PREPARING and environment.snapshot_name == snapshot_name]
+        if preparing:
+            return preparing[0], 'preparing'
+        # Reset the environment that is least useful to the upcoming tasks. Preparations in progress cannot be
+        # interrupted, so if all environments are being prepared for other snapshots, wait for one to finish.
+        others = [environment for environment in self.environments if environment.state in [IDLE, READY]]
+        if not others:
+            return None, None
+        victim = min(others, key = lambda environment: (environment.state != IDLE, self.demand[environment.snapshot_name]))
+        self._start_preparing(victim, snapshot_name)
+        return victim, 'cold'
+
+    def lease(self, snapshot_name: str) -> PoolEnvironment:
+        """An environment reset to `snapshot_name` and initialised; waits for its preparation if needed."""
+        start = time.monotonic()
+        with self.lock:
+            while True:
+                environment, outcome = self._pick_for(snapshot_name)
+                if environment is not None:
+                    break
+                self.condition.wait()
+            environment.state = LEASED
+            future = environment.future
+            self._update_gauges()
+        try:
+            if future is not None:
+                future.result()
+        except BaseException:
+            with self.lock:
+                environment.state = IDLE
+                environment.snapshot_name = None
+                self._update_gauges()
+                self.condition.notify_all()
+            raise
+        waited = time.monotonic() - start
+        self.lease_outcomes[outcome] += 1
+        WARM_POOL_LEASES_TOTAL.inc(outcome = outcome)
+        WARM_POOL_LEASE_WAIT_SECONDS.observe(waited)
+        print_message(f'Leased {environment.instance_id} for {snapshot_name} ({outcome}, waited {waited:.0f}s)', title = 'Warm Pool')
+        return environment
+
+    def release(self, environment: PoolEnvironment):
+        """Hand back a leased environment; it is reset in the background for the next tasks that need one."""
+        with self.lock:
+            environment.state = IDLE
+            environment.snapshot_name = None
+            environment.future = None
+            self._rebalance()
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "environments": {environment.instance_id: f'{environment.state} {environment.snapshot_name or ""}'.strip() for environment in self.environments},
+                "leases": dict(self.lease_outcomes),
+                "preparations": sum(environment.preparations for environment in self.environments),
+            }
+
+    def close(self):
+        self.executor.shutdown(wait = False)